@@ -0,0 +1,216 @@
+# Description: Historical backfill planner. Splits a multi-year date range into per-source shards sized to each site's listings, estimates their cost from earlier runs, runs them in parallel and checkpoints every finished shard so a crash resumes where it stopped.
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime, timedelta
+from functools import partial
+from itertools import zip_longest
+from concurrent.futures import ThreadPoolExecutor
+
+from browser_pool import BrowserPool
+from browser import new_driver
+from runner import SOURCES, load_config, load_source, setup_logging
+import ratelimit
+import metrics
+
+logger = logging.getLogger("backfill")
+
+DEFAULT_SETTINGS = {
+    "state_path": "/backfill.json",
+    "parallel": 4,              # Shards running at once, over every source
+    "per_source": 2,            # Shards of the same source running at once
+    "shard_days": {
+        "north_dakota": 31,     # One date-filtered listing per shard; long ranges make the recordings list slow to load
+        "south_dakota": "year", # One shard per session: every committee table holds a whole session and is read per shard
+        "us_congress": 7,       # One schedule page per day
+        "west_virginia": 366,   # A single archive page holds every recording, more shards only reload it
+    },
+    "default_seconds_per_day": 120,     # Until a shard of the source has finished or a run summary is available
+}
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def shard_range(start_date, end_date, days):
+    # [(start, end), ...] covering start_date..end_date inclusive, each at most `days` long, or each within one
+    # calendar year for "year"
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    shards = []
+    while start <= end:
+        if days == "year":
+            shard_end = min(end, datetime(start.year, 12, 31))
+        else:
+            shard_end = min(end, start + timedelta(days=days - 1))
+        shards.append((start.strftime("%Y-%m-%d"), shard_end.strftime("%Y-%m-%d")))
+        start = shard_end + timedelta(days=1)
+    return shards
+
+
+def span_days(start_date, end_date):
+    return (datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")).days + 1
+
+
+class Backfill:
+    def __init__(self, runner_config, settings=None):
+        self.runner_config = runner_config
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.settings["shard_days"] = dict(DEFAULT_SETTINGS["shard_days"], **self.settings["shard_days"])
+        self.path = self.settings["state_path"]
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, "r") as file:
+                self.state = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.state = {}
+        self.state.setdefault("shards", {})
+        self.state.setdefault("seconds_per_day", {})   # Learned from finished shards, per source
+
+    def source_config(self, name):
+        module = load_source(name)
+        config_path = self.runner_config.get("sources", {}).get(name)
+        return module, module.load_config(config_path) if config_path else module.load_config()
+
+    def plan(self, start_date, end_date, names):
+        # Shard list in run order; shards already done in an earlier invocation keep their state
+        by_source = []
+        for name in names:
+            rate = self.seconds_per_day(name)
+            shards = []
+            for start, end in shard_range(start_date, end_date, self.settings["shard_days"].get(name, 31)):
+                shard_id = f"{name}:{start}:{end}"
+                shard = self.state["shards"].setdefault(shard_id, {"source": name, "start": start, "end": end,
+                                                                   "status": PENDING})
+                shard["estimate"] = round(rate * span_days(start, end))
+                shards.append(shard_id)
+            by_source.append(shards)
+        # Round-robin over sources, so parallel slots are not all spent on one site
+        return [s for batch in zip_longest(*by_source) for s in batch if s is not None]
+
+    def seconds_per_day(self, name):
+        # Finished shards of this backfill first, then the last run summary of the source, then the default
+        if name in self.state["seconds_per_day"]:
+            return self.state["seconds_per_day"][name]
+        try:
+            _, config = self.source_config(name)
+            with open(config.get("metrics_summary_path") or self.runner_config["metrics_summary_path"], "r") as file:
+                stages = json.load(file)["sources"][name]["stages"]
+            # Stages overlap (downloads run while the crawl goes on), so the longest one approximates the run
+            busiest = max(stage["total"] for stage in stages.values())
+            return busiest / span_days(config["start_date"], config["end_date"])
+        except (OSError, KeyError, ValueError, TypeError):
+            return self.settings["default_seconds_per_day"]
+
+    def checkpoint(self, shard_id, **changes):
+        # Write to a temp file first so a crash never leaves a half-written state behind
+        with self.lock:
+            self.state["shards"][shard_id].update(changes)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.state, file, indent=4)
+            os.replace(tmp_path, self.path)
+
+    def run_shard(self, shard_id, browsers, slots):
+        shard = self.state["shards"][shard_id]
+        name = shard["source"]
+        shard_logger = logging.getLogger(name)
+        with slots[name]:
+            module, config = self.source_config(name)
+            # The shard's own range, without the incremental watermark that would move its start date
+            config = dict(config, start_date=shard["start"], end_date=shard["end"], incremental=False)
+            self.checkpoint(shard_id, status=RUNNING, started=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+            shard_logger.info(f"Backfilling {shard['start']} to {shard['end']} (estimated {shard['estimate'] / 60:.0f} min)")
+            started = time.time()
+            try:
+                # Sources whose listing depends on the period (an SD session) adjust the config to the shard
+                if hasattr(module, "shard_config"):
+                    config = module.shard_config(config)
+                module.run(config, browsers, shard_logger)
+            except Exception as e:
+                shard_logger.exception(f"Shard {shard_id} failed: {e}")
+                metrics.inc("scraper_backfill_shards_total", name, outcome=FAILED)
+                self.checkpoint(shard_id, status=FAILED, error=str(e))
+                return False
+
+            elapsed = time.time() - started
+            with self.lock:
+                # Moving average, so the estimates of the remaining shards follow what the site really costs
+                rate = elapsed / span_days(shard["start"], shard["end"])
+                previous = self.state["seconds_per_day"].get(name)
+                self.state["seconds_per_day"][name] = rate if previous is None else 0.7 * previous + 0.3 * rate
+            metrics.inc("scraper_backfill_shards_total", name, outcome=DONE)
+            self.checkpoint(shard_id, status=DONE, elapsed=round(elapsed, 1), error=None)
+            shard_logger.info(f"Shard {shard_id} done in {elapsed / 60:.1f} min")
+            return True
+
+    def run(self, shard_ids, browsers):
+        # Done shards are skipped; running ones were cut off by a crash and start again (the ledger skips
+        # whatever they had already downloaded)
+        todo = [s for s in shard_ids if self.state["shards"][s]["status"] != DONE]
+        logger.info(f"{len(shard_ids) - len(todo)}/{len(shard_ids)} shards already done, "
+                    f"{sum(self.state['shards'][s]['estimate'] for s in todo) / 3600:.1f} h estimated for the rest")
+        slots = {name: threading.Semaphore(self.settings["per_source"]) for name in SOURCES}
+        with ThreadPoolExecutor(max_workers=self.settings["parallel"], thread_name_prefix="backfill") as executor:
+            results = list(executor.map(partial(self.run_shard, browsers=browsers, slots=slots), todo))
+        return results.count(False)
+
+
+def print_plan(backfill, shard_ids):
+    total = 0
+    for shard_id in shard_ids:
+        shard = backfill.state["shards"][shard_id]
+        total += shard["estimate"] if shard["status"] != DONE else 0
+        print(f"{shard_id:45} {shard['status']:8} ~{shard['estimate'] / 60:7.1f} min")
+    parallel = backfill.settings["parallel"]
+    print(f"{len(shard_ids)} shards, {total / 3600:.1f} h of work left, about {total / 3600 / parallel:.1f} h "
+          f"with {parallel} in parallel")
+
+
+# Usage: python backfill.py plan|run <start> <end> [source ...] [--parallel N] [--config /config_runner.json]
+def main():
+    parser = argparse.ArgumentParser(description="Shard and run a historical backfill")
+    parser.add_argument("command", choices=["plan", "run"])
+    parser.add_argument("start_date")
+    parser.add_argument("end_date")
+    parser.add_argument("sources", nargs="*")
+    parser.add_argument("--parallel", type=int)
+    parser.add_argument("--config", default="/config_runner.json")
+    args = parser.parse_args()
+
+    runner_config = load_config(args.config)
+    settings = dict(runner_config.get("backfill") or {})
+    if args.parallel:
+        settings["parallel"] = args.parallel
+    backfill = Backfill(runner_config, settings)
+    names = args.sources or list(runner_config.get("sources", SOURCES))
+    shard_ids = backfill.plan(args.start_date, args.end_date, names)
+
+    if args.command == "plan":
+        print_plan(backfill, shard_ids)
+        return
+
+    setup_logging(runner_config["log_path"])
+    ratelimit.configure(runner_config.get("rate_limits"))
+    server = metrics.start(runner_config)
+    browsers = BrowserPool(partial(new_driver, runner_config.get("browser"), runner_config.get("chromedriver_path")),
+                           size=runner_config.get("browser_pool_size", 2))
+    try:
+        failed = backfill.run(shard_ids, browsers)
+    finally:
+        browsers.close()
+        metrics.finish(runner_config, server)
+    if failed:
+        logger.info(f"{failed} shards failed, run the same command again to retry them")
+        sys.exit(1)
+    logger.info("Backfill complete")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+# Description: Local stand-in for the four legislature sites. Serves the recorded listing pages under benchmarks/fixtures and a fake media origin (HLS, MP3, MP4) generated once with ffmpeg.
+import os
+import re
+import sys
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+from string import Template
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Start times shown on the ND event pages, matching the recorded event list
+ND_EVENT_TIMES = {"1001": "8:30 AM", "1002": "1:00 PM", "1003": "9:00 AM", "1004": "2:30 PM"}
+
+CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".mp3": "audio/mpeg",
+    ".mp4": "video/mp4",
+}
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-STREAM-INF:BANDWIDTH=400000,RESOLUTION=320x240,CODECS="avc1.42c00d,mp4a.40.2"
+media.m3u8
+"""
+
+
+def prepare_media(media_dir, seconds=60):
+    # Every event shares one generated recording; it is only rebuilt when the requested length changes
+    stamp_path = os.path.join(media_dir, "seconds")
+    if os.path.exists(stamp_path):
+        with open(stamp_path, "r") as file:
+            if file.read() == str(seconds):
+                return media_dir
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError("ffmpeg is required to generate the fixture media")
+
+    hls_dir = os.path.join(media_dir, "hls")
+    shutil.rmtree(media_dir, ignore_errors=True)
+    os.makedirs(hls_dir)
+
+    video = ["-f", "lavfi", "-i", f"testsrc=size=320x240:rate=15:duration={seconds}",
+             "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}"]
+    encode = ["-c:v", "libx264", "-preset", "ultrafast", "-g", "60", "-c:a", "aac", "-b:a", "64k"]
+    commands = [
+        ["ffmpeg", "-y", *video, *encode, "-f", "hls", "-hls_time", "4", "-hls_list_size", "0",
+         "-hls_segment_filename", os.path.join(hls_dir, "seg_%04d.ts"), os.path.join(hls_dir, "media.m3u8")],
+        ["ffmpeg", "-y", *video, *encode, "-movflags", "+faststart", os.path.join(media_dir, "video.mp4")],
+        ["ffmpeg", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+         "-c:a", "libmp3lame", "-b:a", "64k", os.path.join(media_dir, "audio.mp3")],
+    ]
+    for command in commands:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    with open(os.path.join(hls_dir, "master.m3u8"), "w") as file:
+        file.write(MASTER_PLAYLIST)
+    with open(stamp_path, "w") as file:
+        file.write(str(seconds))
+    return media_dir
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # Keep-alive, like the real origins
+
+    def do_GET(self):
+        # Optional fixed latency on every request, to look more like the live sites
+        if self.server.delay:
+            time.sleep(self.server.delay)
+
+        path = self.path.split("?")[0]
+        with self.server.log_lock:
+            self.server.requests.append(path)
+        for pattern, handler in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match:
+                return handler(self, *match.groups())
+        self.send_error(404)
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_template(self, relative_path, **values):
+        with open(os.path.join(FIXTURES_DIR, relative_path), "r") as file:
+            html = Template(file.read()).safe_substitute(values)
+        self.send_body(html.encode("utf-8"), CONTENT_TYPES[".html"])
+
+    def send_file(self, path):
+        if not os.path.exists(path):
+            return self.send_error(404)
+        with open(path, "rb") as file:
+            body = file.read()
+        content_type = CONTENT_TYPES.get(os.path.splitext(path)[1], "application/octet-stream")
+
+        # Single byte ranges, enough for resumed downloads and head-of-file probes
+        match = re.fullmatch(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) if match.group(2) else len(body) - 1, len(body) - 1)
+            return self.send_body(body[start:end + 1], content_type, 206,
+                                  {"Content-Range": f"bytes {start}-{end}/{len(body)}", "Accept-Ranges": "bytes"})
+        self.send_body(body, content_type, headers={"Accept-Ranges": "bytes"})
+
+    # Sites
+    def nd_index(self):
+        self.send_template("north_dakota/index.html")
+
+    def nd_list(self):
+        self.send_template("north_dakota/list.html")
+
+    def nd_event(self, event_id):
+        self.send_template("north_dakota/event.html", event_id=event_id, event_time=ND_EVENT_TIMES.get(event_id, "9:00 AM"))
+
+    def sd_committees(self):
+        self.send_template("south_dakota/committees.html")
+
+    def sd_committee(self, committee_id):
+        self.send_template("south_dakota/committee.html", committee_id=committee_id)
+
+    def sd_minutes(self, committee_id):
+        self.send_template("south_dakota/minutes.html", committee_id=committee_id)
+
+    def us_schedule(self):
+        self.send_template("us_congress/schedule.html")
+
+    def us_event(self, event_id):
+        self.send_template("us_congress/event.html", event_id=event_id)
+
+    def wv_archive(self):
+        self.send_template("west_virginia/archive.html")
+
+    # Media origin
+    def hls(self, name, filename):
+        self.send_file(os.path.join(self.server.media_dir, "hls", filename))
+
+    def media(self, name, extension):
+        self.send_file(os.path.join(self.server.media_dir, "audio.mp3" if extension == "mp3" else "video.mp4"))
+
+
+ROUTES = [
+    (r"/nd/", FixtureHandler.nd_index),
+    (r"/nd/list\.html", FixtureHandler.nd_list),
+    (r"/nd/event/(\d+)", FixtureHandler.nd_event),
+    (r"/sd/committees", FixtureHandler.sd_committees),
+    (r"/sd/committee/(\d+)", FixtureHandler.sd_committee),
+    (r"/sd/committee/(\d+)/minutes\.html", FixtureHandler.sd_minutes),
+    (r"/us/daily/\d{4}/\d{2}/\d{2}", FixtureHandler.us_schedule),
+    (r"/us/event/(\d+)", FixtureHandler.us_event),
+    (r"/wv/archived-recordings/", FixtureHandler.wv_archive),
+    (r"/hls/([\w-]+)/(master\.m3u8|media\.m3u8|seg_\d+\.ts)", FixtureHandler.hls),
+    (r"/media/([\w-]+)\.(mp3|mp4)", FixtureHandler.media),
+]
+
+
+class FixtureServer:
+    def __init__(self, media_dir, port=0, delay=0.0):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.media_dir = media_dir
+        self.httpd.delay = delay
+        self.httpd.requests = []      # Every path served, in order; tests count fetches with it
+        self.httpd.log_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="fixture-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+# Usage: python benchmarks/fixture_server.py [--port 8800] [--media-dir DIR] [--media-seconds 60]
+def main():
+    parser = argparse.ArgumentParser(description="Serve the benchmark fixture sites")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--media-dir", default="/tmp/scraper_bench_media")
+    parser.add_argument("--media-seconds", type=int, default=60)
+    parser.add_argument("--delay-ms", type=int, default=0)
+    args = parser.parse_args()
+
+    prepare_media(args.media_dir, args.media_seconds)
+    server = FixtureServer(args.media_dir, args.port, args.delay_ms / 1000)
+    print(f"Serving fixtures on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+        sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
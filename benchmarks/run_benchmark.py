@@ -0,0 +1,221 @@
+# Description: Offline benchmark. Runs each scraper end-to-end against the local fixture server and reports events/sec, time per stage, peak RSS and browser count, so runs can be compared.
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from functools import partial
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import metrics
+import runner
+from browser_pool import BrowserPool
+from browser import new_driver
+from fixture_server import FixtureServer, prepare_media
+
+# Repo config each source starts from, and the overrides that point it at the fixture server
+CONFIG_FILES = {
+    "north_dakota": "config_nd.json",
+    "south_dakota": "config_sd.json",
+    "us_congress": "config_us.json",
+    "west_virginia": "config_wv.json",
+}
+SITE_SETTINGS = {
+    "north_dakota": {"start_date": "2025-03-17", "end_date": "2025-03-17", "home_url": "{base}/nd/"},
+    "south_dakota": {"start_date": "2025-03-10", "end_date": "2025-03-11", "committee_list_url": "{base}/sd/committees"},
+    "us_congress": {"start_date": "2025-03-06", "end_date": "2025-03-06", "schedule_url": "{base}/us/daily/{{date}}"},
+    "west_virginia": {"start_date": "2025-03-10", "end_date": "2025-03-11", "archive_url": "{base}/wv/archived-recordings/"},
+}
+
+
+def make_config(name, base_url, work_dir):
+    with open(os.path.join(ROOT, CONFIG_FILES[name]), "r") as file:
+        config = json.load(file)
+
+    source_dir = os.path.join(work_dir, name)
+    os.makedirs(source_dir, exist_ok=True)
+    output_dir = source_dir + "/"     # The scrapers concatenate the title onto this
+    config.update({
+        "output_path": output_dir,
+        "download_path": output_dir,
+        "success_failed_path": source_dir,
+        "success_download_json_path": os.path.join(source_dir, "success_list.json"),
+        "failed_download_json_path": os.path.join(source_dir, "failed_list.json"),
+        "ledger_path": os.path.join(source_dir, "ledger.db"),
+        "log_path": os.path.join(source_dir, f"{name}.log"),
+        "watermark_path": os.path.join(source_dir, "watermark.json"),
+        "incremental": False,
+        "dedup": False,     # Every fixture event serves the same media bytes
+        "metrics_port": None,
+        "metrics_summary_path": None,
+        "storage": {"backend": "none"},
+        # The fixture server is local, pacing it would only measure the limiter
+        "rate_limits": {"hosts": {"127.0.0.1": {"rps": 1000, "burst": 1000, "concurrency": 64}}},
+    })
+    for key, value in SITE_SETTINGS[name].items():
+        config[key] = value.format(base=base_url)
+    return config
+
+
+def process_tree_rss(pid):
+    # Resident memory of a process and all its descendants (Chrome, chromedriver, ffmpeg, yt-dlp), in bytes
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as file:
+                ppid = int(file.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total, stack = 0, [pid]
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/statm", "r") as file:
+                total += int(file.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            pass
+        stack.extend(children.get(current, []))
+    return total
+
+
+class RssSampler:
+    def __init__(self, interval=0.25):
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, name="rss-sampler", daemon=True)
+
+    def _sample(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, process_tree_rss(os.getpid()))
+            self.stopped.wait(self.interval)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.peak
+
+
+def counter_total(summary, prefix):
+    return sum(value for source in summary["sources"].values()
+               for key, value in source["counters"].items() if key.startswith(prefix))
+
+
+def run_source(name, config, browser_factory, pool_size):
+    # One source at a time, with its own browser pool and a clean set of metrics
+    metrics.reset()
+    logger = logging.getLogger(name)
+    module = runner.load_source(name)
+    browsers = BrowserPool(browser_factory, size=pool_size)
+    sampler = RssSampler().start()
+
+    started = time.time()
+    error = None
+    try:
+        module.run(config, browsers, logger)
+    except Exception as e:
+        logger.exception(f"Benchmark run of {name} failed: {e}")
+        error = str(e)
+    finally:
+        browsers.close()
+    elapsed = time.time() - started
+    peak_rss = sampler.stop()
+
+    summary = metrics.summary()
+    events = counter_total(summary, "scraper_downloads_total")
+    stages = summary["sources"].get(name, {}).get("stages", {})
+    shared = summary["sources"].get("all", {}).get("stages", {})
+    return {
+        "elapsed": round(elapsed, 3),
+        "events": events,
+        "events_per_sec": round(events / elapsed, 4) if elapsed else 0,
+        "downloads_ok": counter_total(summary, "scraper_downloads_total[outcome=success]"),
+        "stages": dict(shared, **stages),
+        "peak_rss_mb": round(peak_rss / 1024 / 1024, 1),
+        "browsers": counter_total(summary, "scraper_browsers_launched_total"),
+        "error": error,
+    }
+
+
+def print_report(results, baseline=None):
+    for name, result in results.items():
+        print(f"\n== {name} ==")
+        line = (f"{result['events']} events in {result['elapsed']:.2f}s ({result['events_per_sec']:.3f}/s), "
+                f"{result['downloads_ok']} downloaded, peak RSS {result['peak_rss_mb']} MB, {result['browsers']} browsers")
+        previous = (baseline or {}).get(name)
+        if previous and previous.get("elapsed"):
+            change = (result["elapsed"] - previous["elapsed"]) / previous["elapsed"] * 100
+            line += f" [elapsed {change:+.1f}% vs baseline]"
+        print(line)
+        if result["error"]:
+            print(f"  error: {result['error']}")
+        for stage_name, stage in sorted(result["stages"].items()):
+            print(f"  {stage_name:<36} n={stage['count']:<4} total={stage['total']:>8.3f}s  mean={stage['mean']:>7.3f}s  max={stage['max']:>7.3f}s")
+
+
+# Usage: python benchmarks/run_benchmark.py [source ...] [--output results.json] [--compare baseline.json]
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers against recorded fixture sites")
+    parser.add_argument("sources", nargs="*", default=list(CONFIG_FILES))
+    parser.add_argument("--chromedriver", default="/chromedriver")
+    parser.add_argument("--browser-pool-size", type=int, default=2)
+    parser.add_argument("--headed", action="store_true", help="Show the Chrome windows")
+    parser.add_argument("--media-dir", default=os.path.join(tempfile.gettempdir(), "scraper_bench_media"))
+    parser.add_argument("--media-seconds", type=int, default=60)
+    parser.add_argument("--delay-ms", type=int, default=0, help="Latency added to every fixture request")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the downloaded files and logs")
+    args = parser.parse_args()
+
+    for name in args.sources:
+        runner.load_source(name)    # Fail fast on a typo
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    prepare_media(args.media_dir, args.media_seconds)
+    server = FixtureServer(args.media_dir, delay=args.delay_ms / 1000).start()
+    work_dir = tempfile.mkdtemp(prefix="scraper_bench_")
+
+    results = {}
+    try:
+        for name in args.sources:
+            config = make_config(name, server.base_url, work_dir)
+            # The source's own browser profile, only made visible with --headed
+            profile = dict(config.get("browser") or {}, **({"headless": False} if args.headed else {}))
+            results[name] = run_source(name, config, partial(new_driver, profile, args.chromedriver),
+                                       args.browser_pool_size)
+    finally:
+        server.stop()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)["results"]
+    print_report(results, baseline)
+    if args.keep:
+        print(f"\nFiles and logs kept in {work_dir}")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"date": time.strftime("%Y-%m-%d %H:%M:%S"), "args": vars(args), "results": results}, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# Description: Tests for the backfill planner: shard boundaries, per-session South Dakota shards and shard checkpoints.
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import importlib.util
+from types import SimpleNamespace
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HAS_SELENIUM = importlib.util.find_spec("selenium") is not None
+if HAS_SELENIUM:
+    import backfill
+    import south_dakota
+
+SESSION_URL = "https://sdlegislature.gov/Session/Committee/1231/Minutes"
+
+
+@unittest.skipUnless(HAS_SELENIUM, "backfill and the scrapers import selenium")
+class ShardRangeTest(unittest.TestCase):
+    def test_fixed_length_shards(self):
+        self.assertEqual(backfill.shard_range("2025-01-01", "2025-01-20", 7),
+                         [("2025-01-01", "2025-01-07"), ("2025-01-08", "2025-01-14"), ("2025-01-15", "2025-01-20")])
+
+    def test_year_shards(self):
+        self.assertEqual(backfill.shard_range("2022-11-01", "2025-03-10", "year"),
+                         [("2022-11-01", "2022-12-31"), ("2023-01-01", "2023-12-31"), ("2024-01-01", "2024-12-31"),
+                          ("2025-01-01", "2025-03-10")])
+
+
+@unittest.skipUnless(HAS_SELENIUM, "backfill and the scrapers import selenium")
+class SouthDakotaShardTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="backfill_test_")
+        self.runs = []
+        self.source = SimpleNamespace(
+            load_config=lambda path=None: {"start_date": "2025-03-10", "end_date": "2025-03-11",
+                                           "committee_list_url": SESSION_URL, "session_year": 2025,
+                                           "sessions": {"2025": SESSION_URL}},
+            shard_config=south_dakota.shard_config,
+            run=lambda config, browsers, logger: self.runs.append(config),
+        )
+        self.backfill = backfill.Backfill({"sources": {}}, {"state_path": os.path.join(self.work_dir, "state.json")})
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def run_backfill(self, start, end):
+        with mock.patch("backfill.load_source", return_value=self.source):
+            shard_ids = self.backfill.plan(start, end, ["south_dakota"])
+            failed = self.backfill.run(shard_ids, browsers=None)
+        return shard_ids, failed
+
+    def test_one_shard_per_session_year(self):
+        shard_ids, failed = self.run_backfill("2024-06-01", "2025-03-11")
+        self.assertEqual(shard_ids, ["south_dakota:2024-06-01:2024-12-31", "south_dakota:2025-01-01:2025-03-11"])
+        self.assertEqual(failed, 1)
+
+        # The 2025 shard reads the 2025 session, with its own dates and no watermark
+        self.assertEqual(len(self.runs), 1)
+        self.assertEqual((self.runs[0]["start_date"], self.runs[0]["end_date"]), ("2025-01-01", "2025-03-11"))
+        self.assertEqual((self.runs[0]["committee_list_url"], self.runs[0]["session_year"]), (SESSION_URL, 2025))
+        self.assertFalse(self.runs[0]["incremental"])
+
+        # A year with no session configured fails instead of being checkpointed as done
+        with open(os.path.join(self.work_dir, "state.json"), "r") as file:
+            shards = json.load(file)["shards"]
+        self.assertEqual(shards[shard_ids[0]]["status"], backfill.FAILED)
+        self.assertIn("2024", shards[shard_ids[0]]["error"])
+        self.assertEqual(shards[shard_ids[1]]["status"], backfill.DONE)
+
+    def test_rerun_only_retries_failed_shards(self):
+        self.run_backfill("2024-06-01", "2025-03-11")
+        self.runs.clear()
+        self.source.load_config = lambda path=None: {"start_date": "2025-03-10", "end_date": "2025-03-11",
+                                                     "sessions": {"2024": "https://sd/2024", "2025": SESSION_URL}}
+        _, failed = self.run_backfill("2024-06-01", "2025-03-11")
+        self.assertEqual(failed, 0)
+        self.assertEqual([(c["start_date"], c["committee_list_url"], c["session_year"]) for c in self.runs],
+                         [("2024-06-01", "https://sd/2024", 2024)])
+
+    def test_failing_run_keeps_shard_failed(self):
+        def failing_run(config, browsers, logger):
+            raise RuntimeError("2 committees could not be read")
+        self.source.run = failing_run
+        shard_ids, failed = self.run_backfill("2025-01-01", "2025-03-11")
+        self.assertEqual(failed, 1)
+        self.assertEqual(self.backfill.state["shards"][shard_ids[0]]["status"], backfill.FAILED)
+
+
+if __name__ == "__main__":
+    unittest.main()
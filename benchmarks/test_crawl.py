@@ -0,0 +1,65 @@
+# Description: Tests for the shared scraper run frame: incremental start date and teardown when the crawl fails.
+import os
+import sys
+import shutil
+import tempfile
+import logging
+import unittest
+import importlib.util
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HAS_SELENIUM = importlib.util.find_spec("selenium") is not None
+if HAS_SELENIUM:
+    from crawl import crawl
+
+logger = logging.getLogger("test_crawl")
+
+
+@unittest.skipUnless(HAS_SELENIUM, "crawl reports wait savings from waits, which imports selenium")
+class CrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="crawl_test_")
+        self.config = {"start_date": "2025-01-01", "end_date": "2025-03-31", "incremental": True,
+                       "watermark_path": os.path.join(self.work_dir, "watermark.json")}
+        self.pool, self.dedup, self.ledger = mock.Mock(), mock.Mock(), mock.Mock()
+        patcher = mock.patch("crawl.make_pool", return_value=(self.pool, self.dedup))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_complete_run_moves_the_start_date(self):
+        with crawl(self.config, "west_virginia", self.ledger, logger) as run_state:
+            self.assertEqual(run_state.start_date, "2025-01-01")
+            run_state.complete("2025-03-31")
+        with crawl(self.config, "west_virginia", self.ledger, logger) as run_state:
+            self.assertEqual(run_state.start_date, "2025-04-01")
+
+    def test_failed_crawl_still_tears_down(self):
+        with self.assertRaises(RuntimeError):
+            with crawl(self.config, "west_virginia", self.ledger, logger) as run_state:
+                run_state.pool.submit({"title": "a.mp3"})
+                raise RuntimeError("listing page changed")
+        self.pool.join.assert_called_once()
+        self.dedup.close.assert_called_once()
+        self.ledger.close.assert_called_once()
+        # Nothing was marked complete, the next run starts over
+        with crawl(self.config, "west_virginia", self.ledger, logger) as run_state:
+            self.assertEqual(run_state.start_date, "2025-01-01")
+
+    def test_lent_pool_is_left_to_its_owner(self):
+        lent = mock.Mock()
+        with self.assertRaises(RuntimeError):
+            with crawl(self.config, "west_virginia", self.ledger, logger, pool=lent) as run_state:
+                self.assertIs(run_state.pool, lent)
+                raise RuntimeError("listing page changed")
+        lent.join.assert_not_called()
+        self.ledger.close.assert_called_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
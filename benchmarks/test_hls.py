@@ -0,0 +1,246 @@
+# Description: Tests for the native HLS engine against the fixture server: playlist parsing, parallel segment fetch, resume from the manifest, parts split at discontinuities and the final remux.
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from hls import parse_playlist, download_hls, remux, HlsUnsupported, PlaylistError
+from fixture_server import FixtureServer, prepare_media, MASTER_PLAYLIST
+
+SEGMENTS = 12
+HAS_FFMPEG = shutil.which("ffmpeg") is not None and shutil.which("ffprobe") is not None
+
+
+def write_fixture_playlist(media_dir, discontinuity_at=None):
+    # Synthetic media playlist with distinct bytes per segment, so the joined output shows order and completeness
+    hls_dir = os.path.join(media_dir, "hls")
+    os.makedirs(hls_dir)
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0"]
+    segments = []
+    for i in range(SEGMENTS):
+        body = f"segment {i}\n".encode() * 100
+        with open(os.path.join(hls_dir, f"seg_{i:04d}.ts"), "wb") as file:
+            file.write(body)
+        if i == discontinuity_at:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines += ["#EXTINF:4.0,", f"seg_{i:04d}.ts"]
+        segments.append(body)
+    lines.append("#EXT-X-ENDLIST")
+    with open(os.path.join(hls_dir, "media.m3u8"), "w") as file:
+        file.write("\n".join(lines) + "\n")
+    with open(os.path.join(hls_dir, "master.m3u8"), "w") as file:
+        file.write(MASTER_PLAYLIST)
+    return segments
+
+
+def copy_remux(input_path, output_path):
+    # Stand-in for ffmpeg in the transfer tests; the remux has its own test
+    shutil.copyfile(input_path, output_path)
+
+
+def json_remux_parts(input_paths, output_path):
+    # Stand-in for the concat remux that keeps the parts apart, to show where the output was split
+    parts = []
+    for path in input_paths:
+        with open(path, "rb") as file:
+            parts.append(file.read().decode())
+    with open(output_path, "w") as file:
+        json.dump(parts, file)
+
+
+class PlaylistParsingTest(unittest.TestCase):
+    def test_master_playlist(self):
+        playlist = parse_playlist(MASTER_PLAYLIST, "http://origin/hls/x/master.m3u8")
+        self.assertEqual(len(playlist["variants"]), 1)
+        variant = playlist["variants"][0]
+        self.assertEqual(variant["uri"], "http://origin/hls/x/media.m3u8")
+        self.assertEqual(variant["bandwidth"], 400000)
+        self.assertEqual(variant["resolution"], "320x240")
+
+    def test_media_playlist(self):
+        text = "\n".join([
+            "#EXTM3U", "#EXT-X-TARGETDURATION:6", "#EXT-X-MEDIA-SEQUENCE:42", '#EXT-X-MAP:URI="init.mp4"',
+            "#EXTINF:6.0,", "a.m4s", "#EXTINF:5.5,", "https://cdn/b.m4s", "#EXT-X-ENDLIST",
+        ])
+        playlist = parse_playlist(text, "http://origin/live/media.m3u8")
+        self.assertEqual(playlist["media_sequence"], 42)
+        self.assertEqual(playlist["target_duration"], 6.0)
+        self.assertEqual(playlist["init"], "http://origin/live/init.mp4")
+        self.assertTrue(playlist["endlist"])
+        self.assertEqual([s["uri"] for s in playlist["segments"]], ["http://origin/live/a.m4s", "https://cdn/b.m4s"])
+        self.assertEqual([s["duration"] for s in playlist["segments"]], [6.0, 5.5])
+
+    def test_audio_rendition(self):
+        text = '#EXTM3U\n#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",NAME="en",DEFAULT=YES,URI="audio/en.m3u8"\n'
+        playlist = parse_playlist(text, "http://origin/master.m3u8")
+        self.assertEqual(playlist["audio"], [{"uri": "http://origin/audio/en.m3u8", "default": True}])
+
+    def test_unsupported_and_invalid(self):
+        with self.assertRaises(HlsUnsupported):
+            parse_playlist('#EXTM3U\n#EXT-X-KEY:METHOD=AES-128,URI="k"\n#EXTINF:4,\na.ts\n', "http://origin/m.m3u8")
+        with self.assertRaises(PlaylistError):
+            parse_playlist("<html>not a playlist</html>", "http://origin/m.m3u8")
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="hls_test_")
+        self.segments = write_fixture_playlist(os.path.join(self.work_dir, "media"))
+        self.server = FixtureServer(os.path.join(self.work_dir, "media"), delay=0.1).start()
+        self.url = f"{self.server.base_url}/hls/test/master.m3u8"
+        self.output_path = os.path.join(self.work_dir, "out.mp4")
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def segment_requests(self):
+        return sorted(p for p in self.server.httpd.requests if p.endswith(".ts"))
+
+    def test_parallel_fetch(self):
+        started = time.time()
+        with mock.patch("hls.remux", copy_remux):
+            download_hls(self.url, self.output_path, workers=6)
+        elapsed = time.time() - started
+
+        with open(self.output_path, "rb") as file:
+            self.assertEqual(file.read(), b"".join(self.segments))
+        self.assertEqual(len(self.segment_requests()), SEGMENTS)
+        # 12 segments at 100 ms each take 1.2 s one after another; six at a time take about 0.2 s
+        self.assertLess(elapsed, SEGMENTS * 0.1 * 0.6)
+        self.assertFalse(os.path.exists(self.output_path + ".parts"))
+
+    def test_resume_from_manifest(self):
+        # A previous run stored the first half before it was interrupted
+        parts_dir = self.output_path + ".parts"
+        os.makedirs(parts_dir)
+        done = list(range(SEGMENTS // 2))
+        for i in done:
+            with open(os.path.join(parts_dir, f"seg_{i:06d}"), "wb") as file:
+                file.write(self.segments[i])
+        media_url = f"{self.server.base_url}/hls/test/media.m3u8"
+        with open(os.path.join(parts_dir, "manifest.json"), "w") as file:
+            json.dump({"playlist": media_url, "done": done}, file)
+
+        with mock.patch("hls.remux", copy_remux):
+            download_hls(self.url, self.output_path, workers=4)
+
+        with open(self.output_path, "rb") as file:
+            self.assertEqual(file.read(), b"".join(self.segments))
+        fetched = [int(os.path.basename(p)[4:8]) for p in self.segment_requests()]
+        self.assertEqual(fetched, list(range(SEGMENTS // 2, SEGMENTS)))
+
+    def test_resume_from_manifest_log(self):
+        # The manifest was written at the start of the interrupted run, its segments went to the log
+        parts_dir = self.output_path + ".parts"
+        os.makedirs(parts_dir)
+        for i in range(SEGMENTS // 2):
+            with open(os.path.join(parts_dir, f"seg_{i:06d}"), "wb") as file:
+                file.write(self.segments[i])
+        media_url = f"{self.server.base_url}/hls/test/media.m3u8"
+        with open(os.path.join(parts_dir, "manifest.json"), "w") as file:
+            json.dump({"playlist": media_url, "done": [0, 1]}, file)
+        with open(os.path.join(parts_dir, "manifest.json.log"), "w") as file:
+            file.write("2\n3\n4\n5\n1")     # Cut off mid-line by the crash
+
+        with mock.patch("hls.remux", copy_remux):
+            download_hls(self.url, self.output_path, workers=4, keep_parts=True)
+
+        fetched = [int(os.path.basename(p)[4:8]) for p in self.segment_requests()]
+        self.assertEqual(fetched, list(range(SEGMENTS // 2, SEGMENTS)))
+        # The old log was folded into the manifest, this run's segments were appended to a new one
+        with open(os.path.join(parts_dir, "manifest.json"), "r") as file:
+            self.assertEqual(json.load(file)["done"], list(range(SEGMENTS // 2)))
+        with open(os.path.join(parts_dir, "manifest.json.log"), "r") as file:
+            self.assertEqual(sorted(int(line) for line in file), list(range(SEGMENTS // 2, SEGMENTS)))
+
+    def test_manifest_of_another_playlist_is_ignored(self):
+        parts_dir = self.output_path + ".parts"
+        os.makedirs(parts_dir)
+        with open(os.path.join(parts_dir, "manifest.json"), "w") as file:
+            json.dump({"playlist": "http://elsewhere/media.m3u8", "done": [0, 1, 2]}, file)
+
+        with mock.patch("hls.remux", copy_remux):
+            download_hls(self.url, self.output_path, workers=4)
+        self.assertEqual(len(self.segment_requests()), SEGMENTS)
+
+
+class DiscontinuityTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="hls_test_")
+        self.segments = write_fixture_playlist(os.path.join(self.work_dir, "media"), discontinuity_at=5)
+        self.server = FixtureServer(os.path.join(self.work_dir, "media")).start()
+        self.url = f"{self.server.base_url}/hls/test/master.m3u8"
+        self.output_path = os.path.join(self.work_dir, "out.mp4")
+        self.expected = [b"".join(self.segments[:5]).decode(), b"".join(self.segments[5:]).decode()]
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_parts_are_remuxed_apart(self):
+        with mock.patch("hls.remux", copy_remux), mock.patch("hls.remux_parts", json_remux_parts):
+            download_hls(self.url, self.output_path, workers=4)
+        with open(self.output_path, "r") as file:
+            self.assertEqual(json.load(file), self.expected)
+
+    def test_parts_are_uploaded_once_joined(self):
+        uploaded = []
+
+        def upload(stream, check):
+            uploaded.append(json.loads(stream.read()))
+            return "s3://bucket/out.mp4"
+
+        with mock.patch("hls.remux_parts", json_remux_parts):
+            stored_at = download_hls(self.url, self.output_path, workers=4, upload=upload)
+        self.assertEqual((stored_at, uploaded), ("s3://bucket/out.mp4", [self.expected]))
+        self.assertFalse(os.path.exists(self.output_path + ".parts"))
+
+
+@unittest.skipUnless(HAS_FFMPEG, "ffmpeg and ffprobe are needed for the remux tests")
+class RemuxTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="hls_remux_")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def probe(self, path):
+        result = subprocess.run(["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path],
+                                capture_output=True, text=True, check=True)
+        return json.loads(result.stdout)
+
+    def test_download_and_remux_fixture_media(self):
+        media_dir = prepare_media(os.path.join(self.work_dir, "media"), seconds=12)
+        server = FixtureServer(media_dir).start()
+        try:
+            output_path = os.path.join(self.work_dir, "out.mp4")
+            download_hls(f"{server.base_url}/hls/test/master.m3u8", output_path, workers=4)
+        finally:
+            server.stop()
+
+        info = self.probe(output_path)
+        self.assertIn("mp4", info["format"]["format_name"])
+        self.assertEqual(sorted(s["codec_type"] for s in info["streams"]), ["audio", "video"])
+        self.assertAlmostEqual(float(info["format"]["duration"]), 12, delta=1.5)
+
+    def test_remux_mp3_audio(self):
+        # Audio-only MP3 renditions must not get the AAC bitstream filter
+        ts_path = os.path.join(self.work_dir, "audio.ts")
+        subprocess.run(["ffmpeg", "-y", "-f", "lavfi", "-i", "sine=frequency=440:duration=3", "-c:a", "libmp3lame",
+                        "-f", "mpegts", ts_path], check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        output_path = os.path.join(self.work_dir, "audio.mp4")
+        remux(ts_path, output_path)
+        self.assertEqual([s["codec_name"] for s in self.probe(output_path)["streams"]], ["mp3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+# Description: Tests for the SQLite and Redis job queues: one owner per claim, lease expiry, retries and dead jobs.
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import importlib.util
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jobqueue import SqliteQueue, RedisQueue, DOWNLOAD, RESOLVE, DONE, DEAD, QUEUED, LEASED
+
+# The Redis tests run against fakeredis, with Lua support for the queue's scripts
+HAS_FAKEREDIS = all(importlib.util.find_spec(name) is not None for name in ("redis", "fakeredis", "lupa"))
+
+
+class SqliteQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="jobqueue_test_")
+        self.queue = SqliteQueue(os.path.join(self.work_dir, "jobs.db"), max_attempts=2)
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_every_job_is_claimed_once(self):
+        ids = [self.queue.put(DOWNLOAD, {"n": i}, key=f"download:{i}") for i in range(40)]
+        claimed, lock = [], threading.Lock()
+
+        def worker(name):
+            while True:
+                job = self.queue.claim(name, [DOWNLOAD])
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job["id"])
+                self.assertTrue(self.queue.complete(job["id"], name))
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), sorted(ids))
+        self.assertEqual(self.queue.stats()[DOWNLOAD], {DONE: 40})
+
+    def test_pending_key_is_queued_once(self):
+        self.assertIsNotNone(self.queue.put(RESOLVE, {}, key="resolve:a"))
+        self.assertIsNone(self.queue.put(RESOLVE, {}, key="resolve:a"))
+        job = self.queue.claim("w1")
+        self.queue.complete(job["id"], "w1")
+        self.assertIsNotNone(self.queue.put(RESOLVE, {}, key="resolve:a"))
+
+    def test_expired_lease_is_handed_out_again(self):
+        self.queue.put(DOWNLOAD, {})
+        job = self.queue.claim("w1", lease_seconds=0.05)
+        self.assertIsNone(self.queue.claim("w2"))
+        time.sleep(0.1)
+        again = self.queue.claim("w2")
+        self.assertEqual((again["id"], again["attempts"]), (job["id"], 2))
+        # The first worker lost its lease and can no longer settle the job
+        self.assertFalse(self.queue.heartbeat(job["id"], "w1"))
+        self.assertFalse(self.queue.complete(job["id"], "w1"))
+
+    def test_failed_job_retries_then_dies(self):
+        self.queue.put(DOWNLOAD, {})
+        job = self.queue.claim("w1")
+        self.assertTrue(self.queue.fail(job["id"], "w1", "boom", retry_delay=0))
+        self.assertEqual(self.queue.stats()[DOWNLOAD], {QUEUED: 1})
+        job = self.queue.claim("w1")
+        self.assertTrue(self.queue.fail(job["id"], "w1", "boom", retry_delay=0))
+        self.assertEqual(self.queue.stats()[DOWNLOAD], {DEAD: 1})
+        self.assertIsNone(self.queue.claim("w1"))
+
+
+@unittest.skipUnless(HAS_FAKEREDIS, "redis, fakeredis and lupa are needed for the Redis queue tests")
+class RedisQueueTest(unittest.TestCase):
+    def setUp(self):
+        import redis
+        import fakeredis
+
+        server = fakeredis.FakeServer()
+        patcher = mock.patch.object(redis.Redis, "from_url",
+                                    lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = RedisQueue("redis://fake", max_attempts=2)
+
+    def test_every_job_is_claimed_once(self):
+        ids = [self.queue.put(DOWNLOAD, {"n": i}, key=f"download:{i}") for i in range(40)]
+        claimed, lock = [], threading.Lock()
+
+        def worker(name):
+            queue = RedisQueue("redis://fake", max_attempts=2)
+            while True:
+                job = queue.claim(name, [DOWNLOAD])
+                if job is None:
+                    return
+                with lock:
+                    claimed.append(job["id"])
+                self.assertTrue(queue.complete(job["id"], name))
+
+        threads = [threading.Thread(target=worker, args=(f"w{i}",)) for i in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(claimed), sorted(ids))
+
+    def test_pending_key_is_queued_once(self):
+        job_id = self.queue.put(RESOLVE, {"event": 1}, key="resolve:a")
+        self.assertIsNotNone(job_id)
+        self.assertIsNone(self.queue.put(RESOLVE, {"event": 1}, key="resolve:a"))
+        job = self.queue.claim("w1")
+        self.assertEqual((job["id"], job["payload"], job["attempts"]), (job_id, {"event": 1}, 1))
+        self.queue.complete(job["id"], "w1")
+        self.assertIsNotNone(self.queue.put(RESOLVE, {}, key="resolve:a"))
+
+    def test_expired_lease_is_requeued_then_dead(self):
+        job_id = self.queue.put(DOWNLOAD, {}, key="download:a")
+        self.queue.claim("w1", lease_seconds=0.05)
+        time.sleep(0.1)
+        job = self.queue.claim("w2", lease_seconds=0.05)
+        self.assertEqual((job["id"], job["attempts"]), (job_id, 2))
+        self.assertEqual(self.queue.redis.hget(self.queue._key("job", job_id), "status"), LEASED)
+        self.assertFalse(self.queue.complete(job_id, "w1"))
+
+        # The second lease was the last attempt: the job dies and its key can be queued again
+        time.sleep(0.1)
+        self.assertIsNone(self.queue.claim("w3"))
+        self.assertEqual(self.queue.redis.hget(self.queue._key("job", job_id), "status"), DEAD)
+        self.assertEqual(self.queue.redis.zcard(self.queue._key("leases")), 0)
+        self.assertIsNotNone(self.queue.put(DOWNLOAD, {}, key="download:a"))
+
+    def test_failed_job_is_offered_again(self):
+        self.queue.put(DOWNLOAD, {})
+        job = self.queue.claim("w1")
+        self.assertTrue(self.queue.fail(job["id"], "w1", "boom", retry_delay=0))
+        self.assertEqual(self.queue.claim("w1")["attempts"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# Description: Tests for the SQLite download ledger: one-time import of the legacy JSON lists, and the download states it records.
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ledger import Ledger, open_ledger, SUCCESS, FAILED, DUPLICATE
+
+
+def entry(title, link="https://example.org/video"):
+    return {"title": title, "link": link, "recorded_date": "2025-03-10", "last_attempted_scrape_date": "2025-03-11"}
+
+
+class ImportJsonTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="ledger_test_")
+        self.db_path = os.path.join(self.work_dir, "ledger.db")
+        self.list_path = os.path.join(self.work_dir, "success_list.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def write_list(self, entries):
+        with open(self.list_path, "w") as file:
+            json.dump(entries, file)
+
+    def test_import_runs_once(self):
+        self.write_list([entry("a.mp4"), entry("b.mp4"), {"link": "no title"}])
+        ledger = Ledger(self.db_path)
+        self.assertEqual(ledger.import_json(self.list_path, SUCCESS, "west_virginia"), 2)
+        # Entries added to the old list afterwards are not picked up: the path is done
+        self.write_list([entry("a.mp4"), entry("b.mp4"), entry("c.mp4")])
+        self.assertEqual(ledger.import_json(self.list_path, SUCCESS, "west_virginia"), 0)
+        self.assertEqual(sorted(e["title"] for e in ledger.entries(SUCCESS)), ["a.mp4", "b.mp4"])
+        self.assertEqual(ledger.entries(SUCCESS)[0]["source"], "west_virginia")
+        ledger.close()
+
+    def test_missing_list_is_imported_once_it_appears(self):
+        ledger = Ledger(self.db_path)
+        self.assertEqual(ledger.import_json(self.list_path, SUCCESS), 0)
+        self.write_list([entry("a.mp4")])
+        self.assertEqual(ledger.import_json(self.list_path, SUCCESS), 1)
+        self.assertTrue(ledger.is_downloaded("a.mp4"))
+        ledger.close()
+
+    def test_corrupt_list_is_imported_once_fixed(self):
+        with open(self.list_path, "w") as file:
+            file.write('[{"title": "a.mp4", "link": ')
+        ledger = Ledger(self.db_path)
+        self.assertEqual(ledger.import_json(self.list_path, SUCCESS), 0)
+        self.write_list([entry("a.mp4")])
+        self.assertEqual(ledger.import_json(self.list_path, SUCCESS), 1)
+        ledger.close()
+
+    def test_concurrent_imports_from_two_connections(self):
+        # Two scrapers starting together on the same database, each with its own connection
+        self.write_list([entry(f"{i}.mp4") for i in range(500)])
+        ledgers = [Ledger(self.db_path) for _ in range(4)]
+        results, errors = [], []
+
+        def run(ledger):
+            try:
+                results.append(ledger.import_json(self.list_path, SUCCESS))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(ledger,)) for ledger in ledgers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [0, 0, 0, 500])
+        self.assertEqual(len(ledgers[0].entries(SUCCESS)), 500)
+        for ledger in ledgers:
+            ledger.close()
+
+    def test_open_ledger_imports_both_lists(self):
+        self.write_list([entry("a.mp4")])
+        failed_path = os.path.join(self.work_dir, "failed_list.json")
+        with open(failed_path, "w") as file:
+            json.dump([entry("b.mp4", "Not Found")], file)
+        ledger = open_ledger(self.db_path, self.list_path, failed_path, source="south_dakota")
+        self.assertEqual([e["title"] for e in ledger.entries(FAILED, "south_dakota")], ["b.mp4"])
+        self.assertTrue(ledger.is_downloaded("a.mp4"))
+        self.assertFalse(ledger.is_downloaded("b.mp4"))
+        ledger.close()
+
+
+class RecordTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="ledger_test_")
+        self.ledger = Ledger(os.path.join(self.work_dir, "ledger.db"))
+
+    def tearDown(self):
+        self.ledger.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_states(self):
+        self.ledger.record(entry("a.mp4"), FAILED)
+        self.assertFalse(self.ledger.is_downloaded("a.mp4"))
+        self.ledger.record(entry("b.mp4"), DUPLICATE)
+        self.assertTrue(self.ledger.is_downloaded("b.mp4"))     # Settled, not fingerprinted again
+        self.assertEqual(self.ledger.downloaded_links("b.mp4"), [])
+
+    def test_repeat_record_refreshes_attempt_date(self):
+        self.ledger.record(entry("a.mp4"), FAILED)
+        self.ledger.record(dict(entry("a.mp4"), last_attempted_scrape_date="2025-04-01"), FAILED)
+        self.assertEqual([e["last_attempted_scrape_date"] for e in self.ledger.entries(FAILED)], ["2025-04-01"])
+
+    def test_success_clears_failed_job(self):
+        job = {"title": "a.mp4", "entry": entry("a.mp4"), "failure": "network", "event_url": "https://example.org/e/1"}
+        self.ledger.save_resolved("us_congress", job["event_url"], "https://youtube.com/x", None, None, 0, 10)
+        self.ledger.save_failed_job(job, source="us_congress")
+        self.assertEqual([j["title"] for j in self.ledger.failed_jobs("us_congress")], ["a.mp4"])
+        # A failed download drops the cached resolution of its event page
+        self.assertIsNone(self.ledger.get_resolved("us_congress", job["event_url"], 3600, 1))
+        self.ledger.record(entry("a.mp4"), SUCCESS)
+        self.assertEqual(self.ledger.failed_jobs(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# Description: Tests for live capture against a scripted live playlist: segments are appended as they appear, and a discontinuity starts a new part that is concatenated at the end.
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import live
+from http_client import Response
+
+BASE = "http://origin/live/"
+
+
+def playlist(sequence, segments, discontinuity_sequence=0, endlist=False):
+    # segments: names in order; "|" marks an EXT-X-DISCONTINUITY before the next one
+    lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:2", f"#EXT-X-MEDIA-SEQUENCE:{sequence}",
+             f"#EXT-X-DISCONTINUITY-SEQUENCE:{discontinuity_sequence}"]
+    for name in segments:
+        lines += ["#EXT-X-DISCONTINUITY"] if name == "|" else ["#EXTINF:2.0,", name]
+    if endlist:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class ScriptedClient:
+    # Serves each playlist of `reloads` in turn (the last one sticks), and segment bodies named after the segment
+    def __init__(self, reloads):
+        self.reloads = list(reloads)
+        self.fetched = []
+
+    def get(self, url, headers=None):
+        name = url[len(BASE):]
+        if name == "media.m3u8":
+            text = self.reloads.pop(0) if len(self.reloads) > 1 else self.reloads[0]
+            return Response(200, {}, text.encode(), url)
+        self.fetched.append(name)
+        return Response(200, {}, f"<{name}>".encode(), url)
+
+    def close(self):
+        pass
+
+
+class LiveCaptureTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="live_test_")
+        self.output_path = os.path.join(self.work_dir, "out.mp4")
+        self.remuxed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def fake_remux_parts(self, paths, output_path):
+        parts = []
+        for path in paths:
+            with open(path, "rb") as file:
+                parts.append(file.read())
+        self.remuxed.append(parts)
+        with open(output_path, "wb") as file:
+            file.write(b"".join(parts))
+
+    def capture(self, reloads):
+        client = ScriptedClient(reloads)
+        with mock.patch("live.time.sleep"), \
+                mock.patch("live.remux", lambda path, output_path: self.fake_remux_parts([path], output_path)), \
+                mock.patch("live.remux_parts", self.fake_remux_parts):
+            live.capture_live(BASE + "media.m3u8", self.output_path, client=client)
+        return client
+
+    def test_segments_are_appended_as_they_appear(self):
+        client = self.capture([
+            playlist(0, ["a.ts", "b.ts"]),
+            playlist(0, ["a.ts", "b.ts", "c.ts"]),
+            playlist(1, ["b.ts", "c.ts", "d.ts"], endlist=True),
+        ])
+        self.assertEqual(client.fetched, ["a.ts", "b.ts", "c.ts", "d.ts"])
+        self.assertEqual(self.remuxed, [[b"<a.ts><b.ts><c.ts><d.ts>"]])
+        self.assertFalse(os.path.exists(self.output_path + ".live"))
+
+    def test_discontinuity_starts_a_new_part(self):
+        self.capture([
+            playlist(0, ["a.ts", "b.ts"]),
+            playlist(0, ["a.ts", "b.ts", "|", "ad1.ts", "ad2.ts"]),
+            playlist(2, ["ad1.ts", "ad2.ts", "|", "c.ts"], discontinuity_sequence=1, endlist=True),
+        ])
+        self.assertEqual(self.remuxed, [[b"<a.ts><b.ts>", b"<ad1.ts><ad2.ts>", b"<c.ts>"]])
+
+    def test_discontinuity_rolled_off_before_it_was_seen(self):
+        # The tagged segment left the window between two reloads; the discontinuity sequence still moved on
+        self.capture([
+            playlist(0, ["a.ts", "b.ts"]),
+            playlist(3, ["d.ts", "e.ts"], discontinuity_sequence=1, endlist=True),
+        ])
+        self.assertEqual(self.remuxed, [[b"<a.ts><b.ts>", b"<d.ts><e.ts>"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+# Description: Tests for per-host politeness: shared buckets for subdomains, Retry-After parsing and the adaptive request rate.
+import os
+import sys
+import time
+import unittest
+from email.utils import formatdate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ratelimit import RateLimiter, HostLimiter, retry_after_seconds
+
+
+def host_limiter(rps=10.0, burst=5):
+    return HostLimiter("example.org", rps=rps, burst=burst, concurrency=2, min_rps=0.5, latency_factor=4.0)
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds_and_dates(self):
+        self.assertEqual(retry_after_seconds("30"), 30.0)
+        self.assertEqual(retry_after_seconds("-5"), 0.0)
+        self.assertAlmostEqual(retry_after_seconds(formatdate(time.time() + 60, usegmt=True)), 60, delta=2)
+        self.assertIsNone(retry_after_seconds(None))
+        self.assertIsNone(retry_after_seconds("soon"))
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_subdomains_share_a_bucket(self):
+        limiter = RateLimiter({"hosts": {"congress.gov": {"rps": 2}}})
+        self.assertIs(limiter.host("https://www.congress.gov/event/1"), limiter.host("https://api.congress.gov/x"))
+        self.assertEqual(limiter.host("https://www.congress.gov/").max_rate, 2.0)
+        self.assertIsNot(limiter.host("https://congress.gov.example.org/"), limiter.host("https://congress.gov/"))
+
+    def test_configured_hosts_are_merged(self):
+        limiter = RateLimiter({"hosts": {"congress.gov": {"rps": 2}}})
+        limiter.update({"hosts": {"sdlegislature.gov": {"rps": 1}}})
+        self.assertEqual(limiter.host("https://sdlegislature.gov/").max_rate, 1.0)
+        self.assertEqual(limiter.host("https://congress.gov/").max_rate, 2.0)
+
+    def test_failed_request_is_observed(self):
+        limiter = RateLimiter({"default": {"rps": 8}})
+        with self.assertRaises(OSError):
+            with limiter.request("https://example.org/a"):
+                raise OSError("connection reset")
+        self.assertEqual(limiter.host("https://example.org/").rate, 6.0)
+
+
+class AdaptiveRateTest(unittest.TestCase):
+    def test_throttling_halves_the_rate_and_pauses(self):
+        limiter = host_limiter()
+        limiter.observe(429, 0.1, retry_after=0.2)
+        self.assertEqual(limiter.rate, 5.0)
+        started = time.monotonic()
+        limiter.take()
+        self.assertGreaterEqual(time.monotonic() - started, 0.15)
+
+    def test_rate_stays_within_its_bounds(self):
+        limiter = host_limiter()
+        for _ in range(10):
+            limiter.observe(503, 0.1, retry_after=0)
+        self.assertEqual(limiter.rate, 0.5)
+        for _ in range(40):
+            limiter.observe(200, 0.1)
+        self.assertEqual(limiter.rate, 10.0)
+
+    def test_latency_spike_slows_down(self):
+        limiter = host_limiter()
+        limiter.observe(200, 0.3)
+        limiter.observe(200, 2.0)
+        self.assertEqual(limiter.rate, 7.5)
+
+    def test_burst_then_paced(self):
+        limiter = host_limiter(rps=20, burst=3)
+        started = time.monotonic()
+        for _ in range(5):
+            limiter.take()
+        # Three tokens up front, then one every 50 ms
+        self.assertAlmostEqual(time.monotonic() - started, 0.1, delta=0.05)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Description: Tests for download retries: failure classes, which of them are retried, and the per-host backoff.
+import os
+import sys
+import socket
+import unittest
+import subprocess
+import http.client
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from retry import (classify, retryable, Backoff, TruncatedOutput, CorruptOutput, NO_MANIFEST, HTTP_4XX, HTTP_5XX,
+                   TRUNCATED, CORRUPT, PROCESS_EXIT, NETWORK, LOCAL, UNKNOWN)
+from http_client import HttpError
+from hls import PlaylistError
+from ytdlp_engine import DownloadFailed
+
+
+class ClassifyTest(unittest.TestCase):
+    def test_categories(self):
+        cases = [
+            (HttpError(404, "https://example.org/a"), HTTP_4XX),
+            (HttpError(503, "https://example.org/a"), HTTP_5XX),
+            (PlaylistError("No segments"), NO_MANIFEST),
+            (CorruptOutput("no audio stream"), CORRUPT),
+            (TruncatedOutput("No output written"), TRUNCATED),
+            (http.client.IncompleteRead(b"partial", 100), TRUNCATED),
+            (subprocess.CalledProcessError(1, ["ffmpeg"]), PROCESS_EXIT),
+            (DownloadFailed("yt-dlp gave up"), PROCESS_EXIT),
+            (FileNotFoundError("ffmpeg"), LOCAL),
+            (PermissionError("read-only volume"), LOCAL),
+            (ConnectionResetError("reset by peer"), NETWORK),
+            (socket.timeout("timed out"), NETWORK),
+            (ValueError("unexpected"), UNKNOWN),
+        ]
+        for error, category in cases:
+            self.assertEqual(classify(error), category, repr(error))
+
+    def test_retryable(self):
+        # Client errors are final unless they mean "later"
+        self.assertFalse(retryable(HttpError(404, "https://example.org/a")))
+        self.assertTrue(retryable(HttpError(429, "https://example.org/a")))
+        self.assertTrue(retryable(HttpError(500, "https://example.org/a")))
+        # No manifest needs a new crawl, a missing tool needs a fix; neither improves by trying again
+        self.assertFalse(retryable(PlaylistError("No segments")))
+        self.assertFalse(retryable(FileNotFoundError("ffmpeg")))
+        self.assertTrue(retryable(ConnectionResetError("reset by peer")))
+
+
+class BackoffTest(unittest.TestCase):
+    def test_delay_doubles_up_to_the_limit(self):
+        backoff = Backoff(base_delay=5, max_delay=30)
+        delays = [backoff.failure("example.org") for _ in range(5)]
+        for delay, ceiling in zip(delays, [5, 10, 20, 30, 30]):
+            self.assertTrue(ceiling / 2 <= delay <= ceiling, (delay, ceiling))
+
+    def test_success_resets_the_host(self):
+        backoff = Backoff(base_delay=5, max_delay=300)
+        backoff.failure("example.org")
+        backoff.failure("example.org")
+        backoff.success("example.org")
+        self.assertLessEqual(backoff.failure("example.org"), 5)
+        # Other hosts are not held back
+        self.assertNotIn("other.org", backoff.not_before)
+
+
+if __name__ == "__main__":
+    unittest.main()
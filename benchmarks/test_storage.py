@@ -0,0 +1,167 @@
+# Description: Tests for the storage backends: resuming an S3 multipart upload from its part file, re-uploading parts that changed, aborting uploads that will not be finished, and local copies that fail.
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import S3Storage, LocalStorage, MB
+
+
+class FakeS3:
+    # Just enough of the boto3 client for S3Storage; parts are kept in memory per upload id
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+        self.part_calls = []
+        self.aborted = []
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        self.part_calls.append(PartNumber)
+        self.uploads[UploadId][PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        self.objects[Key] = b"".join(parts[p["PartNumber"]] for p in MultipartUpload["Parts"])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.uploads.pop(UploadId, None)
+
+
+def fail_after(data, size):
+    # A stream that breaks after `size` bytes, like a transfer cut off halfway
+    class Broken(io.BytesIO):
+        def read(self, n=-1):
+            if self.tell() >= size:
+                raise OSError("connection reset")
+            return super().read(min(n, size - self.tell()))
+    return Broken(data)
+
+
+class FailingS3(FakeS3):
+    # Rejects one part number, like S3 refusing a request mid-upload
+    def __init__(self, failing_part):
+        super().__init__()
+        self.failing_part = failing_part
+        self.lock = threading.Lock()
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        if PartNumber == self.failing_part:
+            raise OSError("503 Slow Down")
+        with self.lock:
+            return super().upload_part(Bucket, Key, PartNumber, UploadId, Body)
+
+
+class SlowStream(io.BytesIO):
+    def read(self, n=-1):
+        data = super().read(n)
+        time.sleep(0.01)    # Leaves the part uploads time to finish, like a transcoder writing the stream
+        return data
+
+
+class S3ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="storage_test_")
+        self.resume_path = os.path.join(self.work_dir, "out.mp4.upload.json")
+        self.client = FakeS3()
+        self.storage = S3Storage("bucket", part_size=5 * MB, max_inflight=2, client=self.client)
+        self.data = os.urandom(5 * MB * 4 + 1234)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def interrupted_upload(self):
+        with self.assertRaises(OSError):
+            self.storage.upload_stream("key", fail_after(self.data, 5 * MB * 2), resume_path=self.resume_path)
+        self.assertEqual(sorted(self.client.part_calls), [1, 2])
+        self.client.part_calls.clear()
+
+    def test_resume_skips_stored_parts(self):
+        self.interrupted_upload()
+        self.storage.upload_stream("key", io.BytesIO(self.data), resume_path=self.resume_path)
+        self.assertEqual(sorted(self.client.part_calls), [3, 4, 5])
+        self.assertEqual(self.client.objects["key"], self.data)
+        self.assertFalse(os.path.exists(self.resume_path))
+
+    def test_changed_part_is_uploaded_again(self):
+        self.interrupted_upload()
+        changed = self.data[:100] + b"x" * 100 + self.data[200:]
+        self.storage.upload_stream("key", io.BytesIO(changed), resume_path=self.resume_path)
+        self.assertEqual(sorted(self.client.part_calls), [1, 3, 4, 5])
+        self.assertEqual(self.client.objects["key"], changed)
+
+    def test_expired_upload_is_aborted(self):
+        self.interrupted_upload()
+        with open(self.resume_path, "r") as file:
+            progress = json.load(file)
+        progress["created"] = time.time() - 25 * 3600
+        with open(self.resume_path, "w") as file:
+            json.dump(progress, file)
+
+        self.storage.upload_stream("key", io.BytesIO(self.data), resume_path=self.resume_path)
+        self.assertEqual(self.client.aborted, ["upload-1"])
+        self.assertEqual(sorted(self.client.part_calls), [1, 2, 3, 4, 5])
+        self.assertEqual(self.client.objects["key"], self.data)
+
+    def test_abort_drops_upload_and_part_file(self):
+        self.interrupted_upload()
+        self.storage.abort(self.resume_path)
+        self.assertEqual(self.client.aborted, ["upload-1"])
+        self.assertEqual(self.client.uploads, {})
+        self.assertFalse(os.path.exists(self.resume_path))
+        self.storage.abort(self.resume_path)    # Nothing left to abort
+        self.assertEqual(self.client.aborted, ["upload-1"])
+
+
+class S3FailureTest(unittest.TestCase):
+    def test_failed_part_stops_and_aborts_the_upload(self):
+        client = FailingS3(failing_part=2)
+        storage = S3Storage("bucket", part_size=5 * MB, max_inflight=2, client=client)
+        stream = SlowStream(os.urandom(5 * MB * 20))
+        with self.assertRaises(OSError):
+            storage.upload_stream("key", stream)
+        # The stream was not read to the end before the failure surfaced
+        self.assertLess(stream.tell(), 5 * MB * 20)
+        self.assertEqual(client.aborted, ["upload-1"])
+        self.assertEqual(client.uploads, {})
+        self.assertNotIn("key", client.objects)
+
+
+class LocalStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="storage_test_")
+        self.storage = LocalStorage(self.work_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_failed_copy_leaves_nothing_behind(self):
+        with self.assertRaises(OSError):
+            self.storage.upload_stream("a/b.mp3", fail_after(b"x" * 100, 50))
+        self.assertEqual(os.listdir(os.path.join(self.work_dir, "a")), [])
+
+    def test_original_error_survives_a_missing_temp_file(self):
+        # The temp file cannot be created: the open() error is raised, not the cleanup's FileNotFoundError
+        with mock.patch("storage.open", side_effect=PermissionError("read-only volume"), create=True):
+            with self.assertRaises(PermissionError):
+                self.storage.upload_stream("a/b.mp3", io.BytesIO(b"data"))
+
+
+if __name__ == "__main__":
+    unittest.main()
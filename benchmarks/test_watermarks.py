@@ -0,0 +1,70 @@
+# Description: Tests for crawl watermarks: listing fingerprints, the date range a listing was handled for, and the last complete date.
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from watermarks import Watermark, load_watermark
+
+URL = "https://wvlegislature.gov/archived-recordings/"
+
+
+class ListingTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="watermark_test_")
+        self.path = os.path.join(self.work_dir, "watermark.json")
+        self.watermark = Watermark(self.path, "west_virginia")
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def test_unchanged_listing_within_handled_range(self):
+        self.watermark.update_listing(URL, "abc", {"etag": '"1"'}, "2025-03-01", "2025-03-31")
+        self.assertTrue(self.watermark.listing_unchanged(URL, digest="abc", start_date="2025-03-10", end_date="2025-03-11"))
+        self.assertFalse(self.watermark.listing_unchanged(URL, digest="def", start_date="2025-03-10", end_date="2025-03-11"))
+        self.assertEqual(self.watermark.conditional_headers(URL, "2025-03-10", "2025-03-11"), {"If-None-Match": '"1"'})
+
+    def test_changed_date_range_is_not_skipped(self):
+        # Same page, but rows of February were never queued
+        self.watermark.update_listing(URL, "abc", {"etag": '"1"'}, "2025-03-01", "2025-03-31")
+        self.assertFalse(self.watermark.listing_unchanged(URL, digest="abc", start_date="2025-02-01", end_date="2025-03-31"))
+        self.assertFalse(self.watermark.listing_unchanged(URL, status=304, start_date="2025-03-20", end_date="2025-04-02"))
+        self.assertEqual(self.watermark.conditional_headers(URL, "2025-02-01", "2025-03-31"), {})
+
+    def test_ranges_of_an_unchanged_listing_add_up(self):
+        self.watermark.update_listing(URL, "abc", None, "2025-03-01", "2025-03-10")
+        self.watermark.update_listing(URL, "abc", None, "2025-03-11", "2025-03-20")
+        self.assertTrue(self.watermark.covers(URL, "2025-03-01", "2025-03-20"))
+        # A range apart from the covered one replaces it rather than claiming the days between
+        self.watermark.update_listing(URL, "abc", None, "2025-05-01", "2025-05-02")
+        self.assertFalse(self.watermark.covers(URL, "2025-03-01", "2025-05-02"))
+        self.assertTrue(self.watermark.covers(URL, "2025-05-01", "2025-05-02"))
+
+    def test_changed_listing_only_covers_the_new_range(self):
+        self.watermark.update_listing(URL, "abc", None, "2025-03-01", "2025-03-20")
+        self.watermark.update_listing(URL, "def", None, "2025-03-15", "2025-03-25")
+        self.assertFalse(self.watermark.covers(URL, "2025-03-01", "2025-03-25"))
+        self.assertTrue(self.watermark.covers(URL, "2025-03-15", "2025-03-25"))
+
+    def test_listing_without_a_range(self):
+        # Per-date listings (one congress schedule page a day) are fingerprinted without a range
+        self.watermark.update_listing(URL, "abc")
+        self.assertTrue(self.watermark.listing_unchanged(URL, digest="abc"))
+        self.assertTrue(self.watermark.listing_unchanged(URL, status=304))
+
+    def test_state_survives_a_restart(self):
+        self.watermark.update_listing(URL, "abc", None, "2025-03-01", "2025-03-31")
+        self.watermark.mark_complete("2025-03-31")
+        self.watermark.save()
+        watermark = load_watermark({"incremental": True, "watermark_path": self.path}, "west_virginia")
+        self.assertTrue(watermark.listing_unchanged(URL, digest="abc", start_date="2025-03-05", end_date="2025-03-06"))
+        self.assertEqual(watermark.effective_start("2025-01-01", lookback_days=2), "2025-03-30")
+        self.assertIsNone(load_watermark({"incremental": False, "watermark_path": self.path}, "west_virginia"))
+
+
+if __name__ == "__main__":
+    unittest.main()
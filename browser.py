@@ -0,0 +1,193 @@
+# Description: Shared Chrome profile builder for every source. Headless with a small viewport by default, and blocks images, fonts, CSS and media segments over CDP while HLS manifests still load. Attaches to a warm browser_daemon.py instance when one is running.
+import os
+import json
+import fcntl
+import logging
+import threading
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from urllib.request import urlopen
+
+logger = logging.getLogger(__name__)
+
+user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+
+DEFAULT_PROFILE = {
+    "headless": True,
+    "window_size": "1024,768",      # Wide enough that Vuetify still renders its md-and-up layout
+    "block": ["image", "font", "stylesheet", "media"],
+    "user_data_dir": None,          # Root for persistent profiles (cache, cookies) reused across runs
+    "performance_log": False,
+    "daemon_state": None,           # State file of a running browser_daemon.py to attach to
+}
+
+# Network.setBlockedURLs wildcard patterns per resource type. .m3u8 is never listed, so players still
+# request their manifest (which is all the sniffer needs) while the segments behind it are dropped.
+BLOCK_PATTERNS = {
+    "image": ["png", "jpg", "jpeg", "gif", "webp", "svg", "ico", "avif"],
+    "font": ["woff", "woff2", "ttf", "otf", "eot"],
+    "stylesheet": ["css"],
+    "media": ["ts", "m4s", "m4a", "m4v", "aac", "mp4", "mp3", "webm"],
+}
+
+profile_lock = threading.Lock()
+reserved_dirs = set()   # Profile directories handed to a Chrome that is still starting up
+
+
+def blocked_url_patterns(resource_types):
+    patterns = []
+    for resource_type in resource_types:
+        for extension in BLOCK_PATTERNS.get(resource_type, []):
+            patterns += [f"*.{extension}", f"*.{extension}?*"]
+    return patterns
+
+
+def claim_profile_dir(root):
+    # Chrome refuses to share a profile between running instances, so each one gets the first free
+    # root/chrome-N; a running Chrome holds a SingletonLock in its directory
+    with profile_lock:
+        index = 0
+        while True:
+            path = os.path.join(root, f"chrome-{index}")
+            if path not in reserved_dirs and not os.path.lexists(os.path.join(path, "SingletonLock")):
+                reserved_dirs.add(path)
+                os.makedirs(path, exist_ok=True)
+                return path
+            index += 1
+
+
+def chrome_arguments(profile):
+    # Command-line switches shared by chromedriver-launched and daemon-launched browsers
+    arguments = [f"--user-agent={user_agent}"]
+    if profile["headless"]:
+        arguments.append("--headless=new")
+    arguments += [
+        f"--window-size={profile['window_size']}",
+        "--disable-gpu",
+        "--disable-extensions",
+        "--disable-dev-shm-usage",
+        "--mute-audio",
+        "--no-first-run",
+        # Pages keep full speed in a hidden or headless window
+        "--disable-background-timer-throttling",
+        "--disable-backgrounding-occluded-windows",
+        "--disable-renderer-backgrounding",
+        "--disable-blink-features=AutomationControlled",
+        "--ignore-certificate-errors",
+    ]
+    return arguments
+
+
+def browser_options(profile):
+    options = webdriver.ChromeOptions()
+    for argument in chrome_arguments(profile):
+        options.add_argument(argument)
+    options.add_experimental_option("excludeSwitches", ["enable-automation"])
+    options.add_experimental_option("useAutomationExtension", False)
+    if profile["performance_log"]:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return options
+
+
+def prepare_driver(driver, profile):
+    # Per-session CDP setup; it does not survive a detach, so attached browsers get it again
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
+    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
+        "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
+    })
+
+    patterns = blocked_url_patterns(profile["block"])
+    if patterns:
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
+        logger.info(f"Blocking {', '.join(profile['block'])} requests in browser")
+    return driver
+
+
+class AttachedChrome(webdriver.Chrome):
+    # Driver for a daemon-owned Chrome: quit() ends the chromedriver session and frees the instance,
+    # the browser itself stays up with its cookies and cache for the next run
+    lease = None
+
+    def quit(self):
+        try:
+            super().quit()
+        finally:
+            if self.lease is not None:
+                self.lease.close()      # Closing the file drops the flock
+                self.lease = None
+
+
+def endpoint_alive(debugger_address):
+    try:
+        with urlopen(f"http://{debugger_address}/json/version", timeout=2) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+
+def attach_driver(profile, chromedriver_path=None):
+    # Lease the first idle daemon instance; None when no daemon is running or every instance is taken
+    try:
+        with open(profile["daemon_state"], "r") as file:
+            state = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    for instance in state.get("instances", []):
+        lease = open(instance["lock_path"], "a")
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)     # Held for as long as the driver lives
+        except BlockingIOError:
+            lease.close()
+            continue
+
+        if not endpoint_alive(instance["debugger_address"]):
+            lease.close()
+            continue
+
+        options = webdriver.ChromeOptions()
+        options.debugger_address = instance["debugger_address"]
+        service = Service(executable_path=chromedriver_path) if chromedriver_path else Service()
+        try:
+            driver = AttachedChrome(service=service, options=options)
+        except Exception as e:
+            lease.close()
+            logger.info(f"Could not attach to warm browser at {instance['debugger_address']}: {e}")
+            continue
+
+        driver.lease = lease
+        logger.info(f"Attached to warm browser at {instance['debugger_address']}")
+        return prepare_driver(driver, profile)
+
+    return None
+
+
+def new_driver(profile=None, chromedriver_path=None):
+    # profile overrides any of DEFAULT_PROFILE, usually from the "browser" block of a source config
+    profile = dict(DEFAULT_PROFILE, **(profile or {}))
+
+    # A warm daemon instance skips Chrome start-up entirely; otherwise fall back to a cold start
+    if profile["daemon_state"]:
+        driver = attach_driver(profile, chromedriver_path)
+        if driver is not None:
+            return driver
+        logger.info("No idle warm browser, starting a new one")
+
+    options = browser_options(profile)
+
+    profile_dir = None
+    if profile["user_data_dir"]:
+        profile_dir = claim_profile_dir(profile["user_data_dir"])
+        options.add_argument(f"--user-data-dir={profile_dir}")
+
+    # Without a path Selenium Manager finds a chromedriver matching the installed Chrome
+    service = Service(executable_path=chromedriver_path) if chromedriver_path else Service()
+    try:
+        driver = webdriver.Chrome(service=service, options=options)
+    finally:
+        if profile_dir:
+            with profile_lock:
+                reserved_dirs.discard(profile_dir)
+
+    return prepare_driver(driver, profile)
@@ -0,0 +1,172 @@
+# Description: Long-lived pool of warm Chrome instances with persistent profiles. Scrapers attach over the remote debugging port instead of starting a cold browser each run.
+import os
+import sys
+import json
+import time
+import shutil
+import signal
+import logging
+import subprocess
+from urllib.request import urlopen
+
+from browser import DEFAULT_PROFILE, chrome_arguments, endpoint_alive
+
+logger = logging.getLogger("browser_daemon")
+
+CHROME_BINARIES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome"]
+
+DEFAULT_SETTINGS = {
+    "instances": 4,
+    "base_port": 9222,
+    "state_path": "/tmp/browser_daemon.json",
+    "profile_root": "/var/tmp/scraper-chrome",     # Used when the browser profile has no user_data_dir
+    "chrome_binary": None,
+    "check_interval": 10,
+}
+
+
+def find_chrome(binary=None):
+    for candidate in [binary] + CHROME_BINARIES:
+        if candidate and shutil.which(candidate):
+            return shutil.which(candidate)
+    raise FileNotFoundError(f"No Chrome binary found, tried {', '.join(CHROME_BINARIES)}")
+
+
+def save_state(state, state_path):
+    # Write to a temp file first so an attaching scraper never reads half a state file
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file, indent=4)
+    os.replace(tmp_path, state_path)
+
+
+class BrowserDaemon:
+    def __init__(self, profile=None, settings=None):
+        self.profile = dict(DEFAULT_PROFILE, **(profile or {}))
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.chrome = find_chrome(self.settings["chrome_binary"])
+        self.profile_root = self.profile["user_data_dir"] or self.settings["profile_root"]
+        self.processes = {}     # index -> Popen
+        self.running = True
+
+    def instance(self, index):
+        port = self.settings["base_port"] + index
+        profile_dir = os.path.join(self.profile_root, f"chrome-{index}")
+        return {
+            "index": index,
+            "debugger_address": f"127.0.0.1:{port}",
+            "profile_dir": profile_dir,
+            "lock_path": profile_dir + ".lock",     # flock'd by the scraper currently attached
+        }
+
+    def launch(self, index):
+        instance = self.instance(index)
+        os.makedirs(instance["profile_dir"], exist_ok=True)
+        command = [
+            self.chrome,
+            *chrome_arguments(self.profile),
+            f"--remote-debugging-port={self.settings['base_port'] + index}",
+            "--remote-debugging-address=127.0.0.1",
+            f"--user-data-dir={instance['profile_dir']}",
+            "about:blank",
+        ]
+        self.processes[index] = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Wait for the DevTools endpoint so the state file only lists browsers that can be attached to
+        deadline = time.time() + 30
+        while time.time() < deadline and not endpoint_alive(instance["debugger_address"]):
+            time.sleep(0.25)
+        logger.info(f"Chrome {index} ready on {instance['debugger_address']} (pid {self.processes[index].pid})")
+
+    def write_state(self):
+        instances = []
+        for index, process in sorted(self.processes.items()):
+            instances.append(dict(self.instance(index), pid=process.pid))
+        save_state({"pid": os.getpid(), "instances": instances}, self.settings["state_path"])
+
+    def check(self):
+        # Restart any instance that exited or stopped answering on its debugging port
+        restarted = False
+        for index, process in list(self.processes.items()):
+            if process.poll() is None and endpoint_alive(self.instance(index)["debugger_address"]):
+                continue
+            logger.info(f"Chrome {index} is down, restarting it")
+            self.stop_instance(index)
+            self.launch(index)
+            restarted = True
+        if restarted:
+            self.write_state()
+
+    def stop_instance(self, index):
+        process = self.processes.pop(index, None)
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def stop(self, *args):
+        self.running = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for index in range(self.settings["instances"]):
+            self.launch(index)
+        self.write_state()
+        logger.info(f"{len(self.processes)} warm browsers listed in {self.settings['state_path']}")
+
+        try:
+            while self.running:
+                time.sleep(self.settings["check_interval"])
+                if self.running:
+                    self.check()
+        finally:
+            # Remove the state file first so no scraper attaches to a browser that is going away
+            if os.path.exists(self.settings["state_path"]):
+                os.remove(self.settings["state_path"])
+            for index in list(self.processes):
+                self.stop_instance(index)
+            logger.info("Browser daemon stopped")
+
+
+def status(state_path):
+    # Print the instances in a state file and whether each one answers
+    try:
+        with open(state_path, "r") as file:
+            state = json.load(file)
+    except FileNotFoundError:
+        print(f"No browser daemon state at {state_path}")
+        return 1
+
+    for instance in state["instances"]:
+        try:
+            with urlopen(f"http://{instance['debugger_address']}/json/version", timeout=2) as response:
+                version = json.load(response).get("Browser", "?")
+        except OSError:
+            version = "not responding"
+        print(f"chrome-{instance['index']}  {instance['debugger_address']}  pid {instance['pid']}  {version}")
+    return 0
+
+
+# Usage: python browser_daemon.py [config_runner.json] [--status]
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    config_path = args[0] if args else "/config_runner.json"
+    with open(config_path, "r") as file:
+        config = json.load(file)
+    settings = config.get("browser_daemon") or {}
+
+    if "--status" in sys.argv:
+        sys.exit(status(settings.get("state_path", DEFAULT_SETTINGS["state_path"])))
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    BrowserDaemon(config.get("browser"), settings).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Description: Bounded pool of warm Chrome instances shared by every source in a run.
+import logging
+import threading
+from contextlib import contextmanager
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserPool:
+    def __init__(self, factory, size=2):
+        self.factory = factory
+        self.size = max(1, size)
+        self.idle = []          # Warm drivers waiting for the next lease
+        self.leased = 0
+        self.waiting = 0        # Callers blocked on a free slot, i.e. outstanding work
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def acquire(self, source=None):
+        with self.condition:
+            self.waiting += 1
+            try:
+                # Slots go to whichever caller is next in line, so a source with more queued work gets more of them
+                while not self.idle and self.leased + len(self.idle) >= self.size:
+                    if self.closed:
+                        raise RuntimeError("Browser pool is closed")
+                    self.condition.wait()
+                self.leased += 1
+                if self.idle:
+                    return self.idle.pop()
+            finally:
+                self.waiting -= 1
+
+        # Start a new browser outside the lock, Chrome takes a few seconds to come up
+        try:
+            with metrics.stage(source, "browser_launch"):
+                driver = self.factory()
+            metrics.inc("scraper_browsers_launched_total", source)
+            return driver
+        except Exception:
+            with self.condition:
+                self.leased -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, driver, broken=False):
+        with self.condition:
+            self.leased -= 1
+            if broken or self.closed:
+                self._quit(driver)
+            else:
+                self.idle.append(driver)
+            self.condition.notify()
+
+    @contextmanager
+    def browser(self, source=None):
+        driver = self.acquire(source)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True   # Don't hand a browser in an unknown state to the next caller
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def _quit(self, driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.info(f"Error closing browser: {e}")
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.condition.notify_all()
+        for driver in idle:
+            self._quit(driver)
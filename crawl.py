@@ -0,0 +1,49 @@
+# Description: Shared frame of a scraper run: the download pool, the incremental start date and the teardown once the crawl is over.
+from contextlib import contextmanager
+
+from download_pool import make_pool
+from watermarks import load_watermark
+from waits import report_savings
+
+
+class Crawl:
+    def __init__(self, pool, start_date, watermark):
+        self.pool = pool
+        self.start_date = start_date
+        self.watermark = watermark      # None unless the source crawls incrementally
+
+    def complete(self, date):
+        # Everything up to date has been queued, the next incremental run starts after it
+        if self.watermark:
+            self.watermark.mark_complete(date)
+
+
+@contextmanager
+def crawl(config, source, ledger, logger, pool=None, on_success=None, on_failure=None, on_duplicate=None, ytdlp=True):
+    # A pool passed in by the job queue takes the downloads instead, dedup then runs on the download node
+    own_pool = pool is None
+    dedup = None
+    if own_pool:
+        pool, dedup = make_pool(config, ledger, source, on_success, on_failure, on_duplicate, ytdlp=ytdlp)
+
+    # Incremental runs start after the last fully-crawled date
+    watermark = load_watermark(config, source)
+    start_date = config["start_date"]
+    if watermark:
+        start_date = watermark.effective_start(start_date, config.get("lookback_days", 0))
+        logger.info(f"Incremental crawl from {start_date}")
+
+    # A crawl that raises still lets the jobs it queued finish, and closes the pool, dedup index and ledger
+    try:
+        yield Crawl(pool, start_date, watermark)
+    finally:
+        try:
+            if watermark:
+                watermark.save()
+            report_savings(logger, source)
+            if own_pool:
+                pool.join()
+        finally:
+            if dedup:
+                dedup.close()
+            ledger.close()
@@ -0,0 +1,136 @@
+# Description: Content-addressed dedup index. Keys each recording by canonical media URL, HLS playlist hash and a hash of its first bytes, and rejects re-posts before they are downloaded.
+import hashlib
+import logging
+import sqlite3
+import threading
+from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
+
+from http_client import HttpClient
+from ledger import SUCCESS
+from hls import resolve_media_playlist
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only change how a player behaves, not which recording it plays
+NOISE_PARAMS = {"autoplay", "rel", "enablejsapi", "origin", "feature", "si", "modestbranding", "controls", "mute", "playsinline"}
+
+
+def canonical_url(url):
+    parsed = urlparse(url.strip())
+    host = (parsed.hostname or "").lower()
+
+    # Every YouTube URL shape (embed, watch, youtu.be) collapses to the video id
+    if host.endswith("youtube.com") or host.endswith("youtube-nocookie.com") or host == "youtu.be":
+        if host == "youtu.be":
+            video_id = parsed.path.strip("/")
+        elif parsed.path.startswith("/embed/") or parsed.path.startswith("/live/"):
+            video_id = parsed.path.split("/")[2]
+        else:
+            video_id = dict(parse_qsl(parsed.query)).get("v", parsed.path)
+        return f"youtube:{video_id}"
+
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(parsed.query)
+                             if k.lower() not in NOISE_PARAMS and not k.lower().startswith("utm_")))
+    return urlunparse((parsed.scheme.lower(), host + (f":{parsed.port}" if parsed.port else ""),
+                       parsed.path, "", query, ""))
+
+
+def sha256(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+class DedupIndex:
+    def __init__(self, db_path, head_bytes=256 * 1024, client=None):
+        self.head_bytes = head_bytes
+        self.client = client or HttpClient()
+        self.lock = threading.Lock()
+        self.inflight = {}      # key -> title for jobs claimed but not yet finished
+
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS fingerprints (
+                key TEXT PRIMARY KEY,
+                title TEXT NOT NULL
+            );
+        """)
+        self.conn.commit()
+
+    def seed(self, entries):
+        # Register the links of everything downloaded before the index existed
+        rows = [(f"url:{canonical_url(e['link'])}", e["title"]) for e in entries if e["link"].startswith("http")]
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO fingerprints (key, title) VALUES (?, ?)", rows)
+
+    def head_hash(self, url, headers=None):
+        # Hash of the first head_bytes of the file, fetched with a Range request
+        request_headers = dict(headers or {})
+        request_headers["Range"] = f"bytes=0-{self.head_bytes - 1}"
+        # max_body stops a server that ignores Range from sending the whole recording
+        response = self.client.get(url, headers=request_headers, max_body=self.head_bytes).raise_for_status()
+        return sha256(response.body[:self.head_bytes])
+
+    def fingerprints(self, job):
+        keys = [f"url:{canonical_url(job['url'])}"]
+        if keys[0].startswith("url:youtube:"):
+            return keys     # Nothing more to fetch without the YouTube player
+
+        try:
+            if job.get("engine") == "hls":
+                media_url, playlist = resolve_media_playlist(self.client, job["url"], job.get("headers"))
+                # Segment paths without their query strings, which usually carry expiring tokens
+                segment_paths = [urlparse(segment["uri"]).path for segment in playlist["segments"]]
+                keys.append(f"playlist:{sha256(chr(10).join(segment_paths))}")
+                if playlist["segments"]:
+                    keys.append(f"head:{self.head_hash(playlist['segments'][0]['uri'], job.get('headers'))}")
+            else:
+                keys.append(f"head:{self.head_hash(job['url'], job.get('headers'))}")
+        except Exception as e:
+            # Encrypted playlists, hosts without Range support, timeouts: the URL key still applies
+            logger.info(f"Could not fingerprint '{job['title']}', deduping on its URL only: {e}")
+
+        return keys
+
+    def claim(self, job):
+        # Returns the title that already owns one of this job's keys, or None after reserving the keys for it
+        keys = self.fingerprints(job)
+        job["fingerprints"] = keys
+        with self.lock:
+            for key in keys:
+                if key in self.inflight:
+                    return self.inflight[key]
+                row = self.conn.execute("SELECT title FROM fingerprints WHERE key = ?", (key,)).fetchone()
+                if row:
+                    return row[0]
+            for key in keys:
+                self.inflight[key] = job["title"]
+        return None
+
+    def commit(self, job):
+        with self.lock, self.conn:
+            for key in job.get("fingerprints", []):
+                self.inflight.pop(key, None)
+                self.conn.execute("INSERT OR IGNORE INTO fingerprints (key, title) VALUES (?, ?)", (key, job["title"]))
+
+    def release(self, job):
+        # The download failed, so a later attempt (or a re-post) may claim these keys again
+        with self.lock:
+            for key in job.get("fingerprints", []):
+                self.inflight.pop(key, None)
+
+    def close(self):
+        self.client.close()
+        with self.lock:
+            self.conn.close()
+
+
+def make_dedup(config, ledger=None):
+    # The index lives next to the download ledger; None when dedup is switched off
+    if not config.get("dedup", True):
+        return None
+    index = DedupIndex(config["ledger_path"], head_bytes=config.get("dedup_head_kb", 256) * 1024)
+    if ledger is not None:
+        index.seed(ledger.entries(SUCCESS))
+    return index
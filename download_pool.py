@@ -0,0 +1,315 @@
+# Description: Producer/consumer download pool. Scrapers queue resolved media jobs while workers run the transfers in parallel.
+import time
+import queue
+import logging
+import os
+import threading
+import subprocess
+from functools import partial
+from urllib.parse import urlparse
+
+from http_client import HttpClient
+from hls import download_hls, HlsUnsupported
+from live import capture_live
+from storage import CountingReader, make_storage
+from profiles import transcode
+from retry import Backoff, TruncatedOutput, classify, retryable, make_backoff
+from verify import make_verifier
+from ytdlp_engine import make_ytdlp_engine
+from dedup import make_dedup
+import ratelimit
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def make_job(title, url, output_path, command, headers=None, entry=None, **extra):
+    # A job is a plain dict so it can be logged, stored and rebuilt without the scraper that produced it
+    job = {
+        "title": title,
+        "url": url,
+        "headers": headers or {},
+        "output_path": output_path,
+        "command": command,
+        "entry": entry,
+    }
+    job.update(extra)
+    return job
+
+
+class DownloadPool:
+    def __init__(self, workers=4, per_host_limit=2, on_success=None, on_failure=None, hls_segment_workers=8, storage=None,
+                 dedup=None, on_duplicate=None, source=None, backoff=None, verifier=None, ytdlp=None):
+        self.jobs = queue.Queue()
+        self.backoff = backoff or Backoff(max_attempts=1)     # Default: one attempt, no retries
+        self.verifier = verifier    # When set, local outputs are probed before they count as downloaded
+        self.ytdlp = ytdlp          # When set, "ytdlp" engine jobs run in its warm worker processes, not a new CLI
+        self.source = source        # Metrics label for every job of this pool
+        self.storage = storage      # When set, jobs with a storage_key stream into it instead of the local disk
+        self.dedup = dedup          # When set, re-posts of a recording already stored are dropped before any transfer
+        self.on_duplicate = on_duplicate
+        self.hls_segment_workers = hls_segment_workers
+        self.http = HttpClient(max_idle_per_host=hls_segment_workers * per_host_limit)
+        self.per_host_limit = per_host_limit
+        self.on_success = on_success
+        self.on_failure = on_failure
+
+        self.host_slots = {}
+        self.host_lock = threading.Lock()
+        self.queued_outputs = set()      # Output paths already queued in this run
+
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"download-{i}", daemon=True)
+            for i in range(workers)     # 0 leaves every job to the caller's process()
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _host_slot(self, url):
+        # One semaphore per host caps the number of parallel transfers against the same server
+        host = urlparse(url).hostname or ""
+        with self.host_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.Semaphore(self.per_host_limit)
+            return self.host_slots[host]
+
+    def submit(self, job):
+        with self.host_lock:
+            if job["output_path"] in self.queued_outputs:
+                logger.info(f"'{job['title']}' is already queued. Skipping.")
+                return False
+            self.queued_outputs.add(job["output_path"])
+
+        self.jobs.put(job)
+        return True
+
+    def run_job(self, job):
+        if job.get("engine") == "live":
+            # Runs for as long as the session is broadcasting; uploaded from disk once finalized
+            try:
+                capture_live(job["url"], job.get("source_path", job["output_path"]), headers=job["headers"],
+                             client=self.http, end_timeout=job.get("end_timeout", 300),
+                             audio_only=job.get("audio_only", False), max_height=job.get("max_height"),
+                             source=self.source)
+                return
+            except HlsUnsupported as e:
+                logger.info(f"Falling back to ffmpeg for '{job['title']}': {e}")
+                ratelimit.pace(job["url"])
+                subprocess.run(job["command"], check=True)
+                return
+
+        # A job with a transcode lands on disk first and is uploaded once converted
+        if self.storage is not None and job.get("storage_key") and not job.get("transcode"):
+            return self.stream_job(job)
+
+        if job.get("engine") == "hls":
+            try:
+                download_hls(job["url"], job.get("source_path", job["output_path"]), headers=job["headers"],
+                             workers=self.hls_segment_workers, client=self.http, source=self.source,
+                             audio_only=job.get("audio_only", False), max_height=job.get("max_height"))
+                return
+            except HlsUnsupported as e:
+                logger.info(f"Falling back to ffmpeg for '{job['title']}': {e}")
+
+        ratelimit.pace(job["url"])
+        if job.get("engine") == "ytdlp" and self.ytdlp is not None:
+            self.ytdlp.download(job, job.get("source_path", job["output_path"]), progress=partial(self._progress, job))
+            return
+        subprocess.run(job["command"], check=True)
+
+    def _progress(self, job, status, done, total, speed):
+        # Reported by the yt-dlp engine about once a second; logs each quarter of the transfer
+        quarter = int(done * 4 / total) if total else 0
+        if status == "finished" or quarter > job.get("progress_quarter", 0):
+            job["progress_quarter"] = quarter
+            logger.info(f"'{job['title']}': {done / 1e6:.1f}/{total / 1e6:.1f} MB at {speed / 1e6:.2f} MB/s ({status})")
+
+    def stream_job(self, job):
+        key = job["storage_key"]
+        resume_path = job["output_path"] + ".upload.json"     # Part tracking for a resumed upload
+
+        def upload(stream, check):
+            counted = CountingReader(stream)
+            try:
+                return self.storage.upload_stream(key, counted, resume_path=resume_path, check=check)
+            finally:
+                job["bytes"] = counted.count
+
+        if job.get("engine") == "hls":
+            try:
+                job["stored_at"] = download_hls(job["url"], job["output_path"], headers=job["headers"],
+                                                workers=self.hls_segment_workers, client=self.http, upload=upload,
+                                                source=self.source, audio_only=job.get("audio_only", False),
+                                                max_height=job.get("max_height"))
+                return
+            except HlsUnsupported as e:
+                logger.info(f"Falling back to ffmpeg for '{job['title']}': {e}")
+
+        # The tool writes to stdout and every full part is uploaded while the transfer is still running
+        ratelimit.pace(job["url"])
+        process = subprocess.Popen(job["stream_command"], stdout=subprocess.PIPE)
+
+        def check():
+            process.stdout.close()
+            if process.wait() != 0:
+                raise subprocess.CalledProcessError(process.returncode, job["stream_command"])
+
+        try:
+            job["stored_at"] = upload(process.stdout, check)
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def _worker(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            try:
+                self.process(job)
+            finally:
+                self.jobs.task_done()
+
+    def process(self, job):
+        # Run one job through dedup, the host slot and the callbacks; returns "success", "duplicate" or "failed".
+        # Used by the worker threads, and directly by job queue workers on a pool built with workers=0.
+        claimed = False
+        try:
+            if self.dedup is not None:
+                owner = self.dedup.claim(job)
+                if owner is not None:
+                    logger.info(f"'{job['title']}' is the same recording as '{owner}'. Skipping.")
+                    metrics.record_download(self.source, 0, 0, outcome="duplicate")
+                    self._callback(self.on_duplicate, job, owner)
+                    return "duplicate"
+                claimed = True
+
+            self._attempts(job)
+
+        except Exception as e:
+            job["failure"] = classify(e)
+            logger.info(f"Failed to download '{job['title']}' ({job['failure']}): {e}")
+            if claimed:
+                self.dedup.release(job)
+            if self.storage is not None:
+                # No attempt is left to finish the multipart upload, so its stored parts are dropped
+                self.storage.abort(job["output_path"] + ".upload.json")
+            metrics.record_download(self.source, 0, 0, outcome="failed")
+            job["error"] = str(e)
+            self._callback(self.on_failure, job, e)
+            return "failed"
+
+        logger.info(f"Downloaded '{job['title']}' in {job['elapsed'] / 60:.2f} min")
+        metrics.record_download(self.source, self._job_size(job), job["elapsed"])
+        if claimed:
+            self._callback(self.dedup.commit, job)
+        self._callback(self.on_success, job)
+        return "success"
+
+    def _attempts(self, job):
+        # Retry failures that may pass on a second try, waiting out the per-host backoff before each one
+        host = urlparse(job["url"]).hostname or ""
+        attempt = 1
+        while True:
+            self.backoff.wait(host)
+            try:
+                with self._host_slot(job["url"]):
+                    logger.info(f"Downloading '{job['title']}'...")
+                    start_time = time.time()
+                    self.run_job(job)
+                    self._check_output(job)
+                    job["elapsed"] = time.time() - start_time
+                # Outside the host slot, transcoding and probing are local work; a corrupt file is retried like a
+                # failed transfer
+                if job.get("transcode"):
+                    transcode(job, self.source)
+                if self.verifier is not None and "stored_at" not in job:
+                    self.verifier.verify(job)
+                if self.storage is not None and job.get("storage_key") and "stored_at" not in job:
+                    self.upload_file(job)
+            except Exception as e:
+                if attempt >= self.backoff.max_attempts or not retryable(e):
+                    raise
+                delay = self.backoff.failure(host)
+                logger.info(f"Retrying '{job['title']}' in {delay:.0f}s after a {classify(e)} failure: {e}")
+                metrics.inc("scraper_download_retries_total", self.source, reason=classify(e))
+                # ffmpeg will not overwrite a partial file, and yt-dlp resumes from its own .part file
+                for path in {job["output_path"], job.get("source_path", job["output_path"])}:
+                    if os.path.exists(path):
+                        os.remove(path)
+                attempt += 1
+            else:
+                self.backoff.success(host)
+                return
+
+    def _check_output(self, job):
+        # A tool can exit 0 without writing anything, e.g. when the stream ended before the first packet
+        if "stored_at" in job:
+            return
+        path = job.get("source_path", job["output_path"])
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            raise TruncatedOutput(f"No output written to {path}")
+
+    def upload_file(self, job):
+        # Transcoded output is uploaded from disk; afterwards only the stored copy is kept, as for streamed jobs
+        with open(job["output_path"], "rb") as file:
+            counted = CountingReader(file)
+            job["stored_at"] = self.storage.upload_stream(job["storage_key"], counted,
+                                                          resume_path=job["output_path"] + ".upload.json")
+        job["bytes"] = counted.count
+        os.remove(job["output_path"])
+
+    def _job_size(self, job):
+        # Streamed jobs count their bytes on the way out; local files are measured on disk
+        if "bytes" in job:
+            return job["bytes"]
+        try:
+            return os.path.getsize(job["output_path"])
+        except OSError:
+            return 0
+
+    def _callback(self, callback, *args):
+        # A broken callback must not take the worker thread down with it
+        if callback is None:
+            return
+        try:
+            callback(*args)
+        except Exception as e:
+            logger.exception(f"Download callback failed: {e}")
+
+    def join(self):
+        # Wait for every queued job, then stop the workers
+        self.jobs.join()
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.http.close()
+        if self.ytdlp is not None:
+            self.ytdlp.close()
+        if self.verifier is not None:
+            self.verifier.close()
+
+
+def make_pool(config, ledger, source, on_success=None, on_failure=None, on_duplicate=None, workers=None, ytdlp=True):
+    # Pool wired from a source config: storage, retry backoff, output checks and, unless switched off, yt-dlp.
+    # Returns the dedup index with it (None when disabled), to be closed once the pool has been joined.
+    # Re-posts of something already stored are dropped before any bytes are transferred
+    dedup = make_dedup(config, ledger)
+    pool = DownloadPool(
+        workers=config.get("download_workers", 4) if workers is None else workers,
+        per_host_limit=config.get("per_host_downloads", 2),
+        hls_segment_workers=config.get("hls_segment_workers", 8),
+        storage=make_storage(config),
+        backoff=make_backoff(config),
+        verifier=make_verifier(config, ledger, source),
+        ytdlp=make_ytdlp_engine(config) if ytdlp else None,
+        on_success=on_success,
+        on_failure=on_failure,
+        dedup=dedup,
+        on_duplicate=on_duplicate,
+        source=source,
+    )
+    return pool, dedup
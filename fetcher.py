@@ -0,0 +1,207 @@
+# Description: Pluggable page fetchers. Plain HTTP + HTML parsing for static listings, with Selenium only as a fallback.
+import re
+import logging
+from html.parser import HTMLParser
+
+from http_client import HttpClient, HttpError
+from waits import wait_for_network_idle
+import ratelimit
+import metrics
+
+logger = logging.getLogger(__name__)
+
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+# Tags whose end tag is optional: opening one of the keys closes any open tag in the value set first
+IMPLICIT_CLOSE = {
+    "li": {"li"},
+    "p": {"p"},
+    "tr": {"tr", "td", "th"},
+    "td": {"td", "th"},
+    "th": {"td", "th"},
+    "option": {"option"},
+}
+
+
+class FetchError(Exception):
+    pass
+
+
+class Node:
+    def __init__(self, tag, attrs=None, parent=None):
+        self.tag = tag
+        self.attrs = dict(attrs or {})
+        self.parent = parent
+        self.children = []      # Nodes and text strings, in document order
+
+    def get(self, name, default=None):
+        return self.attrs.get(name, default)
+
+    def classes(self):
+        return (self.attrs.get("class") or "").split()
+
+    def elements(self):
+        return [child for child in self.children if isinstance(child, Node)]
+
+    def iter(self):
+        for child in self.elements():
+            yield child
+            yield from child.iter()
+
+    def find_all(self, tag=None, cls=None):
+        wanted = cls.split() if cls else []
+        return [
+            node for node in self.iter()
+            if (tag is None or node.tag == tag) and all(c in node.classes() for c in wanted)
+        ]
+
+    def find(self, tag=None, cls=None):
+        matches = self.find_all(tag, cls)
+        return matches[0] if matches else None
+
+    def text(self):
+        # Same whitespace handling as WebElement.text: runs of whitespace collapse to one space
+        parts = []
+
+        def collect(node):
+            for child in node.children:
+                if isinstance(child, Node):
+                    if child.tag == "br":
+                        parts.append(" ")
+                    elif child.tag not in ("script", "style"):
+                        collect(child)
+                else:
+                    parts.append(child)
+
+        collect(self)
+        return re.sub(r"\s+", " ", "".join(parts)).strip()
+
+
+class TreeBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = Node("#document")
+        self.stack = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        closes = IMPLICIT_CLOSE.get(tag)
+        if closes:
+            while self.stack[-1].tag in closes:
+                self.stack.pop()
+
+        node = Node(tag, attrs, self.stack[-1])
+        self.stack[-1].children.append(node)
+        if tag not in VOID_TAGS:
+            self.stack.append(node)
+
+    def handle_startendtag(self, tag, attrs):
+        self.stack[-1].children.append(Node(tag, attrs, self.stack[-1]))
+
+    def handle_endtag(self, tag):
+        # Pop back to the matching open tag; stray end tags are ignored like a browser would
+        for i in range(len(self.stack) - 1, 0, -1):
+            if self.stack[i].tag == tag:
+                del self.stack[i:]
+                return
+
+    def handle_data(self, data):
+        self.stack[-1].children.append(data)
+
+
+def parse_html(html):
+    builder = TreeBuilder()
+    builder.feed(html)
+    builder.close()
+    return builder.root
+
+
+class Page:
+    def __init__(self, url, html, status=200, headers=None, via="http"):
+        self.url = url
+        self.html = html
+        self.status = status
+        self.headers = headers or {}
+        self.via = via
+        self.root = parse_html(html)
+
+
+class HttpFetcher:
+    via = "http"
+
+    def __init__(self, client=None, headers=None):
+        self.client = client or HttpClient(headers=headers)
+
+    def fetch(self, url, headers=None):
+        response = self.client.get(url, headers=headers)
+        try:
+            response.raise_for_status()
+        except HttpError as e:
+            raise FetchError(str(e))
+        return Page(response.url, response.text(), response.status, response.headers, via="http")
+
+    def close(self):
+        self.client.close()
+
+
+class SeleniumFetcher:
+    via = "selenium"
+
+    def __init__(self, browsers, source, settle=3):
+        self.browsers = browsers
+        self.source = source
+        self.settle = settle    # The fixed sleep this page used to get, for the wait savings report
+        self.driver = None
+
+    def fetch(self, url, headers=None):
+        # A browser is only leased from the pool the first time a page actually needs it
+        if self.driver is None:
+            self.driver = self.browsers.acquire(self.source)
+        with ratelimit.request(url):
+            self.driver.get(url)
+        wait_for_network_idle(self.driver, self.source, legacy_sleep=self.settle)
+        return Page(self.driver.current_url, self.driver.page_source, via="selenium")
+
+    def close(self):
+        if self.driver is not None:
+            self.browsers.release(self.driver)
+            self.driver = None
+
+
+class FallbackFetcher:
+    def __init__(self, fetchers, source=None):
+        self.fetchers = fetchers
+        self.source = source
+
+    def fetch(self, url, ready=None, headers=None):
+        # Try each fetcher in order until one returns a page that passes the ready check
+        last_error = None
+        for fetcher in self.fetchers:
+            try:
+                with metrics.stage(self.source, f"page_load_{fetcher.via}"):
+                    page = fetcher.fetch(url, headers=headers)
+            except Exception as e:
+                last_error = e
+                logger.info(f"{type(fetcher).__name__} failed for {url}: {e}")
+                continue
+
+            # 304 Not Modified answers a conditional request, there is no body to check
+            if page.status == 304 or ready is None or ready(page):
+                return page
+            last_error = FetchError(f"{type(fetcher).__name__} page for {url} is missing the expected content")
+            logger.info(str(last_error))
+
+        raise last_error or FetchError(f"No fetcher configured for {url}")
+
+    def close(self):
+        for fetcher in self.fetchers:
+            fetcher.close()
+
+
+def make_fetcher(browsers=None, source=None, settle=3, use_http=True):
+    # HTTP first, Selenium as fallback (or only Selenium when the fast path is switched off)
+    fetchers = []
+    if use_http:
+        fetchers.append(HttpFetcher())
+    if browsers is not None:
+        fetchers.append(SeleniumFetcher(browsers, source, settle=settle))
+    return FallbackFetcher(fetchers, source)
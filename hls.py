@@ -0,0 +1,340 @@
+# Description: Native HLS downloader. Fetches playlist segments in parallel over a pooled HTTP client, keeps a resumable manifest and remuxes to MP4 with ffmpeg at the end.
+import os
+import json
+import shutil
+import logging
+import contextlib
+import threading
+import subprocess
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
+
+from http_client import HttpClient
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class HlsUnsupported(Exception):
+    # Raised for playlists this engine does not handle (encryption, byte ranges); callers fall back to ffmpeg
+    pass
+
+
+class PlaylistError(ValueError):
+    # The URL did not lead to a usable playlist, so retrying the same URL will not help
+    pass
+
+
+def parse_attributes(line):
+    # Parse 'KEY=VALUE,KEY="quoted,value"' attribute lists
+    attributes = {}
+    _, _, rest = line.partition(":")
+    key, value, in_quotes = "", "", False
+    reading_key = True
+    for char in rest + ",":
+        if reading_key:
+            if char == "=":
+                reading_key = False
+            else:
+                key += char
+        elif char == '"':
+            in_quotes = not in_quotes
+        elif char == "," and not in_quotes:
+            attributes[key.strip()] = value
+            key, value, reading_key = "", "", True
+        else:
+            value += char
+    return attributes
+
+
+def parse_playlist(text, base_url):
+    playlist = {"variants": [], "audio": [], "segments": [], "init": None, "endlist": False, "media_sequence": 0,
+                "target_duration": None, "discontinuity_sequence": 0}
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines or lines[0] != "#EXTM3U":
+        raise PlaylistError(f"Not an HLS playlist: {base_url}")
+
+    pending_variant = None
+    pending_duration = None
+    discontinuities = 0     # EXT-X-DISCONTINUITY tags seen so far; segments count from the discontinuity sequence
+    for line in lines[1:]:
+        if line.startswith("#EXT-X-STREAM-INF"):
+            attributes = parse_attributes(line)
+            pending_variant = {
+                "bandwidth": int(attributes.get("BANDWIDTH", 0)),
+                "resolution": attributes.get("RESOLUTION"),
+                "codecs": attributes.get("CODECS"),
+            }
+        elif line.startswith("#EXT-X-MEDIA:"):
+            # Alternative audio renditions; the only way to fetch audio alone when the variants are muxed video
+            attributes = parse_attributes(line)
+            if attributes.get("TYPE") == "AUDIO" and attributes.get("URI"):
+                playlist["audio"].append({"uri": urljoin(base_url, attributes["URI"]),
+                                          "default": attributes.get("DEFAULT") == "YES"})
+        elif line.startswith("#EXTINF"):
+            pending_duration = float(line.split(":", 1)[1].split(",")[0])
+        elif line.startswith("#EXT-X-MEDIA-SEQUENCE"):
+            playlist["media_sequence"] = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION"):
+            playlist["target_duration"] = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-DISCONTINUITY-SEQUENCE"):
+            playlist["discontinuity_sequence"] = int(line.split(":", 1)[1])
+        elif line == "#EXT-X-DISCONTINUITY":
+            discontinuities += 1
+        elif line.startswith("#EXT-X-ENDLIST"):
+            playlist["endlist"] = True
+        elif line.startswith("#EXT-X-KEY"):
+            if parse_attributes(line).get("METHOD", "NONE") != "NONE":
+                raise HlsUnsupported("Encrypted HLS playlist")
+        elif line.startswith("#EXT-X-BYTERANGE"):
+            raise HlsUnsupported("Byte-range HLS playlist")
+        elif line.startswith("#EXT-X-MAP"):
+            playlist["init"] = urljoin(base_url, parse_attributes(line)["URI"])
+        elif line.startswith("#"):
+            continue
+        elif pending_variant is not None:
+            pending_variant["uri"] = urljoin(base_url, line)
+            playlist["variants"].append(pending_variant)
+            pending_variant = None
+        else:
+            # "discontinuity" numbers the run of segments with continuous timestamps, "init" is the map they use
+            playlist["segments"].append({"uri": urljoin(base_url, line), "duration": pending_duration or 0.0,
+                                         "discontinuity": playlist["discontinuity_sequence"] + discontinuities,
+                                         "init": playlist["init"]})
+            pending_duration = None
+
+    return playlist
+
+
+AUDIO_CODECS = ("mp4a", "opus", "ac-3", "ec-3", "mp3", "flac")
+
+
+def is_audio_only(variant):
+    codecs = [c.strip() for c in (variant.get("codecs") or "").split(",") if c.strip()]
+    return bool(codecs) and all(c.startswith(AUDIO_CODECS) for c in codecs)
+
+
+def variant_height(variant):
+    resolution = variant.get("resolution") or ""
+    return int(resolution.split("x")[1]) if "x" in resolution else None
+
+
+def choose_variant(variants, audio_only=False, max_height=None):
+    # Highest bandwidth rendition (what ffmpeg picks) unless the output profile needs less: for audio an
+    # audio-only variant, else the cheapest one since the video is dropped; for a proxy the best one that fits
+    if audio_only:
+        audio = [v for v in variants if is_audio_only(v)]
+        if audio:
+            return max(audio, key=lambda v: v["bandwidth"])
+        return min(variants, key=lambda v: v["bandwidth"])
+    if max_height:
+        fitting = [v for v in variants if (variant_height(v) or 0) and variant_height(v) <= max_height]
+        if fitting:
+            return max(fitting, key=lambda v: v["bandwidth"])
+        return min(variants, key=lambda v: v["bandwidth"])
+    return max(variants, key=lambda v: v["bandwidth"])
+
+
+def resolve_media_playlist(client, url, headers=None, audio_only=False, max_height=None):
+    # Follow the master playlist down to a media playlist
+    playlist = parse_playlist(client.get(url, headers=headers).raise_for_status().text(), url)
+    while playlist["variants"]:
+        if audio_only and playlist["audio"]:
+            rendition = next((a for a in playlist["audio"] if a["default"]), playlist["audio"][0])
+            url = rendition["uri"]
+            playlist = parse_playlist(client.get(url, headers=headers).raise_for_status().text(), url)
+            break
+        url = choose_variant(playlist["variants"], audio_only, max_height)["uri"]
+        playlist = parse_playlist(client.get(url, headers=headers).raise_for_status().text(), url)
+    return url, playlist
+
+
+def load_manifest(manifest_path, playlist_url):
+    # Segments finished since the manifest was last written are listed in its log, one index per line
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+        if manifest.get("playlist") == playlist_url:
+            with contextlib.suppress(FileNotFoundError), open(manifest_path + ".log", "r") as file:
+                # A line cut off by a crash is skipped, that segment is simply fetched again
+                manifest["done"] += [int(line) for line in file if line.strip().isdigit()]
+            return manifest
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {"playlist": playlist_url, "done": []}
+
+
+def save_manifest(manifest, manifest_path):
+    # Write to a temp file first so a crash never leaves a half-written manifest behind
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file)
+    os.replace(tmp_path, manifest_path)
+
+
+def audio_codec(path):
+    # Codec name of the first audio stream, None without audio or when ffprobe cannot tell
+    try:
+        result = subprocess.run(["ffprobe", "-v", "error", "-select_streams", "a:0", "-show_entries",
+                                 "stream=codec_name", "-of", "default=noprint_wrappers=1:nokey=1", path],
+                                capture_output=True, text=True)
+    except FileNotFoundError:
+        return None
+    return result.stdout.strip() or None
+
+
+def audio_filters(input_path):
+    # ADTS AAC from MPEG-TS needs its headers rewritten for MP4; the filter rejects any other codec (MP3, Opus)
+    return ["-bsf:a", "aac_adtstoasc"] if audio_codec(input_path) == "aac" else []
+
+
+def remux(input_path, output_path):
+    ffmpeg_command = [
+        "ffmpeg", "-y",
+        "-i", input_path,
+        "-c", "copy",           # Copy the codecs without re-encoding
+        *audio_filters(input_path),
+        output_path
+    ]
+    subprocess.run(ffmpeg_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def remux_parts(input_paths, output_path):
+    # Parts split at discontinuities restart their timestamps (and may change encoder settings); the concat
+    # demuxer offsets each one to follow the previous, where a byte-level join would confuse the muxer
+    list_path = output_path + ".concat.txt"
+    with open(list_path, "w") as file:
+        for path in input_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            file.write(f"file '{escaped}'\n")
+    ffmpeg_command = [
+        "ffmpeg", "-y",
+        "-f", "concat", "-safe", "0",
+        "-i", list_path,
+        "-c", "copy",
+        *audio_filters(input_paths[0]),
+        output_path
+    ]
+    try:
+        subprocess.run(ffmpeg_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    finally:
+        os.remove(list_path)
+
+
+def remux_to_pipe(input_path, upload):
+    # Fragmented MP4 can be written to a pipe, so the result streams straight into storage
+    ffmpeg_command = [
+        "ffmpeg",
+        "-i", input_path,
+        "-c", "copy",
+        *audio_filters(input_path),
+        "-movflags", "frag_keyframe+empty_moov",
+        "-f", "mp4", "pipe:1"
+    ]
+    process = subprocess.Popen(ffmpeg_command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def check():
+        process.stdout.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, ffmpeg_command)
+
+    try:
+        return upload(process.stdout, check)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def download_hls(url, output_path, headers=None, workers=8, client=None, keep_parts=False, upload=None, source=None,
+                 audio_only=False, max_height=None):
+    # upload(stream, check), when given, receives the remuxed MP4 instead of it being written to output_path
+    own_client = client is None
+    client = client or HttpClient(max_idle_per_host=workers)
+    work_dir = output_path + ".parts"
+    os.makedirs(work_dir, exist_ok=True)
+
+    try:
+        media_url, playlist = resolve_media_playlist(client, url, headers, audio_only, max_height)
+        if not playlist["segments"]:
+            raise PlaylistError(f"No segments in playlist: {media_url}")
+
+        # Timestamps restart at every discontinuity, so each run of segments is joined and remuxed as a part of
+        # its own, starting with the init section it maps to
+        segments, groups = [], []
+        for segment in playlist["segments"]:
+            if not groups or segment["discontinuity"] != segments[groups[-1][-1]]["discontinuity"]:
+                groups.append([])
+                if segment["init"]:
+                    groups[-1].append(len(segments))
+                    segments.append({"uri": segment["init"], "duration": 0.0, "discontinuity": segment["discontinuity"]})
+            groups[-1].append(len(segments))
+            segments.append(segment)
+
+        manifest_path = os.path.join(work_dir, "manifest.json")
+        manifest = load_manifest(manifest_path, media_url)
+        done = set(manifest["done"])
+        # The log is folded into the manifest once per run; after that each segment only appends a line
+        manifest["done"] = sorted(done)
+        save_manifest(manifest, manifest_path)
+        manifest_log = open(manifest_path + ".log", "w")
+        manifest_lock = threading.Lock()
+
+        def segment_path(index):
+            return os.path.join(work_dir, f"seg_{index:06d}")
+
+        def fetch(index):
+            body = client.get(segments[index]["uri"], headers=headers).raise_for_status().body
+            with open(segment_path(index) + ".tmp", "wb") as file:
+                file.write(body)
+            os.replace(segment_path(index) + ".tmp", segment_path(index))
+
+            # Record the segment as soon as it is on disk so a restart skips it
+            with manifest_lock:
+                manifest_log.write(f"{index}\n")
+                manifest_log.flush()
+
+        pending = [i for i in range(len(segments)) if i not in done or not os.path.exists(segment_path(i))]
+        logger.info(f"HLS: {len(segments) - len(pending)}/{len(segments)} segments already on disk for {output_path}")
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(fetch, i) for i in pending]:
+                    future.result()
+        finally:
+            manifest_log.close()
+
+        # Join the segments of each part in playlist order, then remux to the final container
+        joined_paths = []
+        for number, group in enumerate(groups):
+            extension = os.path.splitext(segments[group[-1]]["uri"].split("?")[0])[1]
+            joined_paths.append(os.path.join(work_dir, f"joined_{number:03d}{extension}"))
+            with open(joined_paths[-1], "wb") as joined:
+                for i in group:
+                    with open(segment_path(i), "rb") as part:
+                        shutil.copyfileobj(part, joined)
+
+        with metrics.stage(source, "post_process"):
+            if len(joined_paths) == 1 and upload:
+                stored_at = remux_to_pipe(joined_paths[0], upload)
+            elif len(joined_paths) == 1:
+                remux(joined_paths[0], output_path)
+                stored_at = output_path
+            elif upload:
+                # The parts are concatenated into a plain MP4 on disk first, it cannot be written to a pipe
+                remuxed_path = os.path.join(work_dir, "remuxed" + os.path.splitext(output_path)[1])
+                remux_parts(joined_paths, remuxed_path)
+                with open(remuxed_path, "rb") as remuxed:
+                    stored_at = upload(remuxed, None)
+            else:
+                remux_parts(joined_paths, output_path)
+                stored_at = output_path
+
+    finally:
+        if own_client:
+            client.close()
+
+    if not keep_parts:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    return stored_at
@@ -0,0 +1,131 @@
+# Description: Small pooled HTTP client on top of http.client. Keeps connections alive per host so repeated requests skip the TCP/TLS handshake.
+import ssl
+import threading
+import http.client
+from urllib.parse import urlparse, urljoin
+
+import ratelimit
+
+user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
+
+
+class HttpError(Exception):
+    def __init__(self, status, url):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+
+
+class Response:
+    def __init__(self, status, headers, body, url):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HttpError(self.status, self.url)
+        return self
+
+
+class HttpClient:
+    def __init__(self, max_idle_per_host=8, timeout=30, headers=None, verify=True, limiter=None):
+        self.max_idle_per_host = max_idle_per_host
+        self.limiter = limiter or ratelimit.limiter
+        self.timeout = timeout
+        self.headers = {"User-Agent": user_agent}
+        self.headers.update(headers or {})
+
+        self.ssl_context = ssl.create_default_context()
+        if not verify:
+            self.ssl_context.check_hostname = False
+            self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        self.idle = {}      # (scheme, host, port) -> idle connections ready for reuse
+        self.lock = threading.Lock()
+
+    def _connect(self, key):
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout, context=self.ssl_context)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _checkout(self, key):
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._connect(key), False
+
+    def _checkin(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, url, headers=None, max_redirects=5, max_body=None):
+        # max_body caps how much of the body is read, for probes against servers that may ignore Range
+        for _ in range(max_redirects + 1):
+            parsed = urlparse(url)
+            port = parsed.port or (443 if parsed.scheme == "https" else 80)
+            key = (parsed.scheme, parsed.hostname, port)
+            path = parsed.path or "/"
+            if parsed.query:
+                path += "?" + parsed.query
+
+            request_headers = dict(self.headers)
+            request_headers.update(headers or {})
+
+            # Every request, redirects and HLS segments included, is paced by the per-host limiter
+            with self.limiter.request(url) as permit:
+                conn, reused = self._checkout(key)
+                try:
+                    conn.request(method, path, headers=request_headers)
+                    raw = conn.getresponse()
+                    body = raw.read(max_body) if max_body else raw.read()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    conn.close()
+                    if not reused:
+                        raise
+                    # The server dropped an idle keep-alive connection, retry once on a fresh one
+                    conn = self._connect(key)
+                    conn.request(method, path, headers=request_headers)
+                    raw = conn.getresponse()
+                    body = raw.read(max_body) if max_body else raw.read()
+                except Exception:
+                    conn.close()
+                    raise
+
+                response_headers = {k.lower(): v for k, v in raw.getheaders()}
+                permit.done(raw.status, response_headers)
+
+            if raw.will_close or not raw.isclosed():
+                conn.close()    # Unread body left on the socket, the connection can't be reused
+            else:
+                self._checkin(key, conn)
+
+            if raw.status in (301, 302, 303, 307, 308) and "location" in response_headers:
+                url = urljoin(url, response_headers["location"])
+                if raw.status == 303:
+                    method = "GET"
+                continue
+
+            return Response(raw.status, response_headers, body, url)
+
+        raise HttpError(raw.status, url)
+
+    def get(self, url, headers=None, max_body=None):
+        return self.request("GET", url, headers=headers, max_body=max_body)
+
+    def close(self):
+        with self.lock:
+            for idle in self.idle.values():
+                for conn in idle:
+                    conn.close()
+            self.idle = {}
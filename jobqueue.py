@@ -0,0 +1,563 @@
+# Description: Job queue shared by scraper nodes. Discovery (source + date range), resolve (event page -> media URL) and download jobs are claimed under leases kept alive by heartbeats, with at-least-once delivery. SQLite for one host or a shared disk, Redis across nodes.
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+import logging
+import argparse
+import threading
+from functools import partial
+
+from download_pool import make_pool
+from resolve_cache import make_resolve_cache
+from ledger import open_ledger, record_job, SUCCESS, FAILED, DUPLICATE
+import profiles
+import ratelimit
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DISCOVER = "discover"
+RESOLVE = "resolve"
+DOWNLOAD = "download"
+KINDS = [DISCOVER, RESOLVE, DOWNLOAD]
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+DEAD = "dead"       # Out of attempts, left for a person to look at
+
+DEFAULT_SETTINGS = {
+    "backend": "sqlite",
+    "path": "/jobs.db",
+    "redis_url": "redis://localhost:6379/0",
+    "redis_prefix": "scraper",
+    "lease_seconds": 300,       # A worker that stops heartbeating loses its job after this long
+    "max_attempts": 5,
+    "retry_delay": 60,          # Seconds before a failed job is offered again, doubled per attempt
+    "poll_interval": 5,
+    "worker_threads": 4,
+}
+
+
+class SqliteQueue:
+    def __init__(self, db_path, max_attempts=5):
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+
+        # Autocommit connection so claim() can take the write lock up front with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                key TEXT,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                max_attempts INTEGER NOT NULL,
+                available_at REAL NOT NULL,
+                lease_owner TEXT,
+                lease_expires REAL,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (kind, status, available_at);
+            -- The same work is only queued once while it is pending; it can be queued again once settled
+            CREATE UNIQUE INDEX IF NOT EXISTS jobs_pending_key ON jobs (key) WHERE status IN ('queued', 'leased');
+        """)
+
+    def put(self, kind, payload, key=None, delay=0):
+        # Returns the job id, or None when a job with the same key is already pending
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                """INSERT OR IGNORE INTO jobs (kind, payload, key, status, max_attempts, available_at, created, updated)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (kind, json.dumps(payload), key, QUEUED, self.max_attempts, now + delay, now, now),
+            )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def claim(self, worker, kinds=None, lease_seconds=300):
+        # Lease the oldest ready job of the given kinds. A leased job whose lease ran out belongs to a worker
+        # that died or hung, so it is handed out again.
+        kinds = kinds or KINDS
+        marks = ",".join("?" * len(kinds))
+        now = time.time()
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute(
+                    f"""UPDATE jobs SET status = ?, error = 'lease expired after last attempt', updated = ?
+                        WHERE status = ? AND lease_expires < ? AND attempts >= max_attempts AND kind IN ({marks})""",
+                    (DEAD, now, LEASED, now, *kinds),
+                )
+                row = self.conn.execute(
+                    f"""SELECT id, kind, payload, attempts FROM jobs
+                        WHERE kind IN ({marks})
+                          AND ((status = ? AND available_at <= ?) OR (status = ? AND lease_expires < ?))
+                        ORDER BY available_at, id LIMIT 1""",
+                    (*kinds, QUEUED, now, LEASED, now),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        """UPDATE jobs SET status = ?, lease_owner = ?, lease_expires = ?, attempts = attempts + 1, updated = ?
+                           WHERE id = ?""",
+                        (LEASED, worker, now + lease_seconds, now, row[0]),
+                    )
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+        if row is None:
+            return None
+        return {"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1}
+
+    def heartbeat(self, job_id, worker, lease_seconds=300):
+        # False means the lease was lost and another worker may already be running the job
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND status = ? AND lease_owner = ?",
+                (now + lease_seconds, now, job_id, LEASED, worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker):
+        with self.lock:
+            cursor = self.conn.execute(
+                "UPDATE jobs SET status = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+                "WHERE id = ? AND status = ? AND lease_owner = ?",
+                (DONE, time.time(), job_id, LEASED, worker),
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error, retry_delay=60):
+        # Back to the queue after retry_delay, or dead once every attempt is used up
+        now = time.time()
+        with self.lock:
+            cursor = self.conn.execute(
+                """UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END,
+                       available_at = ?, lease_owner = NULL, lease_expires = NULL, error = ?, updated = ?
+                   WHERE id = ? AND status = ? AND lease_owner = ?""",
+                (DEAD, QUEUED, now + retry_delay, str(error), now, job_id, LEASED, worker),
+            )
+        return cursor.rowcount == 1
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT kind, status, COUNT(*) FROM jobs GROUP BY kind, status").fetchall()
+        counts = {}
+        for kind, status, count in rows:
+            counts.setdefault(kind, {})[status] = count
+        return counts
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# Moves the oldest ready job of one kind to the leases and marks it leased, as one step: a worker that dies
+# between the two can no longer leave a job in neither set. KEYS: ready set, leases; ARGV: now, lease expiry,
+# job hash prefix, leased status, worker. Returns [id, attempts, payload] or nil.
+CLAIM_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 1)
+if #ids == 0 then
+    return false
+end
+local id = ids[1]
+local job = ARGV[3] .. id
+redis.call('ZREM', KEYS[1], id)
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+local attempts = redis.call('HINCRBY', job, 'attempts', 1)
+redis.call('HSET', job, 'status', ARGV[4], 'lease_owner', ARGV[5], 'updated', ARGV[1])
+return {id, attempts, redis.call('HGET', job, 'payload')}
+"""
+
+
+# Queues a job as one step: a crash can no longer leave a pending key behind with no job to clear it. KEYS: id
+# counter, pending key ("" for none), ready set; ARGV: job hash prefix, kind, payload, key, status, max attempts,
+# now, available at. Returns the job id, or nil when a job with the same key is pending.
+PUT_SCRIPT = """
+local id = redis.call('INCR', KEYS[1])
+if KEYS[2] ~= '' and not redis.call('SET', KEYS[2], id, 'NX') then
+    return false
+end
+redis.call('HSET', ARGV[1] .. id, 'kind', ARGV[2], 'payload', ARGV[3], 'key', ARGV[4], 'status', ARGV[5],
+           'attempts', 0, 'max_attempts', ARGV[6], 'created', ARGV[7], 'updated', ARGV[7])
+redis.call('ZADD', KEYS[3], ARGV[8], id)
+return id
+"""
+
+# Takes back every expired lease: the job goes to its ready set, or to dead when it was the last attempt. One
+# script, so a reaper that dies halfway cannot drop a job from the leases without putting it anywhere. KEYS:
+# leases; ARGV: now, job hash prefix, ready set prefix, pending key prefix, queued, dead, default max attempts.
+REAP_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+for _, id in ipairs(ids) do
+    redis.call('ZREM', KEYS[1], id)
+    local job = ARGV[2] .. id
+    local attempts = tonumber(redis.call('HGET', job, 'attempts') or 0)
+    local max_attempts = tonumber(redis.call('HGET', job, 'max_attempts') or ARGV[7])
+    if attempts >= max_attempts then
+        redis.call('HSET', job, 'status', ARGV[6], 'lease_owner', '', 'error', 'lease expired after last attempt',
+                   'updated', ARGV[1])
+        local pending = redis.call('HGET', job, 'key')
+        if pending and pending ~= '' then
+            redis.call('DEL', ARGV[4] .. pending)
+        end
+    else
+        redis.call('HSET', job, 'status', ARGV[5], 'lease_owner', '')
+        redis.call('ZADD', ARGV[3] .. redis.call('HGET', job, 'kind'), ARGV[1], id)
+    end
+end
+return #ids
+"""
+
+
+class RedisQueue:
+    # Same interface as SqliteQueue. Each kind has a sorted set of ready job ids scored by the time they become
+    # available, and one sorted set holds every lease scored by its expiry. Claims run as a Lua script, so only
+    # one worker can take a job and a claim is never half applied; elsewhere ZREM decides races.
+    def __init__(self, url, prefix="scraper", max_attempts=5):
+        import redis    # Only needed when the queue is shared through Redis
+
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self.put_script = self.redis.register_script(PUT_SCRIPT)
+        self.reap_script = self.redis.register_script(REAP_SCRIPT)
+        self.claim_script = self.redis.register_script(CLAIM_SCRIPT)
+
+    def _key(self, *parts):
+        return ":".join([self.prefix, *map(str, parts)])
+
+    def put(self, kind, payload, key=None, delay=0):
+        now = time.time()
+        job_id = self.put_script(
+            keys=[self._key("jobs", "next_id"), self._key("pending", key) if key is not None else "",
+                  self._key("ready", kind)],
+            args=[self._key("job", ""), kind, json.dumps(payload), key or "", QUEUED, self.max_attempts, now,
+                  now + delay],
+        )
+        return int(job_id) if job_id else None
+
+    def _settle(self, job_id, status, **fields):
+        job_key = self._key("job", job_id)
+        self.redis.hset(job_key, mapping=dict(fields, status=status, lease_owner="", updated=time.time()))
+        pending = self.redis.hget(job_key, "key")
+        if status in (DONE, DEAD) and pending:
+            self.redis.delete(self._key("pending", pending))
+
+    def _reap(self, now):
+        # Expired leases go back to their ready set, or to dead when they were the last attempt
+        self.reap_script(keys=[self._key("leases")],
+                         args=[now, self._key("job", ""), self._key("ready", ""), self._key("pending", ""), QUEUED,
+                               DEAD, self.max_attempts])
+
+    def claim(self, worker, kinds=None, lease_seconds=300):
+        now = time.time()
+        self._reap(now)
+        for kind in kinds or KINDS:
+            claimed = self.claim_script(keys=[self._key("ready", kind), self._key("leases")],
+                                        args=[now, now + lease_seconds, self._key("job", ""), LEASED, worker])
+            if claimed:
+                job_id, attempts, payload = claimed
+                return {"id": int(job_id), "kind": kind, "payload": json.loads(payload), "attempts": int(attempts)}
+        return None
+
+    def _owns(self, job_id, worker):
+        return self.redis.hget(self._key("job", job_id), "lease_owner") == worker
+
+    def heartbeat(self, job_id, worker, lease_seconds=300):
+        if not self._owns(job_id, worker):
+            return False
+        # xx: only extend a lease that still exists, never resurrect one the reaper already took back
+        return self.redis.zadd(self._key("leases"), {job_id: time.time() + lease_seconds}, xx=True, ch=True) == 1
+
+    def complete(self, job_id, worker):
+        if not self._owns(job_id, worker) or not self.redis.zrem(self._key("leases"), job_id):
+            return False
+        self._settle(job_id, DONE)
+        return True
+
+    def fail(self, job_id, worker, error, retry_delay=60):
+        if not self._owns(job_id, worker) or not self.redis.zrem(self._key("leases"), job_id):
+            return False
+        job = self.redis.hgetall(self._key("job", job_id))
+        if int(job["attempts"]) >= int(job["max_attempts"]):
+            self._settle(job_id, DEAD, error=str(error))
+        else:
+            self._settle(job_id, QUEUED, error=str(error))
+            self.redis.zadd(self._key("ready", job["kind"]), {job_id: time.time() + retry_delay})
+        return True
+
+    def stats(self):
+        counts = {}
+        for kind in KINDS:
+            counts[kind] = {QUEUED: self.redis.zcard(self._key("ready", kind))}
+        for job_id in self.redis.zrange(self._key("leases"), 0, -1):
+            kind = self.redis.hget(self._key("job", job_id), "kind")
+            counts.setdefault(kind, {})[LEASED] = counts.get(kind, {}).get(LEASED, 0) + 1
+        return counts
+
+    def close(self):
+        self.redis.close()
+
+
+def open_queue(settings=None):
+    settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+    if settings["backend"] == "redis":
+        return RedisQueue(settings["redis_url"], settings["redis_prefix"], settings["max_attempts"])
+    if settings["backend"] == "sqlite":
+        return SqliteQueue(settings["path"], settings["max_attempts"])
+    raise ValueError(f"Unknown queue backend '{settings['backend']}'")
+
+
+class QueueSink:
+    # Stands in for a DownloadPool inside a scraper: submitted jobs become download jobs on the queue
+    def __init__(self, jobs, source):
+        self.jobs = jobs
+        self.source = source
+
+    def submit(self, job):
+        # The output path names the recording, so a re-run of the same discovery does not queue it twice
+        job_id = self.jobs.put(DOWNLOAD, dict(job, source=self.source), key=f"{DOWNLOAD}:{job['output_path']}")
+        if job_id is None:
+            logger.info(f"'{job['title']}' is already queued. Skipping.")
+            return False
+        logger.info(f"Queued download of '{job['title']}'")
+        return True
+
+    def resolve(self, event):
+        self.jobs.put(RESOLVE, {"source": self.source, "event": event}, key=f"{RESOLVE}:{self.source}:{event['url']}")
+
+
+class SourceContext:
+    # What a worker keeps open per source: its config, ledger and a thread-less download pool
+    def __init__(self, name, config_path):
+        import runner
+
+        self.name = name
+        self.module = runner.load_source(name)
+        self.config = self.module.load_config(config_path) if config_path else self.module.load_config()
+        self.logger = logging.getLogger(name)
+        self.ledger = open_ledger(self.config["ledger_path"], source=name)
+        self.resolve_cache = make_resolve_cache(self.config, self.ledger, name)
+        ratelimit.configure(self.config.get("rate_limits"))
+        profiles.configure(name, self.config)     # Resolve jobs build their download jobs without run()
+        self.dedup = None
+        self.pool = None
+        self.fetcher = None
+        self.lock = threading.Lock()
+
+    def download_pool(self):
+        with self.lock:
+            if self.pool is None:
+                self.pool, self.dedup = make_pool(
+                    self.config, self.ledger, self.name,
+                    on_success=partial(record_job, ledger=self.ledger, status=SUCCESS),
+                    on_failure=partial(record_job, ledger=self.ledger, status=FAILED),
+                    on_duplicate=partial(record_job, ledger=self.ledger, status=DUPLICATE),
+                    workers=0,      # The queue worker threads run the jobs
+                )
+            return self.pool
+
+    def close(self):
+        if self.fetcher is not None:
+            self.fetcher.close()
+        if self.pool is not None:
+            self.pool.join()
+        if self.dedup is not None:
+            self.dedup.close()
+        self.ledger.close()
+
+
+class Worker:
+    def __init__(self, jobs, runner_config, kinds=None, threads=None):
+        self.jobs = jobs
+        self.runner_config = runner_config
+        self.settings = dict(DEFAULT_SETTINGS, **(runner_config.get("queue") or {}))
+        self.kinds = kinds or KINDS
+        self.threads = threads or self.settings["worker_threads"]
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+
+        self.sources = {}
+        self.sources_lock = threading.Lock()
+        self.browsers = None
+        self.held = {}      # job id -> worker id, renewed by the heartbeat thread
+        self.held_lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def source(self, name):
+        with self.sources_lock:
+            if name not in self.sources:
+                config_paths = self.runner_config.get("sources", {})
+                self.sources[name] = SourceContext(name, config_paths.get(name))
+            return self.sources[name]
+
+    def browser_pool(self):
+        # Only discovery and resolve need Chrome, a download-only node never starts one
+        with self.sources_lock:
+            if self.browsers is None:
+                from browser_pool import BrowserPool
+                from browser import new_driver
+
+                self.browsers = BrowserPool(
+                    partial(new_driver, self.runner_config.get("browser"), self.runner_config.get("chromedriver_path")),
+                    size=self.runner_config.get("browser_pool_size", 2))
+            return self.browsers
+
+    def discover(self, payload):
+        context = self.source(payload["source"])
+        config = dict(context.config)
+        if payload.get("start_date"):
+            # An explicit range is crawled as given, the source watermark only applies to scheduled runs
+            config.update(start_date=payload["start_date"], end_date=payload["end_date"], incremental=False)
+
+        sink = QueueSink(self.jobs, payload["source"])
+        extra = {"resolve": sink.resolve} if hasattr(context.module, "resolve_event") else {}
+        context.module.run(config, self.browser_pool(), context.logger, pool=sink, **extra)
+
+    def resolve(self, payload):
+        from fetcher import make_fetcher
+
+        context = self.source(payload["source"])
+        with context.lock:
+            if context.fetcher is None:
+                context.fetcher = make_fetcher(self.browser_pool(), context.name, settle=5,
+                                               use_http=context.config.get("http_fast_path", True))
+        context.module.resolve_event(context.fetcher, QueueSink(self.jobs, context.name), payload["event"],
+                                     context.config["output_path"], context.ledger, context.logger,
+                                     context.resolve_cache)
+
+    def download(self, payload):
+        context = self.source(payload["source"])
+        if context.ledger.is_downloaded(payload["entry"]["title"]):
+            logger.info(f"'{payload['title']}' was downloaded since it was queued. Skipping.")
+            return
+        if context.download_pool().process(payload) == "failed":
+            raise RuntimeError(payload.get("error", "download failed"))
+
+    def _heartbeat(self):
+        interval = max(1, self.settings["lease_seconds"] / 3)
+        while not self.stopped.wait(interval):
+            with self.held_lock:
+                held = list(self.held.items())
+            for job_id, worker in held:
+                try:
+                    if not self.jobs.heartbeat(job_id, worker, self.settings["lease_seconds"]):
+                        logger.info(f"Lost the lease on job {job_id}, it may run twice")
+                except Exception as e:
+                    logger.info(f"Heartbeat for job {job_id} failed: {e}")
+
+    def _loop(self, index):
+        worker = f"{self.name}:{index}"
+        handlers = {DISCOVER: self.discover, RESOLVE: self.resolve, DOWNLOAD: self.download}
+        while not self.stopped.is_set():
+            try:
+                job = self.jobs.claim(worker, self.kinds, self.settings["lease_seconds"])
+            except Exception as e:
+                logger.info(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                # Jitter keeps idle workers on different nodes from polling in lockstep
+                self.stopped.wait(self.settings["poll_interval"] * random.uniform(0.5, 1.5))
+                continue
+
+            with self.held_lock:
+                self.held[job["id"]] = worker
+            logger.info(f"{worker} running {job['kind']} job {job['id']} (attempt {job['attempts']})")
+            try:
+                handlers[job["kind"]](job["payload"])
+            except Exception as e:
+                logger.exception(f"{job['kind']} job {job['id']} failed: {e}")
+                delay = self.settings["retry_delay"] * 2 ** (job["attempts"] - 1)
+                self.jobs.fail(job["id"], worker, e, delay)
+                metrics.inc("scraper_queue_jobs_total", job["payload"].get("source"), kind=job["kind"], outcome="failed")
+            else:
+                self.jobs.complete(job["id"], worker)
+                metrics.inc("scraper_queue_jobs_total", job["payload"].get("source"), kind=job["kind"], outcome="done")
+            finally:
+                with self.held_lock:
+                    self.held.pop(job["id"], None)
+
+    def stop(self, *args):
+        self.stopped.set()
+
+    def run(self):
+        threads = [threading.Thread(target=self._heartbeat, name="queue-heartbeat", daemon=True)]
+        threads += [threading.Thread(target=self._loop, args=(i,), name=f"queue-worker-{i}") for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        logger.info(f"Worker {self.name} taking {', '.join(self.kinds)} jobs on {self.threads} threads")
+        try:
+            for thread in threads[1:]:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            # Jobs still running are abandoned; their leases expire and another worker picks them up
+            self.stop()
+        finally:
+            self.stop()
+            for context in self.sources.values():
+                context.close()
+            if self.browsers is not None:
+                self.browsers.close()
+
+
+# Usage:
+#   python jobqueue.py enqueue <source> [start_date end_date]
+#   python jobqueue.py worker [--kinds discover,resolve,download] [--threads 4]
+#   python jobqueue.py stats
+def main():
+    parser = argparse.ArgumentParser(description="Shared scraper job queue")
+    parser.add_argument("--config", default="/config_runner.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = commands.add_parser("enqueue", help="Queue a discovery job")
+    enqueue.add_argument("source")
+    enqueue.add_argument("start_date", nargs="?")
+    enqueue.add_argument("end_date", nargs="?")
+
+    worker = commands.add_parser("worker", help="Claim and run jobs until interrupted")
+    worker.add_argument("--kinds", default=",".join(KINDS))
+    worker.add_argument("--threads", type=int)
+
+    commands.add_parser("stats", help="Job counts per kind and status")
+    args = parser.parse_args()
+
+    with open(args.config, "r") as file:
+        runner_config = json.load(file)
+    jobs = open_queue(runner_config.get("queue"))
+
+    if args.command == "enqueue":
+        payload = {"source": args.source}
+        if args.start_date:
+            payload.update(start_date=args.start_date, end_date=args.end_date or args.start_date)
+        key = f"{DISCOVER}:{args.source}:{payload.get('start_date')}:{payload.get('end_date')}"
+        job_id = jobs.put(DISCOVER, payload, key=key)
+        print(f"Queued discovery job {job_id}" if job_id else "The same discovery job is already queued")
+
+    elif args.command == "stats":
+        for kind, counts in sorted(jobs.stats().items()):
+            print(f"{kind:<10} " + "  ".join(f"{status}={count}" for status, count in sorted(counts.items())))
+
+    else:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        server = metrics.start(runner_config)
+        try:
+            Worker(jobs, runner_config, args.kinds.split(","), args.threads).run()
+        finally:
+            metrics.finish(runner_config, server)
+
+    jobs.close()
+
+
+if __name__ == "__main__":
+    main()
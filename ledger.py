@@ -0,0 +1,258 @@
+# Description: Shared download ledger backed by SQLite. Replaces the whole-file success/failed JSON lists.
+import os
+import sys
+import json
+import sqlite3
+import threading
+
+import metrics
+
+SUCCESS = "success"
+FAILED = "failed"
+DUPLICATE = "duplicate"     # Re-post of a recording already stored under another title
+
+
+class Ledger:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+
+        # One connection shared by every thread of the process, guarded by self.lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")   # Appends survive a crash mid-run
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                title TEXT NOT NULL,
+                link TEXT NOT NULL,
+                status TEXT NOT NULL,
+                recorded_date TEXT,
+                last_attempted_scrape_date TEXT,
+                source TEXT,
+                PRIMARY KEY (title, link, status)
+            );
+            CREATE INDEX IF NOT EXISTS downloads_status_title ON downloads (status, title);
+            CREATE TABLE IF NOT EXISTS imports (
+                path TEXT PRIMARY KEY
+            );
+            -- Last failed job per title, so a replay can run it again without crawling the listing
+            CREATE TABLE IF NOT EXISTS failed_jobs (
+                title TEXT PRIMARY KEY,
+                source TEXT,
+                failure TEXT,
+                job TEXT NOT NULL
+            );
+            -- ffprobe result of the last verified download of each title
+            CREATE TABLE IF NOT EXISTS probes (
+                title TEXT PRIMARY KEY,
+                path TEXT,
+                size INTEGER,
+                duration REAL,
+                format TEXT,
+                streams TEXT,
+                problems TEXT,
+                probed_date TEXT
+            );
+            -- Event page -> media URL mappings, so reruns skip the browser for events already resolved
+            CREATE TABLE IF NOT EXISTS resolved (
+                source TEXT NOT NULL,
+                event_url TEXT NOT NULL,
+                media_url TEXT NOT NULL,
+                headers TEXT,
+                metadata TEXT,
+                resolved_at REAL NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (source, event_url)
+            );
+            CREATE INDEX IF NOT EXISTS resolved_used ON resolved (source, used_at);
+        """)
+        self.conn.commit()
+
+    def record(self, entry, status, source=None):
+        # Insert the entry, or refresh the attempt date if the same title/link/state is already known
+        with metrics.stage(source, "ledger_write"), self.lock, self.conn:
+            self.conn.execute(
+                """INSERT INTO downloads (title, link, status, recorded_date, last_attempted_scrape_date, source)
+                   VALUES (?, ?, ?, ?, ?, ?)
+                   ON CONFLICT (title, link, status) DO UPDATE SET
+                       last_attempted_scrape_date = excluded.last_attempted_scrape_date""",
+                (entry["title"], entry["link"], status, entry.get("recorded_date"),
+                 entry.get("last_attempted_scrape_date"), source),
+            )
+            if status in (SUCCESS, DUPLICATE):
+                self.conn.execute("DELETE FROM failed_jobs WHERE title = ?", (entry["title"],))
+
+    def save_failed_job(self, job, source=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO failed_jobs (title, source, failure, job) VALUES (?, ?, ?, ?)",
+                (job["entry"]["title"], source, job.get("failure"), json.dumps(job, default=str)),
+            )
+            # The media URL behind a failed download may have moved; resolve the event page again next time
+            if job.get("event_url"):
+                self.conn.execute("DELETE FROM resolved WHERE event_url = ?", (job["event_url"],))
+
+    def get_resolved(self, source, event_url, max_age, now):
+        # Resolution of event_url no older than max_age seconds; a hit counts as a use for LRU eviction
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                "SELECT media_url, headers, metadata, resolved_at FROM resolved WHERE source = ? AND event_url = ?",
+                (source, event_url),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[3] < now - max_age:
+                self.conn.execute("DELETE FROM resolved WHERE source = ? AND event_url = ?", (source, event_url))
+                return None
+            self.conn.execute("UPDATE resolved SET used_at = ? WHERE source = ? AND event_url = ?",
+                              (now, source, event_url))
+        return {"media_url": row[0], "headers": json.loads(row[1] or "{}"), "metadata": json.loads(row[2] or "{}")}
+
+    def save_resolved(self, source, event_url, media_url, headers, metadata, now, max_entries):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO resolved (source, event_url, media_url, headers, metadata, resolved_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source, event_url, media_url, json.dumps(headers or {}), json.dumps(metadata or {}), now, now),
+            )
+            # Keep the max_entries most recently used mappings of this source
+            self.conn.execute(
+                "DELETE FROM resolved WHERE source = ? AND event_url NOT IN "
+                "(SELECT event_url FROM resolved WHERE source = ? ORDER BY used_at DESC LIMIT ?)",
+                (source, source, max_entries),
+            )
+
+    def delete_resolved(self, source, event_url):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM resolved WHERE source = ? AND event_url = ?", (source, event_url))
+
+    def record_probe(self, title, info, problems, probed_date=None):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO probes (title, path, size, duration, format, streams, problems, probed_date) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (title, info["path"], info["size"], info["duration"], info["format"], json.dumps(info["streams"]),
+                 json.dumps(problems), probed_date),
+            )
+
+    def failed_jobs(self, source=None):
+        query = "SELECT job, source FROM failed_jobs"
+        params = []
+        if source is not None:
+            query += " WHERE source = ?"
+            params.append(source)
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+        jobs = []
+        for row in rows:
+            job = json.loads(row[0])
+            job.setdefault("source", row[1])     # Jobs queued by a scraper do not carry their source themselves
+            jobs.append(job)
+        return jobs
+
+    def is_downloaded(self, title):
+        # A title found to be a duplicate is settled too, it must not be fingerprinted again every run
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM downloads WHERE status IN (?, ?) AND title = ? LIMIT 1", (SUCCESS, DUPLICATE, title)
+            ).fetchone()
+        return row is not None
+
+    def downloaded_links(self, title):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT link FROM downloads WHERE status = ? AND title = ?", (SUCCESS, title)
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def entries(self, status, source=None):
+        query = "SELECT title, link, recorded_date, last_attempted_scrape_date, source FROM downloads WHERE status = ?"
+        params = [status]
+        if source is not None:
+            query += " AND source = ?"
+            params.append(source)
+
+        with self.lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        return [
+            {"title": r[0], "link": r[1], "recorded_date": r[2], "last_attempted_scrape_date": r[3], "source": r[4]}
+            for r in rows
+        ]
+
+    def import_json(self, json_path, status, source=None):
+        # One-time import of an old success/failed list; a path that was already imported is skipped. A list that
+        # is missing or does not parse is not recorded, so it is imported once it shows up or is fixed.
+        json_path = os.path.abspath(json_path)
+        with self.lock:
+            if self.conn.execute("SELECT 1 FROM imports WHERE path = ?", (json_path,)).fetchone():
+                return 0
+
+        try:
+            with open(json_path, "r") as file:
+                event_list = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return 0
+
+        rows = [
+            (e["title"], e.get("link") or "Not Found", status, e.get("recorded_date"),
+             e.get("last_attempted_scrape_date"), source)
+            for e in event_list if "title" in e
+        ]
+
+        # Check and import under one write lock, so two processes sharing the database cannot both import the list
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if self.conn.execute("SELECT 1 FROM imports WHERE path = ?", (json_path,)).fetchone():
+                    self.conn.rollback()
+                    return 0
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO downloads (title, link, status, recorded_date, last_attempted_scrape_date, source) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self.conn.execute("INSERT OR IGNORE INTO imports (path) VALUES (?)", (json_path,))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def record_job(job, detail=None, ledger=None, status=SUCCESS):
+    # DownloadPool callback for callers without a source module of their own (job queue workers, replays).
+    # The job carries its source; detail is the error or the duplicate's owner, depending on the callback.
+    ledger.record(job["entry"], status, source=job.get("source"))
+    if status == FAILED:
+        ledger.save_failed_job(job, source=job.get("source"))
+
+
+def open_ledger(db_path, success_path=None, failed_path=None, source=None):
+    # Open the ledger and pull in the legacy JSON lists the first time they are seen
+    ledger = Ledger(db_path)
+    if success_path:
+        ledger.import_json(success_path, SUCCESS, source)
+    if failed_path:
+        ledger.import_json(failed_path, FAILED, source)
+    return ledger
+
+
+# Usage: python ledger.py <ledger.db> <success_list.json> <failed_list.json> [source]
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        print("Usage: python ledger.py <ledger.db> <success_list.json> <failed_list.json> [source]")
+        sys.exit(1)
+
+    ledger = Ledger(sys.argv[1])
+    source = sys.argv[4] if len(sys.argv) > 4 else None
+    imported_success = ledger.import_json(sys.argv[2], SUCCESS, source)
+    imported_failed = ledger.import_json(sys.argv[3], FAILED, source)
+    print(f"Imported {imported_success} successful and {imported_failed} failed entries into {sys.argv[1]}")
+    ledger.close()
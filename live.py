@@ -0,0 +1,148 @@
+# Description: Live HLS capture. Follows a session's playlist while it is broadcasting, appends each segment to disk as soon as it is published, and remuxes the recording to MP4 once the stream ends.
+import os
+import json
+import time
+import shutil
+import logging
+
+from http_client import HttpClient, HttpError
+from hls import parse_playlist, resolve_media_playlist, remux, remux_parts, PlaylistError
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "poll_interval": 60,    # Seconds between looks at the listing for sessions that went live
+    "max_streams": 4,       # Sessions recorded at the same time
+    "end_timeout": 300,     # A stream with no new segment for this long is over, even without EXT-X-ENDLIST
+    "until": None,          # "HH:MM": stop looking for new sessions after this time; running captures still finish
+}
+
+GONE = (404, 410)   # Live playlists are usually taken down at gavel-out
+
+
+def load_state(path, media_url, extension):
+    # "part" is the file being appended to, a new one starts at every discontinuity; "bytes" and "init" are its own
+    try:
+        with open(path, "r") as file:
+            state = json.load(file)
+        if state.get("media_url") == media_url:
+            state.setdefault("part", 0)
+            state.setdefault("discontinuity", None)
+            return state
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    return {"media_url": media_url, "extension": extension, "next_sequence": None, "segments": 0, "bytes": 0,
+            "seconds": 0.0, "init": False, "part": 0, "discontinuity": None}
+
+
+def part_path(work_dir, state, part):
+    # The first part keeps the name captures had before they were split
+    return os.path.join(work_dir, f"stream{part or ''}{state['extension']}")
+
+
+def save_state(state, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(state, file)
+    os.replace(tmp_path, path)
+
+
+def capture_live(url, output_path, headers=None, client=None, end_timeout=300, audio_only=False, max_height=None,
+                 source=None):
+    # Blocks until the stream ends. A capture cut off by a crash or a retry carries on from its last segment.
+    own_client = client is None
+    client = client or HttpClient()
+    work_dir = output_path + ".live"
+    os.makedirs(work_dir, exist_ok=True)
+    state_path = os.path.join(work_dir, "state.json")
+
+    try:
+        media_url, playlist = resolve_media_playlist(client, url, headers, audio_only, max_height)
+        first_uri = (playlist["segments"] or [{"uri": ".ts"}])[0]["uri"]
+        state = load_state(state_path, media_url, os.path.splitext(first_uri.split("?")[0])[1] or ".ts")
+
+        # Anything written after the last saved state is a half-appended segment; it is fetched again
+        if os.path.exists(part_path(work_dir, state, state["part"])):
+            with open(part_path(work_dir, state, state["part"]), "r+b") as stream:
+                stream.truncate(state["bytes"])
+
+        def append(body):
+            with open(part_path(work_dir, state, state["part"]), "ab") as stream:
+                stream.write(body)
+            state["bytes"] += len(body)
+
+        def start_part():
+            # Timestamps restart after a discontinuity (an ad break, an encoder restart), so the segments after it
+            # go to a file of their own instead of being appended to the current one
+            state.update(part=state["part"] + 1, bytes=0, init=False)
+            open(part_path(work_dir, state, state["part"]), "wb").close()
+            logger.info(f"Discontinuity in the live stream for {output_path}, starting part {state['part'] + 1}")
+
+        last_new = time.time()
+        while True:
+            new = 0
+            for offset, segment in enumerate(playlist["segments"]):
+                sequence = playlist["media_sequence"] + offset
+                expected = state["next_sequence"]
+                if expected is not None and sequence < expected:
+                    continue
+                if expected is not None and sequence > expected:
+                    # Segments rolled off the playlist before they were fetched
+                    logger.warning(f"Live capture of {output_path} missed segments {expected} to {sequence - 1}")
+                    metrics.inc("scraper_live_gaps_total", source)
+                if state["bytes"] and state["discontinuity"] not in (None, segment["discontinuity"]):
+                    start_part()
+                state["discontinuity"] = segment["discontinuity"]
+                if segment["init"] and not state["init"]:
+                    append(client.get(segment["init"], headers=headers).raise_for_status().body)
+                    state["init"] = True
+                append(client.get(segment["uri"], headers=headers).raise_for_status().body)
+                state["next_sequence"] = sequence + 1
+                state["segments"] += 1
+                state["seconds"] += segment["duration"]
+                save_state(state, state_path)
+                new += 1
+            if new:
+                last_new = time.time()
+                metrics.inc("scraper_live_segments_total", source, new)
+
+            if playlist["endlist"]:
+                logger.info(f"Stream ended for {output_path} after {state['seconds'] / 60:.1f} min")
+                break
+            if time.time() - last_new > end_timeout:
+                logger.info(f"No new segments for {end_timeout}s, treating the stream for {output_path} as ended")
+                break
+
+            # Reload after a target duration, or half of one when the playlist had not moved (RFC 8216 6.3.4)
+            target = playlist["target_duration"] or 6
+            time.sleep(target if new else target / 2)
+            try:
+                playlist = parse_playlist(client.get(media_url, headers=headers).raise_for_status().text(), media_url)
+            except HttpError as e:
+                if e.status in GONE and state["segments"]:
+                    logger.info(f"Playlist taken down, stream ended for {output_path}")
+                    break
+                if e.status < 500 and e.status not in GONE:
+                    raise
+                logger.info(f"Live playlist reload failed, still waiting: {e}")
+            except OSError as e:
+                logger.info(f"Live playlist reload failed, still waiting: {e}")
+
+        if not state["segments"]:
+            raise PlaylistError(f"No segments published on {media_url}")
+
+        with metrics.stage(source, "post_process"):
+            parts = [part_path(work_dir, state, part) for part in range(state["part"] + 1)]
+            parts = [path for path in parts if os.path.exists(path) and os.path.getsize(path)]
+            if len(parts) == 1:
+                remux(parts[0], output_path)
+            else:
+                remux_parts(parts, output_path)
+
+    finally:
+        if own_client:
+            client.close()
+
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return output_path
@@ -0,0 +1,210 @@
+# Description: Per-source pipeline metrics (stage timings, download throughput, counters). Served in Prometheus text format on /metrics and written to a JSON run summary.
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Seconds, from a cached page load up to a multi-hour hearing
+TIME_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+# Bytes per second, from a throttled origin up to a fast CDN
+RATE_BUCKETS = (64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+
+HELP = {
+    "scraper_stage_seconds": ("histogram", "Time spent in each pipeline stage"),
+    "scraper_stage_errors_total": ("counter", "Pipeline stages that raised"),
+    "scraper_download_bytes_total": ("counter", "Bytes of media downloaded"),
+    "scraper_download_bytes_per_second": ("histogram", "Throughput of each finished download"),
+    "scraper_downloads_total": ("counter", "Finished downloads by outcome"),
+    "scraper_browsers_launched_total": ("counter", "Chrome instances started"),
+    "scraper_queue_jobs_total": ("counter", "Queue jobs finished by kind and outcome"),
+    "scraper_download_retries_total": ("counter", "Download attempts retried, by failure class"),
+    "scraper_replayed_jobs_total": ("counter", "Failed downloads queued again by a replay"),
+    "scraper_throttled_total": ("counter", "429/503 answers that slowed a host down"),
+    "scraper_verified_total": ("counter", "Downloads probed with ffprobe, by outcome"),
+    "scraper_resolve_cache_total": ("counter", "Event page resolutions looked up in the resolve cache, by outcome"),
+    "scraper_backfill_shards_total": ("counter", "Backfill shards finished, by outcome"),
+    "scraper_live_segments_total": ("counter", "Segments appended by live captures"),
+    "scraper_live_gaps_total": ("counter", "Live captures that fell behind and lost segments"),
+}
+
+started = time.time()
+lock = threading.Lock()
+counters = {}       # (name, labels) -> value
+histograms = {}     # (name, labels) -> {"buckets", "counts", "sum", "count", "max"}
+
+
+def _labels(source, labels):
+    # Stored as a sorted tuple so it can key a dict; "all" for work shared between sources
+    labels = dict(labels, source=source or "all")
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, source=None, value=1, **labels):
+    key = (name, _labels(source, labels))
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+
+def observe(name, source=None, value=0.0, buckets=TIME_BUCKETS, **labels):
+    key = (name, _labels(source, labels))
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0, "max": 0.0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["counts"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+        histogram["max"] = max(histogram["max"], value)
+
+
+@contextmanager
+def stage(source, name):
+    # with stage("south_dakota", "page_load"): ... times the block, counting it as an error if it raises
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        inc("scraper_stage_errors_total", source, stage=name)
+        raise
+    finally:
+        observe("scraper_stage_seconds", source, time.time() - start, stage=name)
+
+
+def record_download(source, size, seconds, outcome="success"):
+    inc("scraper_downloads_total", source, outcome=outcome)
+    if outcome != "success":
+        return
+    observe("scraper_stage_seconds", source, seconds, stage="download")
+    if size:
+        inc("scraper_download_bytes_total", source, size)
+        if seconds > 0:
+            observe("scraper_download_bytes_per_second", source, size / seconds, buckets=RATE_BUCKETS)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels) + list(extra or [])
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+
+def render():
+    # Prometheus text exposition format
+    with lock:
+        counter_items = sorted(counters.items())
+        histogram_items = sorted((key, dict(h, counts=list(h["counts"]))) for key, h in histograms.items())
+
+    lines = []
+    described = set()
+
+    def describe(name):
+        if name not in described and name in HELP:
+            kind, text = HELP[name]
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+        described.add(name)
+
+    for (name, labels), value in counter_items:
+        describe(name)
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), histogram in histogram_items:
+        describe(name)
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {histogram['count']}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+    return "\n".join(lines) + "\n"
+
+
+def summary():
+    # Per-source view of the same numbers: {source: {"stages": {...}, "counters": {...}}}
+    with lock:
+        counter_items = list(counters.items())
+        histogram_items = list(histograms.items())
+
+    sources = {}
+    for (name, labels), histogram in histogram_items:
+        labels = dict(labels)
+        source = sources.setdefault(labels.pop("source"), {"stages": {}, "counters": {}})
+        key = labels.get("stage", name)
+        source["stages"][key] = {
+            "count": histogram["count"],
+            "total": round(histogram["sum"], 3),
+            "mean": round(histogram["sum"] / histogram["count"], 3) if histogram["count"] else 0,
+            "max": round(histogram["max"], 3),
+        }
+    for (name, labels), value in counter_items:
+        labels = dict(labels)
+        source = sources.setdefault(labels.pop("source"), {"stages": {}, "counters": {}})
+        key = name + "".join(f"[{k}={v}]" for k, v in sorted(labels.items()))
+        source["counters"][key] = value
+
+    return {
+        "started": datetime.fromtimestamp(started).strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed": round(time.time() - started, 3),
+        "sources": sources,
+    }
+
+
+def reset():
+    # Start a fresh measurement, e.g. between benchmark runs in one process
+    global started
+    with lock:
+        counters.clear()
+        histograms.clear()
+        started = time.time()
+
+
+def write_summary(path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(summary(), file, indent=4)
+    os.replace(tmp_path, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass    # Scrapes every few seconds would drown the run log
+
+
+def serve(port, host="127.0.0.1"):
+    # Background /metrics endpoint for the lifetime of the run
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def start(config):
+    # Optional endpoint from the config; returns the server so the caller can shut it down
+    if config.get("metrics_port"):
+        return serve(config["metrics_port"], config.get("metrics_host", "127.0.0.1"))
+    return None
+
+
+def finish(config, server=None):
+    if config.get("metrics_summary_path"):
+        write_summary(config["metrics_summary_path"])
+        logger.info(f"Run summary written to {config['metrics_summary_path']}")
+    if server is not None:
+        server.shutdown()
@@ -0,0 +1,86 @@
+# Description: Streams Network.responseReceived events over the browser's CDP connection and resolves a future on the first HLS manifest.
+import logging
+import threading
+from concurrent.futures import Future
+
+import trio
+
+logger = logging.getLogger(__name__)
+
+HLS_MIME_TYPES = ("application/vnd.apple.mpegurl", "application/x-mpegurl", "audio/mpegurl", "audio/x-mpegurl")
+
+
+def is_hls_manifest(url, mime_type):
+    return ".m3u8" in url or (mime_type or "").lower() in HLS_MIME_TYPES
+
+
+class NetworkSniffer:
+    def __init__(self, driver, match=is_hls_manifest):
+        self.driver = driver
+        self.match = match
+        self.future = None
+        self.lock = threading.Lock()
+        self.ready = threading.Event()
+        self.trio_token = None
+        self.cancel_scope = None
+        self.thread = None
+        self.error = None
+
+    def start(self, timeout=10):
+        # The listener runs on its own trio loop so the WebDriver calls on this thread never block on it
+        self.thread = threading.Thread(target=trio.run, args=(self._listen,), name="cdp-sniffer", daemon=True)
+        self.thread.start()
+        if not self.ready.wait(timeout):
+            raise RuntimeError("CDP connection did not come up")
+        if self.error is not None:
+            raise self.error
+        return self
+
+    async def _listen(self):
+        try:
+            await self._stream()
+        except Exception as e:
+            self.error = e
+            logger.info(f"CDP network listener stopped: {e}")
+        finally:
+            self.ready.set()
+            with self.lock:
+                if self.future is not None and not self.future.done():
+                    self.future.cancel()
+
+    async def _stream(self):
+        self.trio_token = trio.lowlevel.current_trio_token()
+        with trio.CancelScope() as self.cancel_scope:
+            async with self.driver.bidi_connection() as connection:
+                session, devtools = connection.session, connection.devtools
+                await session.execute(devtools.network.enable())
+                listener = session.listen(devtools.network.ResponseReceived)
+                self.ready.set()
+
+                # Only this one event type is subscribed to; everything else never leaves the browser
+                async for event in listener:
+                    response = event.response
+                    if self.match(response.url, response.mime_type):
+                        self._resolve(response.url)
+
+    def _resolve(self, url):
+        with self.lock:
+            if self.future is not None and not self.future.done():
+                self.future.set_result(url)
+
+    def arm(self):
+        # Call before navigating: the returned future holds the first matching URL after this point
+        with self.lock:
+            if self.future is not None and not self.future.done():
+                self.future.cancel()
+            self.future = Future()
+            return self.future
+
+    def stop(self):
+        if self.cancel_scope is not None and self.trio_token is not None:
+            try:
+                trio.from_thread.run_sync(self.cancel_scope.cancel, trio_token=self.trio_token)
+            except trio.RunFinishedError:
+                pass
+        if self.thread is not None:
+            self.thread.join(timeout=5)
@@ -1,71 +1,65 @@
 # Description: This script downloads all videos of the sessions on given range of dates from the North Dakota website.
 import time
-import json
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-import subprocess
 import yaml
 from datetime import datetime
+from functools import partial
 import os
-
-def load_config():
-    config_path = "/config_nd.yaml"
+import sys
+import logging
+from concurrent.futures import TimeoutError as FutureTimeout, CancelledError
+from ledger import open_ledger, SUCCESS, FAILED, DUPLICATE
+from download_pool import DownloadPool, make_job
+from storage import make_storage, storage_key, media_filename
+from retry import make_backoff
+from verify import make_verifier
+from resolve_cache import make_resolve_cache
+from browser_pool import BrowserPool
+from browser import new_driver, user_agent
+from waits import wait_for, wait_until, wait_for_network_idle, configure, record as record_wait
+from network_sniffer import NetworkSniffer
+from crawl import crawl
+from live import DEFAULT_SETTINGS as LIVE_SETTINGS
+import profiles
+import ratelimit
+import metrics
+
+SOURCE_NAME = "north_dakota"
+CONFIG_PATH = "/config_nd.yaml"
+
+def load_config(config_path=CONFIG_PATH):
     with open(config_path, "r") as file:
         return yaml.safe_load(file)
 
-# Accessing the config file
-config = load_config()
-chromedriver_path = config["chromedriver_path"]
-download_path = config["download_path"]
-start_date = config["start_date"]
-end_date = config["end_date"]
-home_url = config["home_url"]
-success_failed_path = config["success_failed_path"]
-
-def get_driver():
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
-    options = webdriver.ChromeOptions()
-    options.add_argument(f"user-agent={user_agent}")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument('--ignore-certificate-errors')
-    # maximize window
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option("useAutomationExtension", False)
-    
-    # Set performance logging capabilities directly on the options
-    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-    
-    # Setting up Chrome WebDriver
-    service = Service(path=chromedriver_path)
-    driver = webdriver.Chrome(service=service, options=options)
-
-    driver.execute_cdp_cmd("Network.enable", {})  # Enable network logging
-    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
-    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-        "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-    })
-
-    return driver
-
-def append_to_json(entry, filename):
-    # Load existing data or start a new list
-    try:
-        with open(os.path.join(success_failed_path, filename), "r") as file:
-            event_list = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        event_list = []
-
-    # Append the new entry to the list
-    event_list.append(entry)
-
-    # Save the updated list back to the file
-    with open(os.path.join(success_failed_path, filename), "w") as file:
-        json.dump(event_list, file, indent=4)  
+# Every event card in the list as {url, title}, read in one round-trip to chromedriver
+EVENT_LIST_JS = """
+return Array.from(arguments[0].querySelectorAll('.divEvent')).map(card => {
+    const link = card.querySelector('a');
+    const title = card.querySelector('a > div > table > tbody > tr > td.tdEventTitle > span');
+    return {url: link ? link.href : null, title: title ? title.innerText.trim() : ''};
+}).filter(event => event.url);
+"""
+
+# Event cards on the home page that are broadcasting now, as {url, title}; the card carries a "live" badge or class
+LIVE_EVENTS_JS = """
+const isLive = element => /\\blive\\b/i.test(element.getAttribute('class') || '');
+return Array.from(document.querySelectorAll('.divEvent')).filter(card =>
+    isLive(card) || Array.from(card.querySelectorAll('[class]')).some(isLive) || /\\bLIVE\\b/.test(card.innerText)
+).map(card => {
+    const link = card.querySelector('a');
+    const title = card.querySelector('td.tdEventTitle > span');
+    return {url: link ? link.href : null, title: title ? title.innerText.trim() : ''};
+}).filter(event => event.url);
+"""
+
+# Date and time from the event's info panel
+EVENT_INFO_JS = """
+const text = id => { const e = document.getElementById(id); return e ? e.innerText.trim() : ''; };
+return {date: text('actualdate'), time: text('actualtime')};
+"""
+
+# First HLS playlist URL the page has fetched, if any
+M3U8_REQUESTED_JS = "const e = performance.getEntriesByType('resource').find(e => e.name.includes('.m3u8')); return e ? e.name : null;"
 
 def format_title(title, event_date, event_time):
 
@@ -98,138 +92,282 @@ def format_title(title, event_date, event_time):
 
     return video_title    # YYYY-MM-DD_HH-MM_The_Title_of_Video.mp4
 
-def download_video(driver):
-
-    driver.get(home_url)
-    time.sleep(2)
-    recordings = driver.find_element(By.ID, "recordLink")
+def session_seconds(event_time):
+    # Scheduled length from "8:30 AM - 10:00 AM", used to spot recordings that stop early; None if unreadable
+    try:
+        start_time, end_time = [datetime.strptime(t.strip(), "%I:%M %p") for t in event_time.split(' - ')]
+    except ValueError:
+        return None
+    seconds = (end_time - start_time).total_seconds()
+    return seconds if seconds > 0 else None
+
+def resolve_event_page(driver, sniffer, event_url, m3u8_timeout):
+    # Event page -> (m3u8 links, actualtime, actualdate)
+
+    # Arm the network listener before navigating so the first manifest response is caught
+    manifest = sniffer.arm()
+
+    # Click on the event
+    started = time.time()
+    m3u8_links = []
+    with metrics.stage(SOURCE_NAME, "resolve"):
+        with ratelimit.request(event_url):
+            driver.get(event_url)
+        try:
+            m3u8_links.append(manifest.result(timeout=m3u8_timeout))
+        except (FutureTimeout, CancelledError):
+            # Players inside cross-origin frames are not on this CDP session; check the page's resource list
+            found = driver.execute_script(M3U8_REQUESTED_JS)
+            if found:
+                m3u8_links.append(found)
+    record_wait("north_dakota", 3, started)
+
+    # Fetching duration and date of event
+    menu_info = driver.find_element(By.ID, 'menu_info')
+    menu_info.click()
+    wait_until(driver, lambda d: d.find_element(By.ID, 'actualtime').text.strip(), "north_dakota", legacy_sleep=2)
+    info = driver.execute_script(EVENT_INFO_JS)
+    return m3u8_links, info["time"], info["date"]
+
+def make_event_job(formatted_title, event_title, event_url, m3u8_url, headers, event_time, download_path, recorded_date,
+                   current_date, **extra):
+    # Download job for one event's manifest; extra picks the engine ("hls" for recordings, "live" while broadcasting)
+    profile = profiles.profile_for(SOURCE_NAME)
+    filename = media_filename(formatted_title, profiles.output_extension(profile, "mp4"))
+    # With a transcoding profile the download lands next to the final file and is converted afterwards
+    fields = profiles.job_fields(profile, f"{download_path}{filename}", "mp4")
+    ffmpeg_command = [
+        "ffmpeg",
+        "-headers", f"Referer: {headers['Referer']}",
+        "-user_agent", headers["User-Agent"],
+        "-i", m3u8_url,  # Input: the m3u8 URL (location of the video playlist)
+        "-c", "copy", # Copy the video codecs without re-encoding
+        fields.get("source_path", f"{download_path}{filename}")
+    ]
+    entry = {
+        "title": formatted_title,
+        "recorded_date": recorded_date,
+        "link": m3u8_url,
+        "last_attempted_scrape_date": current_date
+    }
+    # Same download as fragmented MP4 on stdout, used when the output streams straight into storage
+    stream_command = ffmpeg_command[:-1] + ["-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1"]
+
+    # Determining Category
+    if "senate" in event_title.lower():
+        category = "senate"
+    elif "house" in event_title.lower():
+        category = "house"
+    elif "joint" in event_title.lower():
+        category = "joint"
+    else:
+        category = "unknown"   # default
+
+    # Determining Session type
+    if "committee" in event_title.lower():
+        session_type = "committee"
+    elif "hearing" in event_title.lower():
+        session_type = "hearing"
+    else:
+        session_type = "session"     # default
+
+    return make_job(formatted_title, m3u8_url, f"{download_path}{filename}",
+                    ffmpeg_command, headers=headers, entry=entry,
+                    category=category, session_type=session_type,
+                    expected_seconds=session_seconds(event_time),
+                    storage_key=storage_key(SOURCE_NAME, category, session_type, filename),
+                    stream_command=stream_command, event_url=event_url, **fields, **extra)
+
+def download_video(driver, sniffer, pool, home_url, download_path, start_date, end_date, m3u8_timeout, ledger, cache=None):
+
+    with metrics.stage(SOURCE_NAME, "page_load"):
+        with ratelimit.request(home_url):
+            driver.get(home_url)
+        recordings = wait_for(driver, By.ID, "recordLink", "north_dakota", legacy_sleep=2, clickable=True)
     recordings.click()
 
-    startDate = driver.find_element(By.ID, 'txtStartDate')
+    startDate = wait_for(driver, By.ID, 'txtStartDate', "north_dakota", clickable=True)
     startDate.click()
     startDate.send_keys(start_date)
 
-    time.sleep(1)
-
-    endDate = driver.find_element(By.ID, 'txtEndDate')
+    endDate = wait_for(driver, By.ID, 'txtEndDate', "north_dakota", legacy_sleep=1, clickable=True)
     endDate.click()
     endDate.send_keys(end_date)
-    time.sleep(1)
 
-    filter = driver.find_element(By.ID, 'btnFilter')
+    filter = wait_for(driver, By.ID, 'btnFilter', "north_dakota", legacy_sleep=1, clickable=True)
     filter.click()
-    time.sleep(2)
-    second_card = WebDriverWait(driver, 20).until(
-        EC.presence_of_element_located((By.CLASS_NAME, 'upcomingeventlist'))
-    )
+
+    # Wait for the filtered list request to finish, then for the list itself
+    with metrics.stage(SOURCE_NAME, "page_load"):
+        wait_for_network_idle(driver, "north_dakota", legacy_sleep=2)
+        second_card = wait_for(driver, By.CLASS_NAME, 'upcomingeventlist', "north_dakota")
     # second_card = driver.find_element(By.CLASS_NAME, 'upcomingeventlist')
 
-    # Get event urls from the session cards
-    event_urls = [a.get_attribute("href") for a in second_card.find_elements(By.CSS_SELECTOR, ".divEvent a")]
-    event_titles = [a.text for a in second_card.find_elements(By.CSS_SELECTOR, "a > div > table > tbody > tr > td.tdEventTitle > span")]
+    # Get event urls and titles from the session cards
+    with metrics.stage(SOURCE_NAME, "listing_parse"):
+        events = driver.execute_script(EVENT_LIST_JS, second_card)
+    event_urls = [event["url"] for event in events]
+    event_titles = [event["title"] for event in events]
 
     current_date = datetime.now().strftime("%Y-%m-%d")
+    player_headers = {"Referer": "https://wralarchives.com/", "User-Agent": user_agent}
 
     for i in range(len(event_urls)):
 
-        # Now finding m3u8 urls
-        driver.get_log("performance")
-
-        # Click on the event
-        driver.get(event_urls[i])
-        time.sleep(3)
-
-        logs = driver.get_log("performance")
-        m3u8_links = []
-
-        # Fetching duration and date of event
-        menu_info = driver.find_element(By.ID, 'menu_info')
-        menu_info.click()
-        time.sleep(2)
-        event_time = driver.find_element(By.ID, 'actualtime').text
-        event_date = driver.find_element(By.ID, 'actualdate').text
+        # An event resolved on an earlier run needs no page load: the manifest and the info panel are cached
+        cached = cache.get(event_urls[i]) if cache else None
+        if cached:
+            m3u8_links, headers = [cached["media_url"]], cached["headers"]
+            event_time, event_date = cached["metadata"]["time"], cached["metadata"]["date"]
+        else:
+            m3u8_links, event_time, event_date = resolve_event_page(driver, sniffer, event_urls[i], m3u8_timeout)
+            headers = player_headers
+            if cache and m3u8_links:
+                cache.put(event_urls[i], m3u8_links[0], headers,
+                          metadata={"title": event_titles[i], "time": event_time, "date": event_date})
 
         # Format the title
         formatted_title = format_title(event_titles[i], event_date, event_time)
 
+        if ledger.is_downloaded(formatted_title):
+            print(f"The event '{formatted_title}' has already been downloaded. Skipping download.")
+            continue
+
         print(f"\n\nDownloading video: {formatted_title}...")
-        print ("\nChecking for m3u8 links in the network logs...\n\n")
-        
-        for log in logs:
-            try:
-                # Parse log entry's message
-                message = json.loads(log["message"])["message"]
-            except Exception:
-                continue
-        
-                # Look for network response events
-            if message.get("method") == "Network.responseReceived":
-                # Extract the response data
-                response = message.get("params", {}).get("response", {})
-                headers = response.get("headers", {})
-                content_type = headers.get("Content-Type", "")
-                url = response.get("url", "")
-
-                # Check if the MIME type and URL match our criteria
-                if ".m3u8" in url:
-                    m3u8_links.append(url)
 
         if m3u8_links:
-            try: 
-                start_time = time.time()
-                # Downloading video using ffmpeg
-                ffmpeg_command = [
-                    "ffmpeg",
-                    "-headers", "Referer: https://wralarchives.com/",
-                    "-user_agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36",
-                    "-i", m3u8_links[0],  # Input: the m3u8 URL (location of the video playlist)
-                    "-c", "copy", # Copy the video codecs without re-encoding
-                    f"{download_path}{formatted_title}.mp4"
-                ]
-
-                subprocess.run(ffmpeg_command)
-                # Updating the success list
-                entry = {
-                    "title": formatted_title,
-                    "recorded_date": start_date,
-                    "link": m3u8_links[0],
-                    "last_attempted_scrape_date": current_date
-                }
-                append_to_json(entry, "success_list.json")
-                print(f"\n\nVideo downloaded successfully! -> {formatted_title}")
-
-                end_time = time.time()
-                time_taken = (end_time - start_time)/60
-                print(f"Time taken to download video: {time_taken:.2f} min\n\n")
-                
-            except subprocess.CalledProcessError as e:
-                entry = {
-                    "title": formatted_title,
-                    "recorded_date": start_date,
-                    "link": m3u8_links[0],
-                    "last_attempted_scrape_date": current_date
-                }
-                append_to_json(entry, "failed_list.json")
-                print(f"\n\nFailed to download video! -> {formatted_title}\n\n")
-            
+            # Downloading video with the native HLS engine (ffmpeg command is the fallback), queued so the crawl can move on
+            pool.submit(make_event_job(formatted_title, event_titles[i], event_urls[i], m3u8_links[0], headers,
+                                       event_time, download_path, start_date, current_date, engine="hls"))
+
         else:
-            print("\n\nNo .m3u8 links were found in the network logs.")
+            print("\n\nNo .m3u8 links were found in the network traffic.")
             entry = {
                 "title": formatted_title,
                 "recorded_date": start_date,
-                "link": m3u8_links[0],
+                "link": "Not Found",
                 "last_attempted_scrape_date": current_date
             }
-            append_to_json(entry, "failed_list.json")
+            ledger.record(entry, FAILED, source=SOURCE_NAME)
             print(f"Failed to download video! -> {formatted_title}\n\n")
 
 
-def main():
-    driver = get_driver()
+def record_success(job, ledger):
+    # Updating the success list
+    ledger.record(job["entry"], SUCCESS, source=SOURCE_NAME)
+    print(f"\n\nVideo downloaded successfully! -> {job['title']}")
+    print(f"Time taken to download video: {job['elapsed'] / 60:.2f} min\n\n")
+
+def record_failure(job, error, ledger):
+    ledger.record(job["entry"], FAILED, source=SOURCE_NAME)
+    ledger.save_failed_job(job, source=SOURCE_NAME)     # Kept for a replay without re-crawling
+    print(f"\n\nFailed to download video! -> {job['title']} ({error})\n\n")
+
+def record_duplicate(job, owner, ledger):
+    ledger.record(job["entry"], DUPLICATE, source=SOURCE_NAME)
+    print(f"\n\nSkipped video already stored as '{owner}' -> {job['title']}\n\n")
+
+def run(config, browsers, logger, pool=None):
+    # Source entry point used by runner.py and main()
+    configure(SOURCE_NAME, config.get("wait_timeout", 20))
+    ratelimit.configure(config.get("rate_limits"))    # Adds this source's hosts to the shared limiter
+    profiles.configure(SOURCE_NAME, config)
+    success_failed_path = config["success_failed_path"]
+    ledger = open_ledger(
+        config["ledger_path"],
+        os.path.join(success_failed_path, "success_list.json"),
+        os.path.join(success_failed_path, "failed_list.json"),
+        source=SOURCE_NAME,
+    )
+    # Downloads run while the browser resolves events; teardown once every queued job has finished
+    with crawl(config, SOURCE_NAME, ledger, logger, pool,
+               on_success=partial(record_success, ledger=ledger),
+               on_failure=partial(record_failure, ledger=ledger),
+               on_duplicate=partial(record_duplicate, ledger=ledger),
+               ytdlp=False) as run_state:
+        # Browser goes back to the pool once every event has been resolved
+        with browsers.browser(SOURCE_NAME) as driver:
+            sniffer = NetworkSniffer(driver).start()
+            try:
+                download_video(driver, sniffer, run_state.pool, config["home_url"], config["download_path"],
+                               run_state.start_date, config["end_date"], config.get("m3u8_timeout", 10), ledger,
+                               make_resolve_cache(config, ledger, SOURCE_NAME))
+                run_state.complete(config["end_date"])
+            finally:
+                sniffer.stop()
+
+def watch_live(config, browsers, logger):
+    # Live mode: poll the home page for sessions that are broadcasting and record each one until its stream ends
+    settings = dict(LIVE_SETTINGS, **(config.get("live") or {}))
+    configure(SOURCE_NAME, config.get("wait_timeout", 20))
+    ratelimit.configure(config.get("rate_limits"))
+    profiles.configure(SOURCE_NAME, config)
+    ledger = open_ledger(config["ledger_path"], source=SOURCE_NAME)
+    # Captures hold their worker for the whole session, so they get a pool of their own
+    pool = DownloadPool(
+        workers=settings["max_streams"],
+        per_host_limit=settings["max_streams"],
+        storage=make_storage(config),
+        backoff=make_backoff(config),
+        verifier=make_verifier(config, ledger, SOURCE_NAME),
+        on_success=partial(record_success, ledger=ledger),
+        on_failure=partial(record_failure, ledger=ledger),
+        source=SOURCE_NAME,
+    )
+
+    player_headers = {"Referer": "https://wralarchives.com/", "User-Agent": user_agent}
+    capturing = set()   # Event URLs already handed to the pool
+    try:
+        while not settings["until"] or datetime.now().strftime("%H:%M") < settings["until"]:
+            with browsers.browser(SOURCE_NAME) as driver:
+                sniffer = NetworkSniffer(driver).start()
+                try:
+                    with metrics.stage(SOURCE_NAME, "page_load"):
+                        with ratelimit.request(config["home_url"]):
+                            driver.get(config["home_url"])
+                        wait_for_network_idle(driver, "north_dakota", legacy_sleep=2)
+                    events = [e for e in driver.execute_script(LIVE_EVENTS_JS) if e["url"] not in capturing]
+
+                    for event in events:
+                        m3u8_links, event_time, event_date = resolve_event_page(driver, sniffer, event["url"],
+                                                                                config.get("m3u8_timeout", 10))
+                        if not m3u8_links:
+                            logger.info(f"'{event['title']}' is live but has no stream yet, checking again later")
+                            continue
+                        capturing.add(event["url"])
+                        formatted_title = format_title(event["title"], event_date, event_time)
+                        if ledger.is_downloaded(formatted_title):
+                            continue
+                        logger.info(f"Recording live session '{formatted_title}'")
+                        current_date = datetime.now().strftime("%Y-%m-%d")
+                        pool.submit(make_event_job(formatted_title, event["title"], event["url"], m3u8_links[0],
+                                                   player_headers, event_time, config["download_path"],
+                                                   current_date, current_date, engine="live",
+                                                   end_timeout=settings["end_timeout"]))
+                finally:
+                    sniffer.stop()
+            time.sleep(settings["poll_interval"])
+    finally:
+        # Sessions still on air are recorded to the end before the watcher exits
+        pool.join()
+        ledger.close()
 
-    download_video(driver)
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    config = load_config()
 
-    driver.quit()
+    # Optional /metrics endpoint and JSON run summary
+    server = metrics.start(config)
+    browsers = BrowserPool(partial(new_driver, config.get("browser"), config.get("chromedriver_path")), size=1)
+    try:
+        # python north_dakota.py --live records sessions while they broadcast instead of crawling the archive
+        if "--live" in sys.argv:
+            watch_live(config, browsers, logging.getLogger())
+        else:
+            run(config, browsers, logging.getLogger())
+    finally:
+        browsers.close()
+        metrics.finish(config, server)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,98 @@
+# Description: Per-source output profiles. Keep the stream as published, or store audio only (Opus/AAC) or a low-res H.264 proxy, selecting the smallest fitting rendition at the source and transcoding the rest in a CPU-bounded pool.
+import os
+import logging
+import threading
+import subprocess
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COPY = "copy"
+
+PROFILES = {
+    COPY: {},       # As published: no transcode, each source keeps its own container
+    "audio_opus": {
+        "extension": "opus",
+        "audio_only": True,
+        "ffmpeg": ["-vn", "-c:a", "libopus", "-b:a", "32k", "-application", "voip"],
+    },
+    "audio_aac": {
+        "extension": "m4a",
+        "audio_only": True,
+        "ffmpeg": ["-vn", "-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart"],
+    },
+    "proxy_h264": {
+        "extension": "mp4",
+        "max_height": 360,
+        "ffmpeg": ["-vf", "scale=-2:'min(360,ih)'", "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+                   "-c:a", "aac", "-b:a", "64k", "-movflags", "+faststart"],
+    },
+}
+
+SOURCE_PROFILES = {}    # Source name -> profile, set by configure()
+
+# Every transcode of the process shares these slots. Each ffmpeg runs single-threaded, so one per core keeps the
+# machine busy without download workers oversubscribing it.
+transcode_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+
+def configure(source, config):
+    # "output_profile" picks a profile by name; "profiles" in the same config can override or add profiles
+    name = config.get("output_profile", COPY)
+    overrides = config.get("profiles") or {}
+    if name not in PROFILES and name not in overrides:
+        raise ValueError(f"Unknown output profile '{name}' for {source}")
+    SOURCE_PROFILES[source] = dict(PROFILES.get(name, {}), **overrides.get(name, {}), name=name)
+
+
+def profile_for(source):
+    return SOURCE_PROFILES.get(source, {"name": COPY})
+
+
+def ytdlp_format(profile, default="best"):
+    # Let yt-dlp pick the smallest useful format instead of downloading video that is thrown away
+    if profile.get("audio_only"):
+        return "bestaudio/best"
+    if profile.get("max_height"):
+        return f"best[height<={profile['max_height']}]/worst"
+    return default
+
+
+def output_extension(profile, default):
+    return profile.get("extension") or default
+
+
+def source_path(output_path, extension):
+    # Where the tool writes before the transcode; keeps an extension ffmpeg and yt-dlp understand
+    return f"{os.path.splitext(output_path)[0]}.source.{extension}"
+
+
+def job_fields(profile, output_path, source_extension):
+    # Extra make_job() fields; the job carries its own transcode so a queued or replayed job needs no config
+    fields = {"profile": profile["name"]}
+    if profile.get("audio_only"):
+        fields["audio_only"] = True
+    if profile.get("max_height"):
+        fields["max_height"] = profile["max_height"]
+    if profile.get("ffmpeg"):
+        fields["transcode"] = profile["ffmpeg"]
+        fields["source_path"] = source_path(output_path, source_extension)
+    return fields
+
+
+def transcode(job, source=None):
+    # source_path -> output_path with the profile's ffmpeg arguments; waits for a free slot first
+    ffmpeg_command = ["ffmpeg", "-y", "-v", "error", "-i", job["source_path"], "-threads", "1"]
+    ffmpeg_command += job["transcode"] + [job["output_path"]]
+
+    with transcode_slots:
+        with metrics.stage(source, "transcode"):
+            logger.info(f"Transcoding '{job['title']}' to {job.get('profile')}...")
+            try:
+                subprocess.run(ffmpeg_command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            except Exception:
+                if os.path.exists(job["output_path"]):
+                    os.remove(job["output_path"])
+                raise
+    os.remove(job["source_path"])
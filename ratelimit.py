@@ -0,0 +1,171 @@
+# Description: Per-host politeness. A token bucket paces requests, a semaphore caps concurrent connections, and the rate halves on 429/503 (honouring Retry-After) or drops on latency spikes, then creeps back up while the host answers well.
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LIMITS = {
+    "rps": 10.0,            # Ceiling; the adaptive rate never goes above it
+    "burst": 20,
+    "concurrency": 16,
+    "min_rps": 0.2,
+    "latency_factor": 4.0,  # A response this many times slower than the running average counts as a spike
+}
+
+THROTTLED = (429, 503)
+
+
+def retry_after_seconds(value):
+    # Retry-After is either delta-seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Permit:
+    # Handed to the caller for one request; done() reports how the host answered
+    def __init__(self):
+        self.status = None
+        self.retry_after = None
+
+    def done(self, status, headers=None):
+        self.status = status
+        self.retry_after = retry_after_seconds((headers or {}).get("retry-after"))
+
+
+class HostLimiter:
+    def __init__(self, key, rps, burst, concurrency, min_rps, latency_factor):
+        self.key = key
+        self.max_rate = float(rps)
+        self.rate = float(rps)
+        self.min_rate = min(float(min_rps), self.max_rate)
+        self.burst = max(1, burst)
+        self.latency_factor = latency_factor
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.latency = None     # Moving average of response times, seconds
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+
+    def take(self):
+        # Block until a token is available and any Retry-After pause is over
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, status, seconds, retry_after=None, error=False):
+        # AIMD: halve on throttling, cut by a quarter on errors and latency spikes, add 5% of the ceiling otherwise
+        with self.lock:
+            old_rate = self.rate
+            if status in THROTTLED:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = 0.0
+                pause = retry_after if retry_after is not None else 1 / self.rate
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                metrics.inc("scraper_throttled_total", None, host=self.key, status=str(status))
+            elif error or (self.latency is not None and seconds > 1.0 and seconds > self.latency * self.latency_factor):
+                self.rate = max(self.min_rate, self.rate * 0.75)
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+            if not error and status not in THROTTLED:
+                self.latency = seconds if self.latency is None else 0.8 * self.latency + 0.2 * seconds
+
+            if self.rate < old_rate:
+                logger.info(f"Slowing down {self.key} to {self.rate:.2f} req/s")
+
+
+class RateLimiter:
+    def __init__(self, settings=None):
+        self.default = dict(DEFAULT_LIMITS)
+        self.hosts = {}         # Configured host suffix -> limits
+        self.limiters = {}      # Bucket key -> HostLimiter
+        self.lock = threading.Lock()
+        self.update(settings)
+
+    def update(self, settings):
+        # Merged rather than replaced: every source of a runner process adds its own hosts to the shared limiter
+        settings = settings or {}
+        with self.lock:
+            self.default.update(settings.get("default") or {})
+            for host, limits in (settings.get("hosts") or {}).items():
+                self.hosts[host] = limits
+
+    def _key(self, host):
+        # "congress.gov" covers www.congress.gov and any other subdomain, they share one bucket
+        for suffix in sorted(self.hosts, key=len, reverse=True):
+            if host == suffix or host.endswith("." + suffix):
+                return suffix
+        return host
+
+    def host(self, url):
+        host = urlparse(url).hostname or ""
+        with self.lock:
+            key = self._key(host)
+            if key not in self.limiters:
+                limits = dict(self.default, **self.hosts.get(key, {}))
+                self.limiters[key] = HostLimiter(key, limits["rps"], limits["burst"], limits["concurrency"],
+                                                 limits["min_rps"], limits["latency_factor"])
+            return self.limiters[key]
+
+    @contextmanager
+    def request(self, url):
+        # One request: a connection slot and a token on the way in, the outcome fed back on the way out
+        limiter = self.host(url)
+        limiter.slots.acquire()
+        try:
+            limiter.take()
+            permit = Permit()
+            started = time.monotonic()
+            try:
+                yield permit
+            except Exception:
+                limiter.observe(permit.status, time.monotonic() - started, permit.retry_after,
+                                error=permit.status is None)
+                raise
+            limiter.observe(permit.status, time.monotonic() - started, permit.retry_after)
+        finally:
+            limiter.slots.release()
+
+    def pace(self, url):
+        # Token only, for launching a tool (ffmpeg, yt-dlp) that opens its own connections
+        self.host(url).take()
+
+
+# One limiter per process, shared by every source and download worker
+limiter = RateLimiter()
+
+
+def configure(settings):
+    limiter.update(settings)
+
+
+def request(url):
+    return limiter.request(url)
+
+
+def pace(url):
+    limiter.pace(url)
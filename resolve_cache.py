@@ -0,0 +1,43 @@
+# Description: Event page -> media URL cache. Keeps what an event page resolved to (media URL, request headers, listing metadata) in the ledger, with a per-source TTL and LRU bound, so reruns, retries and overlapping ranges skip the browser for events already resolved.
+import time
+import logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "ttl_hours": 168,       # How long a resolved media URL is trusted without loading the event page again
+    "max_entries": 5000,    # Per source; least recently used mappings go first
+}
+
+
+class ResolveCache:
+    def __init__(self, ledger, source, settings=None):
+        self.ledger = ledger
+        self.source = source
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+
+    def get(self, event_url):
+        # {"media_url", "headers", "metadata"} or None on a miss or an expired entry
+        hit = self.ledger.get_resolved(self.source, event_url, self.settings["ttl_hours"] * 3600, time.time())
+        metrics.inc("scraper_resolve_cache_total", self.source, outcome="hit" if hit else "miss")
+        if hit:
+            logger.info(f"Resolved {event_url} from cache -> {hit['media_url']}")
+        return hit
+
+    def put(self, event_url, media_url, headers=None, metadata=None):
+        self.ledger.save_resolved(self.source, event_url, media_url, headers, metadata, time.time(),
+                                  self.settings["max_entries"])
+
+    def invalidate(self, event_url):
+        # Called when the event page fails to load; a failed download drops its entry in Ledger.save_failed_job
+        self.ledger.delete_resolved(self.source, event_url)
+
+
+def make_resolve_cache(config, ledger, source):
+    settings = dict(DEFAULT_SETTINGS, **(config.get("resolve_cache") or {}))
+    if not settings["enabled"]:
+        return None
+    return ResolveCache(ledger, source, settings)
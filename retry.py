@@ -0,0 +1,139 @@
+# Description: Download retries. Classifies failures, backs off per host with exponential delay and jitter, and replays the failed jobs kept in the ledger without re-crawling the listing pages.
+import time
+import random
+import logging
+import threading
+import subprocess
+import http.client
+from functools import partial
+
+from http_client import HttpError
+from hls import PlaylistError
+from ytdlp_engine import DownloadFailed
+import ratelimit
+import metrics
+
+logger = logging.getLogger(__name__)
+
+NO_MANIFEST = "no_manifest"         # No playlist/media URL behind the link; needs a new crawl, not a retry
+HTTP_4XX = "http_4xx"
+HTTP_5XX = "http_5xx"
+TRUNCATED = "truncated"             # Transfer ended early or left an empty file
+CORRUPT = "corrupt"                 # File written but failed verification (verify.py)
+PROCESS_EXIT = "process_exit"       # ffmpeg or yt-dlp exited non-zero, or the yt-dlp engine gave up
+NETWORK = "network"
+LOCAL = "local"                     # Missing tool or unwritable output path
+UNKNOWN = "unknown"
+
+RETRYABLE = {HTTP_5XX, TRUNCATED, CORRUPT, PROCESS_EXIT, NETWORK, UNKNOWN}
+RETRYABLE_STATUS = {408, 425, 429}  # Client errors that mean "later", not "never"
+
+DEFAULT_SETTINGS = {
+    "max_attempts": 3,      # Per job and run, including the first try
+    "base_delay": 5,
+    "max_delay": 300,
+}
+
+
+class TruncatedOutput(Exception):
+    pass
+
+
+class CorruptOutput(Exception):
+    pass
+
+
+def classify(error):
+    if isinstance(error, HttpError):
+        return HTTP_5XX if error.status >= 500 else HTTP_4XX
+    if isinstance(error, PlaylistError):
+        return NO_MANIFEST
+    if isinstance(error, CorruptOutput):
+        return CORRUPT
+    if isinstance(error, (TruncatedOutput, http.client.IncompleteRead)):
+        return TRUNCATED
+    if isinstance(error, (subprocess.CalledProcessError, DownloadFailed)):
+        return PROCESS_EXIT
+    if isinstance(error, (FileNotFoundError, PermissionError, IsADirectoryError)):
+        return LOCAL
+    if isinstance(error, (OSError, http.client.HTTPException)):
+        return NETWORK      # Resets, timeouts, DNS and TLS errors are all OSError subclasses
+    return UNKNOWN
+
+
+def retryable(error):
+    category = classify(error)
+    if category == HTTP_4XX:
+        return error.status in RETRYABLE_STATUS
+    return category in RETRYABLE
+
+
+class Backoff:
+    # Shared by every worker of a pool: a failure against a host delays the next attempt of any job on that host
+    def __init__(self, max_attempts=3, base_delay=5, max_delay=300):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = {}      # host -> consecutive failures
+        self.not_before = {}    # host -> earliest time of the next attempt
+        self.lock = threading.Lock()
+
+    def failure(self, host):
+        # Exponential delay with jitter in its upper half, so workers that failed together do not retry together
+        with self.lock:
+            count = self.failures.get(host, 0) + 1
+            self.failures[host] = count
+            delay = min(self.max_delay, self.base_delay * 2 ** (count - 1))
+            delay = random.uniform(delay / 2, delay)
+            self.not_before[host] = max(self.not_before.get(host, 0), time.time() + delay)
+            return delay
+
+    def success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            self.not_before.pop(host, None)
+
+    def wait(self, host):
+        with self.lock:
+            delay = self.not_before.get(host, 0) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def make_backoff(config):
+    settings = dict(DEFAULT_SETTINGS, **(config.get("retry") or {}))
+    return Backoff(settings["max_attempts"], settings["base_delay"], settings["max_delay"])
+
+
+def replay_failed(name, config, logger, include_all=False):
+    # Re-run the stored jobs of failed downloads. Entries without a stored job (no manifest found, or failed
+    # before jobs were kept) need the listing crawled again and are only counted.
+    from ledger import open_ledger, record_job, SUCCESS, FAILED, DUPLICATE
+    from download_pool import make_pool
+
+    ratelimit.configure(config.get("rate_limits"))
+    ledger = open_ledger(config["ledger_path"], source=name)
+    pool, dedup = make_pool(config, ledger, name,
+                            on_success=partial(record_job, ledger=ledger, status=SUCCESS),
+                            on_failure=partial(record_job, ledger=ledger, status=FAILED),
+                            on_duplicate=partial(record_job, ledger=ledger, status=DUPLICATE))
+
+    jobs = ledger.failed_jobs(name)
+    stored_titles = {job["title"] for job in jobs}
+    queued = 0
+    for job in jobs:
+        if job.get("failure") in RETRYABLE or include_all:
+            queued += pool.submit(job)
+        else:
+            logger.info(f"Not replaying '{job['title']}' ({job.get('failure')}), use --all to force it")
+
+    needs_crawl = {entry["title"] for entry in ledger.entries(FAILED, name)
+                   if entry["title"] not in stored_titles and not ledger.is_downloaded(entry["title"])}
+    logger.info(f"Replaying {queued} failed downloads for {name}; {len(needs_crawl)} failed entries need a new crawl")
+    metrics.inc("scraper_replayed_jobs_total", name, queued)
+
+    pool.join()
+    if dedup:
+        dedup.close()
+    ledger.close()
+    return queued
@@ -0,0 +1,134 @@
+# Description: Runs every source (North Dakota, South Dakota, US Congress, West Virginia) concurrently from one process, sharing a single browser pool.
+import sys
+import json
+import logging
+import threading
+import importlib
+from functools import partial
+
+from browser_pool import BrowserPool
+from browser import new_driver
+from retry import replay_failed
+import ratelimit
+import metrics
+
+# Source name -> module implementing load_config(path) and run(config, browsers, logger)
+SOURCES = {
+    "north_dakota": "north_dakota",
+    "south_dakota": "south_dakota",
+    "us_congress": "us_congress",
+    "west_virginia": "west_virginia_new",
+}
+
+
+def load_config(config_path="/config_runner.json"):
+    with open(config_path, "r") as file:
+        return json.load(file)
+
+
+def setup_logging(log_path):
+    logging.basicConfig(
+        filename=log_path,
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        filemode='w',  # Overwrite log file on each run
+        force=True      # Ensure no old handlers interfere
+    )
+
+    # Ensure logs also print to console in real-time
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(console_handler)
+
+    return logging.getLogger("runner")
+
+
+def load_source(name):
+    if name not in SOURCES:
+        raise ValueError(f"Unknown source '{name}', expected one of {', '.join(SOURCES)}")
+    return importlib.import_module(SOURCES[name])
+
+
+def run_source(name, config_path, browsers, errors, replay=None, live=False):
+    logger = logging.getLogger(name)
+    try:
+        module = load_source(name)
+        config = module.load_config(config_path) if config_path else module.load_config()
+        if replay is not None:
+            # Only the stored jobs of failed downloads, no listing pages are loaded
+            logger.info(f"Replaying failed downloads of {name}")
+            replay_failed(name, config, logger, include_all=replay == "all")
+        elif live:
+            # Only sources with a live listing have a watcher; the others are caught up by the next archive crawl
+            if not hasattr(module, "watch_live"):
+                logger.info(f"{name} has no live feed, nothing to watch")
+                return
+            logger.info(f"Watching {name} for live sessions")
+            module.watch_live(config, browsers, logger)
+        else:
+            logger.info(f"Starting {name}")
+            module.run(config, browsers, logger)
+        logger.info(f"Finished {name}")
+    except Exception as e:
+        logger.exception(f"Source {name} failed: {e}")
+        errors[name] = e
+
+
+def run_all(runner_config, names=None, browsers=None, replay=None, live=False):
+    # replay: None for a normal crawl, "retryable" or "all" to re-run failed downloads instead; live: record
+    # sessions while they broadcast
+    sources = runner_config.get("sources", {name: None for name in SOURCES})
+    names = names or list(sources)
+
+    own_browsers = browsers is None and replay is None
+    if own_browsers:
+        browsers = BrowserPool(partial(new_driver, runner_config.get("browser"), runner_config.get("chromedriver_path")),
+                               size=runner_config.get("browser_pool_size", 2))
+
+    # One thread per source; they compete for browser slots, so whichever source has work waiting gets the next free one
+    errors = {}
+    threads = [
+        threading.Thread(target=run_source, args=(name, sources.get(name), browsers, errors, replay, live),
+                         name=name)
+        for name in names
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        if own_browsers:
+            browsers.close()
+
+    return errors
+
+
+# Usage: python runner.py [--replay-failed [--all] | --live] [source ...]
+def main():
+    runner_config = load_config()
+    logger = setup_logging(runner_config["log_path"])
+    names = [a for a in sys.argv[1:] if not a.startswith("--")] or None
+    replay = None
+    if "--replay-failed" in sys.argv:
+        replay = "all" if "--all" in sys.argv else "retryable"
+    logger.info(f"Starting runner for {', '.join(names or runner_config.get('sources', SOURCES))}")
+
+    # Hosts shared by several sources (CDNs, YouTube) get their limits from the runner config
+    ratelimit.configure(runner_config.get("rate_limits"))
+
+    # One /metrics endpoint and run summary for every source, labelled by source
+    server = metrics.start(runner_config)
+    try:
+        errors = run_all(runner_config, names, replay=replay, live="--live" in sys.argv)
+    finally:
+        metrics.finish(runner_config, server)
+    if errors:
+        logger.info(f"Sources with errors: {', '.join(errors)}")
+        sys.exit(1)
+    logger.info("All sources finished")
+
+
+if __name__ == "__main__":
+    main()
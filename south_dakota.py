@@ -1,104 +1,87 @@
 # Description: This script downloads all audios of the sessions on a given range of dates from the South Dakota Assembly website.
 import time
 import json
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support import expected_conditions as EC
-import subprocess
+from selenium.common.exceptions import TimeoutException
 from datetime import datetime, timedelta
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import logging
 import sys
-# from download_helper import move_to_s3
-
-def load_config():
-    config_path = "/config_sd.json"
+from ledger import open_ledger, SUCCESS, FAILED, DUPLICATE
+from download_pool import make_job
+from storage import storage_key, media_filename
+from browser_pool import BrowserPool
+from browser import new_driver
+from waits import wait_for, wait_until, wait_for_dom_settled, configure
+from crawl import crawl
+import profiles
+import ratelimit
+import metrics
+
+SOURCE_NAME = "south_dakota"
+CONFIG_PATH = "/config_sd.json"
+
+COMMITTEE_LINKS = "div.v-list.hidden-sm-and-down.v-sheet.theme--light.v-list--dense a"
+COMMITTEE_LIST_URL = "https://sdlegislature.gov/Session/Committee/1231/Minutes"
+SESSION_YEAR = 2025     # Year of the session behind COMMITTEE_LIST_URL; the tables only show month and day
+
+# [url, title] for every committee in the side list, read in one round-trip to chromedriver
+COMMITTEES_JS = """
+return Array.from(document.querySelectorAll(arguments[0])).map(link => {
+    const title = link.querySelector('div.v-list-item__title');
+    return [link.href, title ? title.innerText.trim() : ''];
+});
+"""
+
+# [details, audio url] for every row on the current table page
+TABLE_ROWS_JS = """
+if (document.querySelector("tbody tr[class='v-data-table__empty-wrapper']")) return [];
+return Array.from(document.querySelectorAll("tbody tr[class='']")).map(row => {
+    const cell = row.querySelector("td[class='text-start']");
+    const link = row.querySelector("a[aria-label='SDPB Audio']");
+    return [cell ? cell.innerText.trim() : '', link ? link.href : 'No audio found'];
+});
+"""
+
+def load_config(config_path=CONFIG_PATH):
     with open(config_path, "r") as file:
         return json.load(file)
 
-# Accessing the config file
-config = load_config()
-download_dir = config["output_path"]
-start_date = config["start_date"]
-end_date = config["end_date"]
-failed_path = config["failed_download_json_path"]
-success_path = config["success_download_json_path"]
-log_path = config["log_path"]
-
-# Set up logging
-logging.basicConfig(
-    filename=log_path, 
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filemode='w',  # Overwrite log file on each run
-    force=True      # Ensure no old handlers interfere
-)
-
-# Ensure logs also print to console in real-time
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logging.getLogger().addHandler(console_handler)
-
-logger = logging.getLogger()
-logger.info("Starting South Dakota Assembly audio scraper")
-
-def get_driver():
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
-    options = webdriver.ChromeOptions()
-    options.add_argument(f"user-agent={user_agent}")
-    options.add_argument("--headless")  # Uncomment for headless operation
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument('--ignore-certificate-errors')
-    # maximize window
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option("useAutomationExtension", False)
-    
-    # Set performance logging capabilities directly on the options
-    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-    
-    # Setting up Chrome WebDriver
-    service = Service(path="/chromedriver-mac-arm64")
-    driver = webdriver.Chrome(service=service, options=options)
-
-    driver.execute_cdp_cmd("Network.enable", {})  # Enable network logging
-    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
-    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-        "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-    })
-
-    return driver
-
-def append_to_json(entry, respective_path):
-    # Load existing data or start a new list
-    try:
-        with open(respective_path, "r") as file:
-            event_list = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        event_list = []
-
-    # Append the new entry to the list
-    event_list.append(entry)
-
-    # Save the updated list back to the file
-    with open(respective_path, "w") as file:
-        json.dump(event_list, file, indent=4)  
-
-def format_date(date):
-    # Convert the string to a datetime object
-    date_obj = datetime.strptime(date, "%Y-%m-%d")
-
-    # Format the date to "DD-MM-YYYY"
-    formatted_date = date_obj.strftime("%d/%m/%Y")
-    return formatted_date
+def shard_config(config):
+    # Backfill hook: a shard stays within one session year and reads that session's committee list from
+    # "sessions" (year -> committee list URL); a year with no session configured fails the shard
+    year = config["start_date"][:4]
+    if config["end_date"][:4] != year:
+        raise ValueError(f"South Dakota shards must stay within one session year, got {config['start_date']} to {config['end_date']}")
+    committee_list_url = (config.get("sessions") or {}).get(year)
+    if not committee_list_url:
+        raise ValueError(f"No committee list configured for the {year} South Dakota session")
+    return dict(config, committee_list_url=committee_list_url, session_year=int(year))
+
+def setup_logging(log_path):
+    logging.basicConfig(
+        filename=log_path, 
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filemode='w',  # Overwrite log file on each run
+        force=True      # Ensure no old handlers interfere
+    )
+
+    # Ensure logs also print to console in real-time
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(console_handler)
+
+    return logging.getLogger()
 
 def format_title(title, details, date):
-    dt = datetime.strptime(details, "%m/%d %I:%M %p")       # Parse the date and time string
+    dt = datetime.strptime(details.split(" ", 1)[1], "%I:%M %p")     # Time of "03/10 08:00 AM"; the date is given
     formatted_time = dt.strftime("%H-%M")         # Format to HH-MM (24-hour format)
 
     # Combine everything to create the title
@@ -106,7 +89,7 @@ def format_title(title, details, date):
 
     return video_title    # YYYY-MM-DD_HH-MM_The_Title_of_Video.mp4
 
-def get_date_range():
+def get_date_range(start_date, end_date):
     # Generate a list of dates between start_date and end_date (inclusive).
     start = datetime.strptime(start_date, "%Y-%m-%d")
     end = datetime.strptime(end_date, "%Y-%m-%d")
@@ -120,153 +103,237 @@ def get_date_range():
 
     return date_list
 
-def download_video(driver):
-    
+def show_all_rows(driver):
+    # Switch the Vuetify footer to "All" rows so the whole table renders on one page
+    selects = driver.find_elements(By.CSS_SELECTOR, ".v-data-footer__select .v-select__slot")
+    if not selects:
+        return False
+
+    selects[0].click()
+    options = wait_until(driver, lambda d: [o for o in d.find_elements(By.CSS_SELECTOR, ".menuable__content__active .v-list-item")
+                                            if o.text.strip() == "All"], SOURCE_NAME)
+    options[0].click()
+    wait_for_dom_settled(driver, SOURCE_NAME)
+    return True
+
+def read_rows(driver):
+    # Fetching audio urls and audio details of the rows on the current page
+    return [(details, audio_url) for details, audio_url in driver.execute_script(TABLE_ROWS_JS)]
+
+def read_committee_table(driver, committee_url):
+    with metrics.stage(SOURCE_NAME, "page_load"):
+        # Navigating to specific committee page
+        with ratelimit.request(committee_url):
+            driver.get(committee_url)
+
+        # Click "Journals & Audio" tab once the tab bar has rendered
+        wait_until(driver, lambda d: len(d.find_elements(By.CSS_SELECTOR, "div.v-slide-group__wrapper a")) > 2,
+                   SOURCE_NAME, legacy_sleep=3)
+        wrapper = driver.find_elements(By.CSS_SELECTOR, "div.v-slide-group__wrapper a")[2]
+        wrapper.click()
+        wait_for(driver, By.CSS_SELECTOR, "div.v-data-table tbody tr", SOURCE_NAME, legacy_sleep=3)
+
+    with metrics.stage(SOURCE_NAME, "listing_parse"):
+        try:
+            show_all_rows(driver)
+        except TimeoutException:
+            pass    # No "All" option, page through the table instead
+
+        # Read every page once; dates are filtered client-side instead of reloading per date
+        rows = read_rows(driver)
+        while True:
+            next_buttons = driver.find_elements(By.CSS_SELECTOR, ".v-data-footer__icons-after button")
+            if not next_buttons or not next_buttons[0].is_enabled():
+                break
+            next_buttons[0].click()
+            wait_for_dom_settled(driver, SOURCE_NAME)
+            rows.extend(read_rows(driver))
+    return rows
+
+def row_date(details, session_year):
+    # Row details look like "03/10 08:00 AM"; the year comes from the session the table belongs to
+    try:
+        return datetime.strptime(f"{session_year}/{details}", "%Y/%m/%d %I:%M %p").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+def rows_for_date(rows, date, session_year):
+    # Keep the rows on the given day, compared on the full date
+    return [(details, audio_url) for details, audio_url in rows if row_date(details, session_year) == date]
+
+def session_dates(date_list, session_year):
+    # Only days of the session year can match a row of its tables
+    return [date for date in date_list if date.startswith(f"{session_year}-")]
+
+def queue_audio(pool, committee_title, details, audio_url, date, download_dir, current_date, ledger, logger):
+    formatted_title = format_title(committee_title, details, date)
+    entry = {
+        "title": formatted_title,
+        "recorded_date": date,
+        "link": audio_url,
+        "last_attempted_scrape_date": current_date
+    }
+
+    # Check if the title already exists in the ledger
+    if ledger.is_downloaded(entry["title"]):
+        logger.info(f"The event '{entry['title']}' has already been downloaded. Skipping download.")
+        return
+
+    logger.info(f"Queueing event '{entry['title']}'...")
+    profile = profiles.profile_for(SOURCE_NAME)
+    filename = media_filename(formatted_title, profiles.output_extension(profile, "mp3"))
+    # With a transcoding profile the download lands next to the final file and is converted afterwards
+    fields = profiles.job_fields(profile, f"{download_dir}{filename}", "mp3")
+    # Download audio using yt-dlp.
+    ytdlp_command = [
+        "yt-dlp",
+        "-f", profiles.ytdlp_format(profile),
+        "-o", fields.get("source_path", f"{download_dir}{filename}"),
+        audio_url
+    ]
+
+    # Determining Category
+    if "Senate" in committee_title:
+        category = "senate"
+    elif "House" in committee_title:
+        category = "house"
+    elif "Joint" in committee_title:
+        category = "joint"
+    else:
+        category = "unknown"   # default
+
+    # Determining Session type
+    if "Committee" in committee_title:
+        session_type = "committee"
+    elif "Hearing" in committee_title:
+        session_type = "hearing"
+    else:
+        session_type = "session"
+
+    # Same download written to stdout, used when the output streams straight into storage
+    stream_command = ["yt-dlp", "-f", profiles.ytdlp_format(profile), "-o", "-", audio_url]
+
+    pool.submit(make_job(formatted_title, audio_url, f"{download_dir}{filename}",
+                         ytdlp_command, entry=entry, category=category, session_type=session_type,
+                         storage_key=storage_key(SOURCE_NAME, category, session_type, filename),
+                         stream_command=stream_command, engine="ytdlp", format=profiles.ytdlp_format(profile),
+                         **fields))
+
+def crawl_committee(browsers, pool, committee_url, committee_title, date_list, download_dir, ledger, logger,
+                    session_year=SESSION_YEAR):
+    if not date_list:
+        return
     current_date = datetime.now().strftime("%Y-%m-%d")
-
-    driver.get("https://sdlegislature.gov/Session/Committee/1231/Minutes")
-    time.sleep(3)
-    logger.info("Loaded main committee page")
-
-    # Get committee urls and respective titles
-    committee_urls = [a.get_attribute("href") for a in driver.find_elements(By.CSS_SELECTOR, "div.v-list.hidden-sm-and-down.v-sheet.theme--light.v-list--dense a")]
-    committee_titles = [a.text for a in driver.find_elements(By.CSS_SELECTOR, "div.v-list.hidden-sm-and-down.v-sheet.theme--light.v-list--dense a div.v-list-item__title")]
-
-    date_list = get_date_range()
+    logger.info(f"Fetching audios for {committee_title} from {date_list[0]} to {date_list[-1]}")
+
+    # No listing fingerprint here: the table is only known once it is fully loaded, so skipping an unchanged one
+    # would save no browser work; rows already downloaded are skipped by the ledger instead
+    with browsers.browser(SOURCE_NAME) as driver:
+        rows = read_committee_table(driver, committee_url)
+
+    for date in date_list:
+        day_rows = rows_for_date(rows, date, session_year)
+        if not day_rows:
+            logger.info(f"No events found for {date} for {committee_title}")
+            continue
+
+        for details, audio_url in day_rows:
+            if audio_url != "No audio found":
+                queue_audio(pool, committee_title, details, audio_url, date, download_dir, current_date, ledger, logger)
+
+def download_video(browsers, pool, download_dir, start_date, end_date, workers, ledger, logger,
+                   committee_list_url=COMMITTEE_LIST_URL, session_year=SESSION_YEAR):
+    # Returns how many committees could not be read
+    date_list = session_dates(get_date_range(start_date, end_date), session_year)
+    if not date_list:
+        logger.info(f"No dates of the {session_year} session between {start_date} and {end_date}")
+        return 0
     logger.info(f"Generated date range: {date_list}")
 
-    for i in range(len(committee_urls)):
-
-        for date in date_list:
-            logger.info(f"Fetching videos for {committee_titles[i]} on {date}")
-
-            # Navigating to specific committee page
-            driver.get(committee_urls[i])
-            time.sleep(3)
-
-            # Click "Journals & Audio" tab
-            wrapper = driver.find_elements(By.CSS_SELECTOR, "div.v-slide-group__wrapper a")[2]
-            wrapper.click()
-            time.sleep(3)
-
-            # Filter by date
-            formatted_date = format_date(date)
-            filter = driver.find_element(By.CSS_SELECTOR, "input[placeholder='Filter']")
-            filter.send_keys(formatted_date)
-            time.sleep(3)
-
-            # Fetching audio urls and audio details
+    with browsers.browser(SOURCE_NAME) as driver:
+        with metrics.stage(SOURCE_NAME, "page_load"):
+            with ratelimit.request(committee_list_url):
+                driver.get(committee_list_url)
+            wait_for(driver, By.CSS_SELECTOR, COMMITTEE_LINKS, SOURCE_NAME, legacy_sleep=3)
+        logger.info("Loaded main committee page")
+
+        # Get committee urls and respective titles
+        with metrics.stage(SOURCE_NAME, "listing_parse"):
+            committees = driver.execute_script(COMMITTEES_JS, COMMITTEE_LINKS)
+        committee_urls = [url for url, _ in committees]
+        committee_titles = [title for _, title in committees]
+
+    # Work queue of committees, drained by as many browsers as the pool will lend
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(crawl_committee, browsers, pool, committee_urls[i], committee_titles[i],
+                            date_list, download_dir, ledger, logger, session_year): committee_titles[i]
+            for i in range(len(committee_urls))
+        }
+        failed = 0
+        for future in as_completed(futures):
             try:
-                if driver.find_elements(By.CSS_SELECTOR, "tbody tr[class='v-data-table__empty-wrapper']"):
-                    logger.info(f"No events found for the given date for {committee_titles[i]}")
-                    continue
-                else:
-                    tr_class = driver.find_elements(By.CSS_SELECTOR, "tbody tr[class='']")
-
-                    # Fetching audio urls
-                    audio_urls = []
-                    for tr in tr_class:
-                        if tr.find_elements(By.CSS_SELECTOR, "a[aria-label='SDPB Audio']"):
-                            audio_urls.append(tr.find_element(By.CSS_SELECTOR, "a[aria-label='SDPB Audio']").get_attribute("href"))
-                        else:
-                            audio_urls.append("No audio found")
-                    
-                    # Fetching audio details
-                    audio_details = []
-                    for tr in tr_class:
-                        audio_details.append(tr.find_elements(By.CSS_SELECTOR, "td[class='text-start']")[0].text)
-
-                    # Downloading audios from the event page
-                    for j in range(len(audio_urls)):
-                        formatted_title = format_title(committee_titles[i], audio_details[j], date)
-                        if audio_urls[j] != "No audio found":
-                                
-                            entry = {
-                                "title": formatted_title,
-                                "recorded_date": date,
-                                "link": audio_urls[j],
-                                "last_attempted_scrape_date": current_date
-                            }
-                            
-                            with open(success_path, "r") as file:
-                                success_list = json.load(file)
-
-                            # Check if the title already exists in success_list
-                            title_exists = any(existing_event["title"] == entry["title"] for existing_event in success_list)
-
-                            if title_exists:
-                                logger.info(f"The event '{entry['title']}' has already been downloaded. Skipping download.")
-                            else:
-                                logger.info(f"Downloading event '{entry['title']}'...")
-                                # Download the audio
-                                try:
-                                    start_time = time.time()
-                                    # Download audio using yt-dlp.
-                                    ytdlp_command = [
-                                        "yt-dlp",
-                                        "-f", "best",
-                                        "-o", f"{download_dir}{formatted_title}.mp3",
-                                        audio_urls[j]
-                                    ]
-                                    subprocess.run(ytdlp_command)
-
-                                    # Determining Category
-                                    if "Senate" in committee_titles[i]:
-                                        category = "senate"
-                                    elif "House" in committee_titles[i]:
-                                        category = "house"
-                                    elif "Joint" in committee_titles[i]:
-                                        category = "joint"
-                                    else:
-                                        category = "unknown"   # default
-
-                                    # Determining Session type
-                                    if "Committee" in committee_titles[i]:
-                                        session_type = "committee"
-                                    elif "Hearing" in committee_titles[i]:
-                                        session_type = "hearing"
-                                    else:
-                                        session_type = "session"                                    
-                                    
-                                    # move_to_s3("south dakota", formatted_title, category, session_type, url=audio_urls[j])
-                                    # print(f"CATEGORY= {category}")
-                                    # print(f"SESSION TYPE= {session_type}")
-
-                                    # Updating the success list
-                                    append_to_json(entry, success_path)
-
-                                    logger.info(f"\nAudio downloaded successfully! -> {formatted_title}")
-
-                                    end_time = time.time()
-                                    time_taken = (end_time - start_time)/60
-                                    logger.info(f"Time taken to download audio: {time_taken:.2f} min\n")
-
-
-                                
-                                except subprocess.CalledProcessError as e:
-                                    entry = {
-                                        "title": formatted_title,
-                                        "recorded_date": date,
-                                        "link": audio_urls[j],
-                                        "last_attempted_scrape_date": current_date
-                                    }
-                                    append_to_json(entry, failed_path)              
-                                    logger.info(f"\nError downloading audio: {e}")
-                                    logger.info(f"Failed to download audio! -> {formatted_title}\n")
-                        else:
-                            continue  
-
+                future.result()
             except Exception as e:
-                logger.info(f"\nEncountered error while fetching audio urls and details: {e}\n")
-                continue
-
+                failed += 1
+                logger.info(f"\nEncountered error while fetching audio urls and details for {futures[future]}: {e}\n")
+    return failed
+
+
+def record_success(job, ledger, logger):
+    # Updating the success list
+    ledger.record(job["entry"], SUCCESS, source=SOURCE_NAME)
+
+    logger.info(f"\nAudio downloaded successfully! -> {job['title']}")
+    logger.info(f"Time taken to download audio: {job['elapsed'] / 60:.2f} min\n")
+
+def record_failure(job, error, ledger, logger):
+    ledger.record(job["entry"], FAILED, source=SOURCE_NAME)
+    ledger.save_failed_job(job, source=SOURCE_NAME)     # Kept for a replay without re-crawling
+    logger.info(f"\nError downloading audio: {error}")
+    logger.info(f"Failed to download audio! -> {job['title']}\n")
+
+def record_duplicate(job, owner, ledger, logger):
+    ledger.record(job["entry"], DUPLICATE, source=SOURCE_NAME)
+    logger.info(f"Skipped audio already stored as '{owner}' -> {job['title']}")
+
+def run(config, browsers, logger, pool=None):
+    # Source entry point used by runner.py and main()
+    configure(SOURCE_NAME, config.get("wait_timeout", 15))
+    ratelimit.configure(config.get("rate_limits"))    # Adds this source's hosts to the shared limiter
+    profiles.configure(SOURCE_NAME, config)
+    ledger = open_ledger(config["ledger_path"], config["success_download_json_path"],
+                         config["failed_download_json_path"], source=SOURCE_NAME)
+    with crawl(config, SOURCE_NAME, ledger, logger, pool,
+               on_success=partial(record_success, ledger=ledger, logger=logger),
+               on_failure=partial(record_failure, ledger=ledger, logger=logger),
+               on_duplicate=partial(record_duplicate, ledger=ledger, logger=logger)) as run_state:
+        # Committees are crawled in parallel, each one leasing a browser from the pool
+        failed = download_video(browsers, run_state.pool, config["output_path"], run_state.start_date,
+                                config["end_date"], config.get("committee_workers", 3), ledger, logger,
+                                config.get("committee_list_url", COMMITTEE_LIST_URL),
+                                config.get("session_year", SESSION_YEAR))
+        # A committee that could not be read has to be crawled again, so the range is not complete
+        if not failed:
+            run_state.complete(config["end_date"])
+
+    # Raised once the queued downloads are done, so a backfill shard or the runner sees the crawl as failed
+    if failed:
+        raise RuntimeError(f"{failed} committees could not be read")
 
 def main():
-    driver = get_driver()
+    config = load_config()
+    logger = setup_logging(config["log_path"])
+    logger.info("Starting South Dakota Assembly audio scraper")
 
-    download_video(driver)
-
-    driver.quit()
+    # Optional /metrics endpoint and JSON run summary
+    server = metrics.start(config)
+    browsers = BrowserPool(partial(new_driver, config.get("browser"), config.get("chromedriver_path")), size=config.get("committee_workers", 3))
+    try:
+        run(config, browsers, logger)
+    finally:
+        browsers.close()
+        metrics.finish(config, server)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,232 @@
+# Description: Storage backends for finished recordings. Streams ffmpeg/yt-dlp output straight into a parallel S3 multipart upload, with a local-directory stand-in.
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+def storage_key(state, category, session_type, filename):
+    # e.g. south_dakota/senate/committee/2025-03-10_08-00_Senate_Education.mp3
+    return "/".join([state.replace(" ", "_"), category, session_type, filename])
+
+
+def media_filename(title, extension):
+    # Ledger titles already end in ".mp4" whatever the media is, so the real extension replaces it
+    return f"{os.path.splitext(title)[0]}.{extension}"
+
+
+def read_chunk(stream, size):
+    # Pipes return short reads; keep reading until the part is full or the stream ends
+    chunks, remaining = [], size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        chunks.append(data)
+        remaining -= len(data)
+    return b"".join(chunks)
+
+
+def settle_parts(futures):
+    # Raises the error of a failed part upload; returns the parts still in flight
+    running = []
+    for future in futures:
+        if future.done():
+            future.result()
+        else:
+            running.append(future)
+    return running
+
+
+class CountingReader:
+    # Wraps a pipe to count the bytes that pass through it on the way to storage
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class LocalStorage:
+    # Stand-in for S3 on a dev box or in tests: same interface, files land under root
+    def __init__(self, root):
+        self.root = root
+
+    def upload_stream(self, key, stream, resume_path=None, check=None):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            with open(path + ".tmp", "wb") as file:
+                shutil.copyfileobj(stream, file, 4 * MB)
+            if check:
+                check()
+        except Exception:
+            # open() itself may have failed; the original error is the one that matters
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path + ".tmp")
+            raise
+        os.replace(path + ".tmp", path)
+        return path
+
+    def abort(self, resume_path):
+        pass    # A failed copy is removed on the spot, nothing is left behind
+
+    def exists(self, key):
+        return os.path.exists(os.path.join(self.root, key))
+
+
+class S3Storage:
+    def __init__(self, bucket, endpoint_url=None, part_size=16 * MB, max_inflight=4, client=None, resume_hours=24):
+        if client is None:
+            import boto3   # Only needed when S3 delivery is switched on
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.part_size = max(part_size, 5 * MB)     # S3 minimum for every part but the last
+        self.max_inflight = max_inflight
+        self.resume_seconds = resume_hours * 3600     # Older unfinished uploads are aborted rather than resumed
+
+    def load_progress(self, resume_path, key):
+        try:
+            with open(resume_path, "r") as file:
+                progress = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if (progress.get("key") == key and progress.get("part_size") == self.part_size
+                and time.time() - progress.get("created", 0) < self.resume_seconds):
+            return progress
+        # Another key, another part size or too old to trust: its parts would otherwise be billed forever
+        self.abort(resume_path)
+        return None
+
+    def abort(self, resume_path):
+        # Drops the multipart upload tracked in resume_path, called when a job has failed for good
+        try:
+            with open(resume_path, "r") as file:
+                progress = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        try:
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=progress["key"], UploadId=progress["upload_id"])
+            logger.info(f"Aborted unfinished upload of {progress['key']}")
+        except Exception as e:
+            # Already completed, aborted or expired by a bucket lifecycle rule
+            logger.info(f"Could not abort upload of {progress.get('key')}: {e}")
+        os.remove(resume_path)
+
+    def save_progress(self, resume_path, progress):
+        tmp_path = resume_path + ".tmp"
+        with open(tmp_path, "w") as file:
+            json.dump(progress, file)
+        os.replace(tmp_path, resume_path)
+
+    def upload_stream(self, key, stream, resume_path=None, check=None):
+        # check() runs once the stream is drained and may raise to stop a truncated object being completed
+        progress = self.load_progress(resume_path, key) if resume_path else None
+        if progress is None:
+            upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+            progress = {"key": key, "upload_id": upload_id, "part_size": self.part_size, "parts": {},
+                        "created": time.time()}
+            if resume_path:
+                self.save_progress(resume_path, progress)
+        else:
+            logger.info(f"Resuming upload of {key}: {len(progress['parts'])} parts already stored")
+
+        upload_id = progress["upload_id"]
+        lock = threading.Lock()
+        slots = threading.Semaphore(self.max_inflight)     # Bounds how many part buffers are held in memory
+
+        def upload_part(number, body):
+            try:
+                etag = self.client.upload_part(Bucket=self.bucket, Key=key, PartNumber=number,
+                                               UploadId=upload_id, Body=body)["ETag"]
+                with lock:
+                    progress["parts"][str(number)] = etag
+                    if resume_path:
+                        self.save_progress(resume_path, progress)
+            finally:
+                slots.release()
+
+        futures = []
+        number = 0
+        executor = ThreadPoolExecutor(max_workers=self.max_inflight)
+        try:
+            try:
+                while True:
+                    slots.acquire()
+                    # A failed part stops the upload before the rest of the stream is read and sent
+                    futures = settle_parts(futures)
+                    body = read_chunk(stream, self.part_size)
+                    if not body:
+                        slots.release()
+                        break
+                    number += 1
+                    # Stored on an earlier attempt: the bytes are only re-read, unless they changed since (the
+                    # ETag of a part is the MD5 of its body)
+                    stored = progress["parts"].get(str(number))
+                    if stored and stored.strip('"') == hashlib.md5(body).hexdigest():
+                        slots.release()
+                        continue
+                    if stored:
+                        logger.info(f"Part {number} of {key} differs from the stored one, uploading it again")
+                    futures.append(executor.submit(upload_part, number, body))
+
+                for future in futures:
+                    future.result()
+            finally:
+                # Parts already read (at most max_inflight) are still stored, for a resume or before the abort
+                executor.shutdown(wait=True)
+
+            if check:
+                check()
+            if number == 0:
+                raise ValueError(f"Empty stream for {key}")
+
+            parts = [{"PartNumber": n, "ETag": progress["parts"][str(n)]} for n in range(1, number + 1)]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                                  MultipartUpload={"Parts": parts})
+        except Exception:
+            # A resumable upload keeps its stored parts for the retry, abort() drops them once the job fails for good
+            if not resume_path:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
+
+        if resume_path and os.path.exists(resume_path):
+            os.remove(resume_path)
+        return f"s3://{self.bucket}/{key}"
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except Exception:
+            return False
+
+
+def make_storage(config):
+    # None keeps the old behaviour of writing finished files to the local output path
+    settings = config.get("storage") or {}
+    backend = settings.get("backend", "none")
+    if backend == "s3":
+        return S3Storage(
+            settings["bucket"],
+            endpoint_url=settings.get("endpoint_url"),      # MinIO or moto server for local testing
+            part_size=settings.get("part_size_mb", 16) * MB,
+            max_inflight=settings.get("max_inflight_parts", 4),
+            resume_hours=settings.get("resume_hours", 24),
+        )
+    if backend == "local":
+        return LocalStorage(settings["root"])
+    return None
@@ -1,100 +1,64 @@
 # Description: This script downloads all videos of the sessions on a given range of dates from the US Congress Assembly website.
 import time
 import json
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import subprocess
 import os
 import logging
 import sys
 from datetime import datetime, timedelta
-# from download_helper import move_to_s3
-
-def load_config():
-    config_path = "/config_us.json"
+from functools import partial
+from urllib.parse import urljoin
+from ledger import open_ledger, SUCCESS, FAILED, DUPLICATE
+from download_pool import make_job
+from storage import storage_key, media_filename
+from resolve_cache import make_resolve_cache
+from dedup import canonical_url
+from browser_pool import BrowserPool
+from browser import new_driver
+from fetcher import make_fetcher
+from waits import configure
+from watermarks import content_hash
+from crawl import crawl
+import profiles
+import ratelimit
+import metrics
+
+SOURCE_NAME = "us_congress"
+CONFIG_PATH = "/config_us.json"
+SCHEDULE_URL = "https://www.congress.gov/committee-schedule/daily/{date}"     # {date} is YYYY/MM/DD
+
+def load_config(config_path=CONFIG_PATH):
     with open(config_path, "r") as file:
         return json.load(file)
 
-# Accessing the config file
-config = load_config()
-download_path = config["output_path"]
-start_date = config["start_date"]
-end_date = config["end_date"]
-failed_path = config["failed_download_json_path"]
-success_path = config["success_download_json_path"]
-log_path = config["log_path"]
-
-# Set up logging
-logging.basicConfig(
-    filename=log_path, 
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filemode='w',  # Overwrite log file on each run
-    force=True      # Ensure no old handlers interfere
-)
-
-# Ensure logs also print to console in real-time
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logging.getLogger().addHandler(console_handler)
-
-logger = logging.getLogger()
-logger.info("Starting South Dakota Assembly audio scraper")
-
-def get_driver():
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
-    options = webdriver.ChromeOptions()
-    options.add_argument(f"user-agent={user_agent}")
-    options.add_argument("--headless")  # Uncomment for headless operation
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument('--ignore-certificate-errors')
-    # maximize window
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option("useAutomationExtension", False)
-    
-    # Set performance logging capabilities directly on the options
-    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-    
-    # Setting up Chrome WebDriver
-    service = Service(path="/chromedriver-mac-arm64")
-    driver = webdriver.Chrome(service=service, options=options)
-
-    driver.execute_cdp_cmd("Network.enable", {})  # Enable network logging
-    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
-    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-        "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-    })
-
-    return driver
-
-def append_to_json(entry, respective_path):
-    # Load existing data or start a new list
-    try:
-        with open(respective_path, "r") as file:
-            event_list = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        event_list = []
+def setup_logging(log_path):
+    logging.basicConfig(
+        filename=log_path, 
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        filemode='w',  # Overwrite log file on each run
+        force=True      # Ensure no old handlers interfere
+    )
 
-    # Append the new entry to the list
-    event_list.append(entry)
+    # Ensure logs also print to console in real-time
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logging.getLogger().addHandler(console_handler)
 
-    # Save the updated list back to the file
-    with open(respective_path, "w") as file:
-        json.dump(event_list, file, indent=4)  
+    return logging.getLogger()
 
-def format_title(title, date):
-    # Combine everything to create the title
-    video_title = f"{date}_00-00_{title.replace(' ', '_')}.mp4"
+def format_title(title, date, event_id=None):
+    # The schedule has no start times, so hearings sharing a name on one day are told apart by event id
+    video_title = f"{date}_00-00_{title.replace(' ', '_')}"
+    if event_id:
+        video_title += f"_{event_id}"
 
-    return video_title    # YYYY-MM-DD_HH-MM_The_Title_of_Video.mp4
+    return f"{video_title}.mp4"    # YYYY-MM-DD_HH-MM_The_Title_of_Video[_EventId].mp4
 
-def get_date_range():
+def get_date_range(start_date, end_date):
     # Generate a list of dates between start_date and end_date (inclusive).
     start = datetime.strptime(start_date, "%Y-%m-%d")
     end = datetime.strptime(end_date, "%Y-%m-%d")
@@ -108,9 +72,114 @@ def get_date_range():
 
     return date_list
 
-def download_video(driver):
+def event_id(event):
+    return event["url"].rstrip("/").split("/")[-1]
+
+def resolve_event(fetcher, pool, event, download_path, ledger, logger, cache=None):
+    # Event page -> YouTube URL -> download job; event is {url, title, type, date[, event_id]} from the schedule listing.
+    # True once the event is queued or already downloaded, False when it has to be looked at again on the next run
+    current_date = datetime.now().strftime("%Y-%m-%d")
+    formatted_title = format_title(event["title"], event["date"], event.get("event_id"))
+    cached = cache.get(event["url"]) if cache else None
+    if cached:
+        youtube_url = cached["media_url"]
+    else:
+        with metrics.stage(SOURCE_NAME, "resolve"):
+            # Open the event page
+            try:
+                event_page = fetcher.fetch(event["url"], ready=lambda p: p.root.find("iframe") is not None)
+            except Exception as e:
+                logger.info(f"Could not load event page {event['url']}: {e}")
+                event_page = None
+                if cache:
+                    cache.invalidate(event["url"])
+
+            # Get the video URL
+            iframe = event_page.root.find("iframe") if event_page else None
+            youtube_url = urljoin(event_page.url, iframe.get("src")) if iframe is not None and iframe.get("src") else None
+        if cache and youtube_url:
+            cache.put(event["url"], youtube_url, metadata={"title": event["title"], "type": event["type"],
+                                                           "date": event["date"]})
+    if youtube_url:
+        # Check for duplicates
+        entry = {
+            "title": formatted_title,
+            "recorded_date": event["date"],
+            "link": youtube_url,
+            "last_attempted_scrape_date": current_date
+        }
+
+        # A stored title with a different video is another hearing of the same name, not this one
+        stored_links = ledger.downloaded_links(entry["title"])
+        if stored_links and canonical_url(youtube_url) not in {canonical_url(link) for link in stored_links}:
+            formatted_title = format_title(event["title"], event["date"], event_id(event))
+            entry["title"] = formatted_title
+
+        # Check if the title already exists in the ledger
+        title_exists = ledger.is_downloaded(entry["title"])
+
+        if title_exists:
+            logger.info(f"The event '{entry['title']}' has already been downloaded. Skipping download.")
+
+        else:
+            logger.info(f"Queueing event '{entry['title']}'...")
+            profile = profiles.profile_for(SOURCE_NAME)
+            filename = media_filename(formatted_title, profiles.output_extension(profile, "mp4"))
+            # With a transcoding profile the download lands next to the final file and is converted afterwards
+            fields = profiles.job_fields(profile, f"{download_path}{filename}", "mp4")
+            # Download video using yt-dlp.
+            ytdlp_command = [
+                "yt-dlp",
+                "-f", profiles.ytdlp_format(profile),
+                "-o", fields.get("source_path", f"{download_path}{filename}"),
+                youtube_url
+            ]
+
+            # Determining Category
+            if "senate" in event["type"].lower():
+                category = "senate"
+            elif "house" in event["type"].lower():
+                category = "house"
+            elif "joint" in event["type"].lower():
+                category = "joint"
+            else:
+                category = "unknown"   # default
 
-    date_list = get_date_range()
+            # Determining Session type
+            if "committee" in event["type"].lower():
+                session_type = "committee"
+            elif "hearing" in event["type"].lower():
+                session_type = "hearing"
+            else:
+                session_type = "session"     # default 
+
+            # Same download written to stdout, used when the output streams straight into storage
+            stream_command = ["yt-dlp", "-f", profiles.ytdlp_format(profile), "-o", "-", youtube_url]
+
+            pool.submit(make_job(formatted_title, youtube_url, f"{download_path}{filename}",
+                                 ytdlp_command, entry=entry, category=category, session_type=session_type,
+                                 storage_key=storage_key(SOURCE_NAME, category, session_type, filename),
+                                 stream_command=stream_command, engine="ytdlp", format=profiles.ytdlp_format(profile),
+                                 event_url=event["url"], **fields))
+        return True
+
+    else:
+        logger.info("No video urls were found!")
+        entry = {
+            "title": formatted_title,
+            "recorded_date": event["date"],
+            "link": "Not Found",
+            "last_attempted_scrape_date": current_date
+        }
+        ledger.record(entry, FAILED, source=SOURCE_NAME)    
+        logger.info(f"Failed to download video! -> {formatted_title}")
+        return False
+
+def download_video(fetcher, pool, download_path, start_date, end_date, ledger, logger, watermark=None, schedule_url=SCHEDULE_URL,
+                   resolve=None, cache=None):
+    # Returns the first date with an event that had no video yet, None when every event was handled
+    date_list = get_date_range(start_date, end_date)
+    first_unresolved = None
 
     for date in date_list:
         logger.info(f"Fetching videos for {date}")
@@ -118,121 +187,109 @@ def download_video(driver):
         # Generating url based on date
         date_obj = datetime.strptime(date, "%Y-%m-%d")
         formatted_date = date_obj.strftime("%Y/%m/%d")
-        url = f"https://www.congress.gov/committee-schedule/daily/{formatted_date}"
-        
-        current_date = datetime.now().strftime("%Y-%m-%d")
+        url = schedule_url.format(date=formatted_date)
 
-        driver.get(url)
-        time.sleep(5)
-        
-        # Get event urls from the session cards
-        main_content = driver.find_element(By.CSS_SELECTOR, "article.column-main.main-content[role='article']")
-        event_urls = [a.get_attribute("href") for a in main_content.find_elements(By.CSS_SELECTOR, ".schedule-heading.blue a")]
-        event_titles = [a.text for a in main_content.find_elements(By.CSS_SELECTOR, ".committee-schedule-section h4")]
-        event_type = [a.text for a in main_content.find_elements(By.CSS_SELECTOR, ".committee-schedule-section h3")]
+        page = fetcher.fetch(url, ready=lambda p: p.root.find("article", "column-main main-content") is not None,
+                             headers=watermark.conditional_headers(url) if watermark else None)
+        if watermark and page.status == 304:
+            logger.info(f"Schedule for {date} has not changed since the last run. Skipping.")
+            continue
 
-        # Downloading videos from the event page
+        # Get event urls from the session cards
+        with metrics.stage(SOURCE_NAME, "listing_parse"):
+            main_content = page.root.find("article", "column-main main-content")
+            event_urls = [urljoin(page.url, a.get("href")) for heading in main_content.find_all(cls="schedule-heading blue") for a in heading.find_all("a")]
+            event_titles = [h4.text() for section in main_content.find_all(cls="committee-schedule-section") for h4 in section.find_all("h4")]
+            event_type = [h3.text() for section in main_content.find_all(cls="committee-schedule-section") for h3 in section.find_all("h3")]
+
+        # Fingerprint the listing itself, the raw page carries per-request tokens
+        digest = content_hash("\n".join(event_urls + event_titles + event_type))
+        if watermark and watermark.listing_unchanged(url, digest=digest):
+            logger.info(f"Schedule for {date} has not changed since the last run. Skipping.")
+            continue
+
+        # Downloading videos from the event page, or handing each event to the job queue as a resolve job
+        seen_titles = set()
+        unresolved = 0
         for i in range(len(event_urls)):
-            formatted_title = format_title(event_titles[i], date)
-            # Click on the event
-            driver.get(event_urls[i])
-            time.sleep(5)
-            
-            # Get the video URL
-            if driver.find_elements(By.TAG_NAME, "iframe"):
-                youtube_url = driver.find_element(By.TAG_NAME, "iframe").get_attribute("src")
-            else:
-                youtube_url = None
-            if youtube_url:
-                    # Check for duplicates
-                    entry = {
-                        "title": formatted_title,
-                        "recorded_date": date,
-                        "link": youtube_url,
-                        "last_attempted_scrape_date": current_date
-                    }
-
-                    with open(success_path, "r") as file:
-                        success_list = json.load(file)
-
-                    # Check if the title already exists in success_list
-                    title_exists = any(existing_event["title"] == entry["title"] for existing_event in success_list)
-
-                    if title_exists:
-                        logger.info(f"The event '{entry['title']}' has already been downloaded. Skipping download.")
-
-                    else:
-                        logger.info(f"Downloading event '{entry['title']}'...")
-                        # Download the audio
-                        try:
-                            start_time = time.time()
-                            # Download video using yt-dlp.
-                            ytdlp_command = [
-                                "yt-dlp",
-                                "-f", "best",
-                                "-o", f"{download_path}{formatted_title}.mp4",
-                                youtube_url
-                            ]
-                            subprocess.run(ytdlp_command)
-
-                            # Determining Category
-                            if "senate" in event_type[i].lower():
-                                category = "senate"
-                            elif "house" in event_type[i].lower():
-                                category = "house"
-                            elif "joint" in event_type[i].lower():
-                                category = "joint"
-                            else:
-                                category = "unknown"   # default
-
-                            # Determining Session type
-                            if "committee" in event_type[i].lower():
-                                session_type = "committee"
-                            elif "hearing" in event_type[i].lower():
-                                session_type = "hearing"
-                            else:
-                                session_type = "session"     # default 
-
-                            # move_to_s3("us congress", formatted_title, category, session_type, url=youtube_url)
-                            
-                            # Updating the success list
-                            append_to_json(entry, success_path)
-
-                            logger.info(f"Video downloaded successfully! -> {formatted_title}")
-
-                            end_time = time.time()
-                            time_taken = (end_time - start_time)/60
-                            logger.info(f"Time taken to download video: {time_taken:.2f} min")
-                        
-                        except subprocess.CalledProcessError as e:
-                            entry = {
-                                "title": formatted_title,
-                                "recorded_date": date,
-                                "link": youtube_url,
-                                "last_attempted_scrape_date": current_date
-                            }
-                            append_to_json(entry, failed_path)              
-                            logger.info(f"Error downloading video: {e}")
-                            logger.info(f"Failed to download video! -> {formatted_title}")
-
-            else:
-                logger.info("No video urls were found!")
-                entry = {
-                    "title": formatted_title,
-                    "recorded_date": date,
-                    "link": "Not Found",
-                    "last_attempted_scrape_date": current_date
-                }
-                append_to_json(entry, failed_path)    
-                logger.info(f"Failed to download video! -> {formatted_title}")
-
+            event = {"url": event_urls[i], "title": event_titles[i], "type": event_type[i], "date": date}
+            # Hearings sharing a name on one day would write to the same file; later ones carry their event id
+            if event["title"] in seen_titles:
+                event["event_id"] = event_id(event)
+            seen_titles.add(event["title"])
+            if resolve is not None:
+                resolve(event)
+            elif not resolve_event(fetcher, pool, event, download_path, ledger, logger, cache):
+                unresolved += 1
+
+        # Only remember the listing once every event on it has been handled, so a missing video is looked for again
+        if unresolved:
+            logger.info(f"{unresolved} events of {date} had no video yet, the schedule will be read again next run")
+            first_unresolved = first_unresolved or date
+        elif watermark:
+            watermark.update_listing(url, digest, page.headers)
+
+    return first_unresolved
+
+
+def record_success(job, ledger, logger):
+    # Updating the success list
+    ledger.record(job["entry"], SUCCESS, source=SOURCE_NAME)
+
+    logger.info(f"Video downloaded successfully! -> {job['title']}")
+    logger.info(f"Time taken to download video: {job['elapsed'] / 60:.2f} min")
+
+def record_failure(job, error, ledger, logger):
+    ledger.record(job["entry"], FAILED, source=SOURCE_NAME)
+    ledger.save_failed_job(job, source=SOURCE_NAME)     # Kept for a replay without re-crawling
+    logger.info(f"Error downloading video: {error}")
+    logger.info(f"Failed to download video! -> {job['title']}")
+
+def record_duplicate(job, owner, ledger, logger):
+    ledger.record(job["entry"], DUPLICATE, source=SOURCE_NAME)
+    logger.info(f"Skipped video already stored as '{owner}' -> {job['title']}")
+
+def run(config, browsers, logger, pool=None, resolve=None):
+    # Source entry point used by runner.py and main()
+    configure(SOURCE_NAME, config.get("wait_timeout", 15))
+    ratelimit.configure(config.get("rate_limits"))    # Adds this source's hosts to the shared limiter
+    profiles.configure(SOURCE_NAME, config)
+    ledger = open_ledger(config["ledger_path"], config["success_download_json_path"],
+                         config["failed_download_json_path"], source=SOURCE_NAME)
+
+    # Plain HTTP first; a browser is only leased if congress.gov refuses the fast path
+    fetcher = make_fetcher(browsers, SOURCE_NAME, settle=5, use_http=config.get("http_fast_path", True))
+    with crawl(config, SOURCE_NAME, ledger, logger, pool,
+               on_success=partial(record_success, ledger=ledger, logger=logger),
+               on_failure=partial(record_failure, ledger=ledger, logger=logger),
+               on_duplicate=partial(record_duplicate, ledger=ledger, logger=logger)) as run_state:
+        try:
+            first_unresolved = download_video(fetcher, run_state.pool, config["output_path"], run_state.start_date,
+                                              config["end_date"], ledger, logger, run_state.watermark,
+                                              config.get("schedule_url", SCHEDULE_URL), resolve,
+                                              make_resolve_cache(config, ledger, SOURCE_NAME))
+            # An incremental run has to come back to the first day with a missing video
+            complete = config["end_date"]
+            if first_unresolved:
+                complete = (datetime.strptime(first_unresolved, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+            run_state.complete(complete)
+        finally:
+            # Browser is no longer needed once every event has been resolved
+            fetcher.close()
 
 def main():
-    driver = get_driver()
-
-    download_video(driver)
+    config = load_config()
+    logger = setup_logging(config["log_path"])
+    logger.info("Starting US Congress video scraper")
 
-    driver.quit()
+    # Optional /metrics endpoint and JSON run summary
+    server = metrics.start(config)
+    browsers = BrowserPool(partial(new_driver, config.get("browser"), config.get("chromedriver_path")), size=1)
+    try:
+        run(config, browsers, logger)
+    finally:
+        browsers.close()
+        metrics.finish(config, server)
 
 if __name__ == "__main__":
-    main()
+    main()
\ No newline at end of file
@@ -0,0 +1,143 @@
+# Description: Post-download integrity check. Runs ffprobe (and optionally a full decode) on each finished file in a process pool, checks duration, streams and container against the expected session, and stores the probe in the ledger.
+import os
+import json
+import shutil
+import logging
+import threading
+import subprocess
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from retry import CorruptOutput
+import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "workers": 2,
+    "min_seconds": 30,              # Anything shorter is not a session recording
+    "min_duration_ratio": 0.5,      # Of the scheduled length, when the source knows it
+    "decode": False,                # Decode every frame as well; catches corrupt packets, costs a full read
+    "timeout": 600,
+}
+
+AUDIO_EXTENSIONS = {".mp3", ".m4a", ".aac", ".opus", ".ogg"}
+
+
+def probe_file(path, decode=False, timeout=600):
+    # Runs in a worker process, so it only returns plain data
+    info = {"path": path, "size": os.path.getsize(path) if os.path.exists(path) else 0,
+            "format": None, "duration": 0.0, "streams": [], "errors": []}
+
+    try:
+        result = subprocess.run(["ffprobe", "-v", "error", "-show_format", "-show_streams", "-of", "json", path],
+                                capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        info["unverified"] = "ffprobe timed out"
+        return info
+    if result.returncode != 0:
+        info["errors"].append(result.stderr.strip() or f"ffprobe exited with {result.returncode}")
+        return info
+
+    data = json.loads(result.stdout or "{}")
+    container = data.get("format", {})
+    info["format"] = container.get("format_name")
+    info["duration"] = float(container.get("duration") or 0)
+    info["streams"] = [f"{s.get('codec_type')}:{s.get('codec_name')}" for s in data.get("streams", [])]
+    # With -v error anything on stderr is a demuxer error, e.g. a missing moov atom or a damaged header
+    info["errors"] += [line for line in result.stderr.splitlines() if line.strip()][:5]
+
+    if decode and not info["errors"]:
+        try:
+            result = subprocess.run(["ffmpeg", "-v", "error", "-i", path, "-f", "null", "-"],
+                                    capture_output=True, text=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            info["unverified"] = "decode timed out"
+            return info
+        info["errors"] += [line for line in result.stderr.splitlines() if line.strip()][:5]
+        if result.returncode != 0 and not info["errors"]:
+            info["errors"].append(f"ffmpeg decode exited with {result.returncode}")
+
+    return info
+
+
+def problems(info, job, settings):
+    found = list(info["errors"])
+    if info["size"] == 0:
+        found.append("empty file")
+    if info["duration"] < settings["min_seconds"]:
+        found.append(f"only {info['duration']:.0f}s long")
+
+    expected = job.get("expected_seconds")
+    if expected and info["duration"] < expected * settings["min_duration_ratio"]:
+        found.append(f"{info['duration']:.0f}s of an expected {expected:.0f}s")
+
+    kinds = {stream.split(":")[0] for stream in info["streams"]}
+    if "audio" not in kinds:
+        found.append("no audio stream")
+    if os.path.splitext(info["path"])[1].lower() not in AUDIO_EXTENSIONS and "video" not in kinds:
+        found.append("no video stream")
+    return found
+
+
+class Verifier:
+    def __init__(self, ledger=None, source=None, settings=None):
+        self.ledger = ledger
+        self.source = source
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _executor(self):
+        # Started on first use, so a run that never finishes a download starts no probe processes.
+        # Spawned rather than forked: a fork copies the ledger's SQLite handle and any lock a download thread holds.
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.settings["workers"],
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            return self.executor
+
+    def verify(self, job):
+        # Blocks the calling download worker until the probe is back; raises CorruptOutput on a bad file
+        try:
+            with metrics.stage(self.source, "verify"):
+                info = self._executor().submit(probe_file, job["output_path"], self.settings["decode"],
+                                               self.settings["timeout"]).result()
+        except BrokenProcessPool as e:
+            # A crashed probe worker says nothing about the file; start a new pool and let the download stand
+            logger.warning(f"Could not verify '{job['title']}', probe pool failed: {e}")
+            self.executor = None
+            return
+        if info.get("unverified"):
+            logger.warning(f"Could not verify '{job['title']}': {info['unverified']}")
+            return
+
+        found = problems(info, job, self.settings)
+        job["probe"] = {"duration": info["duration"], "format": info["format"], "streams": info["streams"]}
+
+        if self.ledger is not None:
+            self.ledger.record_probe(job["entry"]["title"], info, found, datetime.now().strftime("%Y-%m-%d"))
+        metrics.inc("scraper_verified_total", self.source, outcome="corrupt" if found else "ok")
+
+        if found:
+            raise CorruptOutput(f"{job['output_path']}: {'; '.join(found)}")
+        logger.info(f"Verified '{job['title']}': {info['duration'] / 60:.1f} min, {', '.join(info['streams'])}")
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+def make_verifier(config, ledger=None, source=None):
+    # None when switched off, or when ffprobe is missing (every download would otherwise fail verification)
+    settings = dict(DEFAULT_SETTINGS, **(config.get("verify") or {}))
+    if not settings["enabled"]:
+        return None
+    if shutil.which("ffprobe") is None:
+        logger.warning("ffprobe not found, downloads will not be verified")
+        return None
+    return Verifier(ledger, source, settings)
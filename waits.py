@@ -0,0 +1,102 @@
+# Description: Event-driven readiness waits that replace the fixed time.sleep calls, plus a tally of the wall time they saved.
+import time
+import threading
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+
+# Per-source timeouts in seconds, overridable with the "wait_timeout" config key
+TIMEOUTS = {
+    "north_dakota": 20,
+    "south_dakota": 15,
+    "us_congress": 15,
+    "west_virginia": 15,
+}
+DEFAULT_TIMEOUT = 15
+
+savings = {}    # source -> {"steps", "legacy", "actual"}
+savings_lock = threading.Lock()
+
+# Resolves once the page has finished loading and no new resource has started for quiet_ms
+NETWORK_IDLE_JS = """
+const quietMs = arguments[0], done = arguments[arguments.length - 1];
+let last = performance.getEntriesByType('resource').length, since = Date.now();
+const timer = setInterval(() => {
+    const now = performance.getEntriesByType('resource').length;
+    if (now !== last) { last = now; since = Date.now(); }
+    if (document.readyState === 'complete' && Date.now() - since >= quietMs) { clearInterval(timer); done(true); }
+}, 50);
+"""
+
+# Resolves once the DOM has gone quiet_ms without a mutation (Vue re-renders after a filter, etc.)
+DOM_SETTLED_JS = """
+const quietMs = arguments[0], done = arguments[arguments.length - 1];
+let timer = setTimeout(finish, quietMs);
+const observer = new MutationObserver(() => { clearTimeout(timer); timer = setTimeout(finish, quietMs); });
+observer.observe(document.body, {childList: true, subtree: true, characterData: true, attributes: true});
+function finish() { observer.disconnect(); done(true); }
+"""
+
+
+def configure(source, timeout):
+    TIMEOUTS[source] = timeout
+
+
+def timeout_for(source):
+    return TIMEOUTS.get(source, DEFAULT_TIMEOUT)
+
+
+def record(source, legacy_sleep, started):
+    with savings_lock:
+        tally = savings.setdefault(source, {"steps": 0, "legacy": 0.0, "actual": 0.0})
+        tally["steps"] += 1
+        tally["legacy"] += legacy_sleep
+        tally["actual"] += time.time() - started
+
+
+def wait_until(driver, condition, source, legacy_sleep=0, timeout=None):
+    # Return as soon as the condition holds; legacy_sleep is what the old code slept here, for the savings report
+    started = time.time()
+    try:
+        return WebDriverWait(driver, timeout or timeout_for(source), poll_frequency=0.1).until(condition)
+    finally:
+        record(source, legacy_sleep, started)
+
+
+def wait_for(driver, by, selector, source, legacy_sleep=0, clickable=False, timeout=None):
+    condition = EC.element_to_be_clickable((by, selector)) if clickable else EC.presence_of_element_located((by, selector))
+    return wait_until(driver, condition, source, legacy_sleep, timeout)
+
+
+def wait_for_all(driver, by, selector, source, legacy_sleep=0, timeout=None):
+    return wait_until(driver, EC.presence_of_all_elements_located((by, selector)), source, legacy_sleep, timeout)
+
+
+def _run_async(driver, script, quiet_ms, source, legacy_sleep, timeout):
+    started = time.time()
+    driver.set_script_timeout(timeout or timeout_for(source))
+    try:
+        driver.execute_async_script(script, quiet_ms)
+    except TimeoutException:
+        pass    # Pages that never go fully quiet (polling players) just use the whole timeout
+    finally:
+        record(source, legacy_sleep, started)
+
+
+def wait_for_network_idle(driver, source, legacy_sleep=0, quiet_ms=500, timeout=None):
+    _run_async(driver, NETWORK_IDLE_JS, quiet_ms, source, legacy_sleep, timeout)
+
+
+def wait_for_dom_settled(driver, source, legacy_sleep=0, quiet_ms=300, timeout=None):
+    _run_async(driver, DOM_SETTLED_JS, quiet_ms, source, legacy_sleep, timeout)
+
+
+def report_savings(logger, source=None):
+    with savings_lock:
+        tallies = {s: dict(t) for s, t in savings.items() if source is None or s == source}
+
+    for name, tally in tallies.items():
+        saved = tally["legacy"] - tally["actual"]
+        logger.info(f"[{name}] {tally['steps']} waits took {tally['actual']:.1f}s instead of "
+                    f"{tally['legacy']:.1f}s of fixed sleeps (saved {saved:.1f}s)")
+    return tallies
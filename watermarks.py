@@ -0,0 +1,111 @@
+# Description: Per-source crawl watermarks. Remembers the last fully-crawled date and a fingerprint of each listing page so daily runs only fetch what is new.
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return hashlib.sha256(content).hexdigest()
+
+
+def ranges_meet(first, second):
+    # Overlapping or back to back, so their union is one range
+    def day_after(date):
+        return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    return first[0] <= day_after(second[1]) and second[0] <= day_after(first[1])
+
+
+class Watermark:
+    def __init__(self, path, source):
+        self.path = path
+        self.source = source
+        self.lock = threading.Lock()
+        try:
+            with open(path, "r") as file:
+                self.state = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.state = {}
+        self.state.setdefault("source", source)
+        self.state.setdefault("last_complete_date", None)
+        self.state.setdefault("listings", {})
+
+    def effective_start(self, start_date, lookback_days=0):
+        # Resume the day after the last fully-crawled date, minus a few days to catch late uploads
+        last = self.state["last_complete_date"]
+        if not last:
+            return start_date
+        resume = datetime.strptime(last, "%Y-%m-%d") + timedelta(days=1 - lookback_days)
+        return max(start_date, resume.strftime("%Y-%m-%d"))
+
+    def mark_complete(self, end_date):
+        # Today is never complete: sessions still in progress are posted later
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        complete = min(end_date, yesterday)
+        with self.lock:
+            last = self.state["last_complete_date"]
+            if not last or complete > last:
+                self.state["last_complete_date"] = complete
+
+    def covers(self, url, start_date, end_date):
+        # Whether the rows of start_date..end_date on this listing were all handled when it was last recorded
+        covered = self.state["listings"].get(url, {}).get("covered")
+        return bool(covered and covered[0] <= start_date and end_date <= covered[1])
+
+    def conditional_headers(self, url, start_date=None, end_date=None):
+        # No validators for a range the listing was not read for: a 304 would hide rows that were never queued
+        listing = self.state["listings"].get(url, {})
+        headers = {}
+        if start_date and not self.covers(url, start_date, end_date):
+            return headers
+        if listing.get("etag"):
+            headers["If-None-Match"] = listing["etag"]
+        if listing.get("last_modified"):
+            headers["If-Modified-Since"] = listing["last_modified"]
+        return headers
+
+    def listing_unchanged(self, url, status=None, digest=None, start_date=None, end_date=None):
+        # A 304 or an identical content hash both mean nothing new was posted on this listing. For a listing that
+        # spans many dates, the requested range must also be one its rows were already handled for.
+        if start_date and not self.covers(url, start_date, end_date):
+            return False
+        if status == 304:
+            return True
+        listing = self.state["listings"].get(url)
+        return bool(listing and digest and listing.get("hash") == digest)
+
+    def update_listing(self, url, digest, headers=None, start_date=None, end_date=None):
+        # start_date..end_date: the dates whose rows were handled. An unchanged listing adds them to the range it
+        # already covers when the two meet; a changed one only covers what was just handled.
+        headers = headers or {}
+        with self.lock:
+            previous = self.state["listings"].get(url, {})
+            covered = [start_date, end_date] if start_date else None
+            old = previous.get("covered")
+            if covered and old and previous.get("hash") == digest and ranges_meet(old, covered):
+                covered = [min(old[0], start_date), max(old[1], end_date)]
+            self.state["listings"][url] = {
+                "hash": digest,
+                "etag": headers.get("etag"),
+                "last_modified": headers.get("last-modified"),
+                "covered": covered,
+                "checked": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            }
+
+    def save(self):
+        # Write to a temp file first so a crash never leaves a half-written watermark behind
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.state, file, indent=4)
+            os.replace(tmp_path, self.path)
+
+
+def load_watermark(config, source):
+    # None when incremental crawling is switched off, so callers can skip every watermark check
+    if not config.get("incremental") or not config.get("watermark_path"):
+        return None
+    return Watermark(config["watermark_path"], source)
@@ -5,19 +5,33 @@ import re
 import os
 import sys
 import logging
-import subprocess
+from functools import partial
 from datetime import datetime, timedelta
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
+from urllib.parse import urljoin
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-# from download_helper import move_to_s3
+from ledger import open_ledger, SUCCESS, FAILED, DUPLICATE
+from download_pool import make_job
+from storage import storage_key, media_filename
+from browser_pool import BrowserPool
+from browser import new_driver
+from fetcher import make_fetcher
+from waits import configure
+from watermarks import content_hash
+from crawl import crawl
+import profiles
+import ratelimit
+import metrics
+
+
+SOURCE_NAME = "west_virginia"
+CONFIG_PATH = "/config_wv.json"
+ARCHIVE_URL = "https://home.wvlegislature.gov/archived-recordings/"
 
 
 # Configuration functions
-def load_config():
-    config_path = "/config_wv.json"
+def load_config(config_path=CONFIG_PATH):
     with open(config_path, "r") as file:
         return json.load(file)
 
@@ -41,53 +55,7 @@ def setup_logging(log_path):
     return logging.getLogger()
 
 
-# Selenium setup
-def get_driver():
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.36"
-    options = webdriver.ChromeOptions()
-    options.add_argument(f"user-agent={user_agent}")
-    # options.add_argument("--headless = new")  # Uncomment for headless operation
-    options.add_argument("--disable-gpu")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument('--ignore-certificate-errors')
-    # maximize window
-    options.add_argument("--start-maximized")
-    options.add_experimental_option("excludeSwitches", ["enable-automation"])
-    options.add_experimental_option("useAutomationExtension", False)
-    
-    # Set performance logging capabilities directly on the options
-    options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
-    
-    # Setting up Chrome WebDriver
-    service = Service(path="/chromedriver-mac-arm64")
-    driver = webdriver.Chrome(service=service, options=options)
-
-    driver.execute_cdp_cmd("Network.enable", {})  # Enable network logging
-    driver.execute_cdp_cmd("Network.setUserAgentOverride", {"userAgent": user_agent})
-    driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {
-        "source": "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-    })
-
-    return driver
-
-
 # Helper functions
-def append_to_json(entry, respective_path):
-    # Load existing data or start a new list
-    try:
-        with open(respective_path, "r") as file:
-            event_list = json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        event_list = []
-
-    # Append the new entry to the list
-    event_list.append(entry)
-
-    # Save the updated list back to the file
-    with open(respective_path, "w") as file:
-        json.dump(event_list, file, indent=4)
-
-
 def format_date(audio_date):
     # Remove the 'th' (or 'st', 'nd', 'rd') using regex
     clean_date = re.sub(r'(\d+)(st|nd|rd|th)', r'\1', audio_date)
@@ -132,18 +100,35 @@ def get_date_range(start_date, end_date):
 
 
 # Main scraping function
-def download_video(driver, download_dir, start_date, end_date, success_path, failed_path, logger):
+def download_video(fetcher, pool, download_dir, start_date, end_date, ledger, logger, watermark=None, archive_url=ARCHIVE_URL):
     date_list = get_date_range(start_date, end_date)    # Get date range
     current_date = datetime.now().strftime("%Y-%m-%d")
 
-    driver.get("https://home.wvlegislature.gov/archived-recordings/")
-    time.sleep(3)
-    
-    # Get audio urls from the audio cards
-    main_content = driver.find_element(By.CSS_SELECTOR, "tbody")
-    audio_urls = [a.get_attribute("src") for a in main_content.find_elements(By.CSS_SELECTOR, "tr source")]
-    audio_titles = [a.text for a in main_content.find_elements(By.CSS_SELECTOR, "tr td:nth-child(2)")]
-    audio_dates = [a.text for a in main_content.find_elements(By.CSS_SELECTOR, "tr td div:nth-child(1)")]
+    page = fetcher.fetch(archive_url, ready=lambda p: p.root.find("tbody") is not None,
+                         headers=watermark.conditional_headers(archive_url, start_date, end_date) if watermark else None)
+    if watermark and page.status == 304:
+        logger.info("Archived recordings have not changed since the last run. Skipping.")
+        return
+
+    # Get audio urls from the audio cards, one row at a time so the three lists stay aligned
+    audio_urls, audio_titles, audio_dates = [], [], []
+    with metrics.stage(SOURCE_NAME, "listing_parse"):
+        main_content = page.root.find("tbody")
+        for tr in main_content.find_all("tr"):
+            source = tr.find("source")
+            cells = [td for td in tr.elements() if td.tag == "td"]
+            date_divs = [div for td in cells for div in td.find_all("div") if div.parent.elements()[0] is div]
+            if source is None or len(cells) < 2 or not date_divs:
+                continue
+            audio_urls.append(urljoin(page.url, source.get("src")))
+            audio_titles.append(cells[1].text())
+            audio_dates.append(date_divs[0].text())
+
+    # Fingerprint the rows rather than the raw page, which carries per-request tokens
+    digest = content_hash("\n".join(audio_urls + audio_titles + audio_dates))
+    if watermark and watermark.listing_unchanged(archive_url, digest=digest, start_date=start_date, end_date=end_date):
+        logger.info("Archived recordings have not changed since the last run. Skipping.")
+        return
 
     for i in range(len(audio_dates)):
         audio_date = format_date(audio_dates[i])   # Get specific audio date from audio cards
@@ -158,86 +143,116 @@ def download_video(driver, download_dir, start_date, end_date, success_path, fai
                 "last_attempted_scrape_date": current_date
             }            
                             
-            with open(success_path, "r") as file:
-                success_list = json.load(file)
-
-            # Check if the title already exists in success_list
-            title_exists = any(existing_event["title"] == entry["title"] for existing_event in success_list)
+            # Check if the title already exists in the ledger
+            title_exists = ledger.is_downloaded(entry["title"])
 
             if title_exists:
                 logger.info(f"The event '{entry['title']}' has already been downloaded. Skipping download.")
 
             else:
-                logger.info(f"Downloading event '{entry['title']}'...")            
-                try:
-                    start_time = time.time()
-                    # Download audio using yt-dlp.
-                    ytdlp_command = [
-                        "yt-dlp",
-                        "-f", "best",
-                        "-o", f"{download_dir}{formatted_title}.mp3",
-                        audio_urls[i]
-                    ]
-                    subprocess.run(ytdlp_command)
-
-                    # Determining Session type
-                    if "committee" in audio_titles[i].lower():
-                        session_type = "committee"
-                    elif "hearing" in audio_titles[i].lower():
-                        session_type = "hearing"
-                    else:
-                        session_type = "session"     # default 
-
-                    # move_to_s3("west virginia", formatted_title, category="house", session_type, url=audio_urls[i]) 
-
-                    # Updating the success list
-                    append_to_json(entry, success_path)
-
-                    logger.info(f"Audio downloaded successfully! -> {formatted_title}")
-
-                    end_time = time.time()
-                    time_taken = (end_time - start_time)/60
-                    logger.info(f"Time taken to download audio: {time_taken:.2f} min")
-                
-                except subprocess.CalledProcessError as e:
-                    entry = {
-                        "title": formatted_title,
-                        "recorded_date": audio_date,
-                        "link": audio_urls[i],
-                        "last_attempted_scrape_date": current_date
-                    }
-                    append_to_json(entry, failed_path)              
-                    logger.info(f"Error downloading audio: {e}")
-                    logger.info(f"Failed to download audio! -> {formatted_title}")
+                logger.info(f"Queueing event '{entry['title']}'...")
+                profile = profiles.profile_for(SOURCE_NAME)
+                filename = media_filename(formatted_title, profiles.output_extension(profile, "mp3"))
+                # With a transcoding profile the download lands next to the final file and is converted afterwards
+                fields = profiles.job_fields(profile, f"{download_dir}{filename}", "mp3")
+                # Download audio using yt-dlp.
+                ytdlp_command = [
+                    "yt-dlp",
+                    "-f", profiles.ytdlp_format(profile),
+                    "-o", fields.get("source_path", f"{download_dir}{filename}"),
+                    audio_urls[i]
+                ]
+
+                # Determining Session type
+                if "committee" in audio_titles[i].lower():
+                    session_type = "committee"
+                elif "hearing" in audio_titles[i].lower():
+                    session_type = "hearing"
+                else:
+                    session_type = "session"     # default 
+
+                # Same download written to stdout, used when the output streams straight into storage
+                stream_command = ["yt-dlp", "-f", profiles.ytdlp_format(profile), "-o", "-", audio_urls[i]]
+
+                pool.submit(make_job(formatted_title, audio_urls[i], f"{download_dir}{filename}",
+                                     ytdlp_command, entry=entry, category="house", session_type=session_type,
+                                     storage_key=storage_key(SOURCE_NAME, "house", session_type, filename),
+                                     stream_command=stream_command, engine="ytdlp", format=profiles.ytdlp_format(profile),
+                                     **fields))
         else:
             continue
 
+    # Only remember the listing once every row on it has been handled
+    if watermark:
+        watermark.update_listing(archive_url, digest, page.headers, start_date, end_date)
+
+
+# Download callbacks
+def record_success(job, ledger, logger):
+    # Updating the success list
+    ledger.record(job["entry"], SUCCESS, source=SOURCE_NAME)
+
+    logger.info(f"Audio downloaded successfully! -> {job['title']}")
+    logger.info(f"Time taken to download audio: {job['elapsed'] / 60:.2f} min")
+
+
+def record_failure(job, error, ledger, logger):
+    ledger.record(job["entry"], FAILED, source=SOURCE_NAME)
+    ledger.save_failed_job(job, source=SOURCE_NAME)     # Kept for a replay without re-crawling
+    logger.info(f"Error downloading audio: {error}")
+    logger.info(f"Failed to download audio! -> {job['title']}")
+
+
+def record_duplicate(job, owner, ledger, logger):
+    ledger.record(job["entry"], DUPLICATE, source=SOURCE_NAME)
+    logger.info(f"Skipped audio already stored as '{owner}' -> {job['title']}")
+
+
+# Source entry point used by runner.py and main()
+def run(config, browsers, logger, pool=None):
+    configure(SOURCE_NAME, config.get("wait_timeout", 15))
+    ratelimit.configure(config.get("rate_limits"))    # Adds this source's hosts to the shared limiter
+    profiles.configure(SOURCE_NAME, config)
+
+    # Open the download ledger (imports the old JSON lists on first run)
+    ledger = open_ledger(config["ledger_path"], config["success_download_json_path"],
+                         config["failed_download_json_path"], source=SOURCE_NAME)
+
+    # Initialize the page fetcher (plain HTTP, webdriver only as fallback) and the download workers
+    fetcher = make_fetcher(browsers, SOURCE_NAME, settle=3, use_http=config.get("http_fast_path", True))
+    with crawl(config, SOURCE_NAME, ledger, logger, pool,
+               on_success=partial(record_success, ledger=ledger, logger=logger),
+               on_failure=partial(record_failure, ledger=ledger, logger=logger),
+               on_duplicate=partial(record_duplicate, ledger=ledger, logger=logger)) as run_state:
+        # Run the main scraping function
+        try:
+            download_video(fetcher, run_state.pool, config["output_path"], run_state.start_date, config["end_date"],
+                           ledger, logger, run_state.watermark, config.get("archive_url", ARCHIVE_URL))
+            run_state.complete(config["end_date"])
+        finally:
+            # Release the browser first, downloads keep running until the queue drains
+            fetcher.close()
+    logger.info(f"Finished downloading all videos for given range of dates.")
+
 
 # Main execution
 def main():
     # Load configuration
     config = load_config()
-    download_dir = config["output_path"]
-    start_date = config["start_date"]
-    end_date = config["end_date"]
-    failed_path = config["failed_download_json_path"]
-    success_path = config["success_download_json_path"]
-    log_path = config["log_path"]
-    
+
     # Set up logging
-    logger = setup_logging(log_path)
+    logger = setup_logging(config["log_path"])
     logger.info("Starting West Virginia Assembly audio scraper")
-    
-    # Initialize webdriver
-    driver = get_driver()
-    
-    # Run the main scraping function
-    download_video(driver, download_dir, start_date, end_date, success_path, failed_path, logger)
-    logger.info(f"Finished downloading all videos for given range of dates.")
-    
-    # Clean up
-    driver.quit()
+
+    # Optional /metrics endpoint and JSON run summary
+    server = metrics.start(config)
+    browsers = BrowserPool(partial(new_driver, config.get("browser"), config.get("chromedriver_path")), size=1)
+    try:
+        run(config, browsers, logger)
+    finally:
+        browsers.close()
+        metrics.finish(config, server)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,150 @@
+# Description: In-process yt-dlp engine. Long-lived worker processes each keep one YoutubeDL instance (cookies, extractor and player-JS caches, HTTP connections) across jobs, and report progress back through callbacks instead of console output.
+import time
+import logging
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from http_client import HttpError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "enabled": True,
+    "workers": 4,
+    "jobs_per_worker": 200,     # Recycle a worker process after this many jobs, in case an extractor leaks
+    "cookiefile": None,
+    "options": {},              # Passed to YoutubeDL as is
+}
+
+PROGRESS_INTERVAL = 1.0     # Seconds between progress events from a worker
+
+
+class DownloadFailed(Exception):
+    # yt-dlp gave up on a job for a reason other than an HTTP status
+    pass
+
+
+# Worker process state, set up once by _init_worker
+_ydl = None
+_selectors = {}
+_events = None
+_current = {"job_id": None, "last": 0.0}    # A worker runs one job at a time
+
+
+def _progress_hook(status):
+    now = time.monotonic()
+    if status["status"] == "downloading" and now - _current["last"] < PROGRESS_INTERVAL:
+        return
+    _current["last"] = now
+    _events.put((_current["job_id"], status["status"], status.get("downloaded_bytes") or 0,
+                 status.get("total_bytes") or status.get("total_bytes_estimate") or 0, status.get("speed") or 0))
+
+
+def _init_worker(options, events):
+    global _ydl, _events
+    import yt_dlp
+
+    _events = events
+    _ydl = yt_dlp.YoutubeDL(options)
+    _ydl.add_progress_hook(_progress_hook)
+
+
+def _run(job_id, url, output_path, format_spec):
+    # Runs in a worker process; only plain data goes back to the parent
+    from yt_dlp.utils import DownloadError
+
+    # Format selectors are compiled once per spec; the output template is the literal path, so escape it
+    if format_spec not in _selectors:
+        _selectors[format_spec] = _ydl.build_format_selector(format_spec)
+    _ydl.format_selector = _selectors[format_spec]
+    _ydl.params["outtmpl"]["default"] = output_path.replace("%", "%%")
+
+    _current.update(job_id=job_id, last=0.0)
+    try:
+        _ydl.download([url])
+    except DownloadError as e:
+        cause = e.exc_info[1] if e.exc_info else None
+        status = getattr(cause, "status", None) or getattr(cause, "code", None)
+        return {"error": str(e), "status": status if isinstance(status, int) else None}
+    return {"error": None}
+
+
+class YtdlpEngine:
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.options = dict(quiet=True, noprogress=True, no_color=True, noplaylist=True, continuedl=True,
+                            **self.settings["options"])
+        if self.settings["cookiefile"]:
+            self.options["cookiefile"] = self.settings["cookiefile"]
+
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.listeners = {}     # Job id -> progress callback
+        self.executor = None
+        self.lock = threading.Lock()
+        self.reader = threading.Thread(target=self._read_events, name="ytdlp-progress", daemon=True)
+        self.reader.start()
+
+    def _executor(self):
+        # Started on first use; each worker imports yt-dlp once in _init_worker and keeps it warm between jobs.
+        # The progress queue comes from the same spawn context (see __init__), so it can be passed to the workers.
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.settings["workers"], mp_context=self.context,
+                                                    initializer=_init_worker, initargs=(self.options, self.events),
+                                                    max_tasks_per_child=self.settings["jobs_per_worker"])
+            return self.executor
+
+    def _read_events(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            callback = self.listeners.get(event[0])
+            if callback is not None:
+                try:
+                    callback(*event[1:])
+                except Exception as e:
+                    logger.exception(f"Progress callback failed: {e}")
+
+    def download(self, job, output_path, progress=None):
+        # Blocks the calling download worker until the file is written; progress(status, done, total, speed)
+        job_id = f"{output_path}:{id(job)}"
+        if progress is not None:
+            self.listeners[job_id] = progress
+        try:
+            result = self._executor().submit(_run, job_id, job["url"], output_path,
+                                             job.get("format", "best")).result()
+        except BrokenProcessPool:
+            # A crashed worker takes the pool down; the next job starts a new one
+            with self.lock:
+                self.executor = None
+            raise
+        finally:
+            self.listeners.pop(job_id, None)
+
+        if result["error"]:
+            if result["status"]:
+                raise HttpError(result["status"], job["url"])
+            raise DownloadFailed(result["error"])
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        self.events.put(None)
+        self.reader.join()
+
+
+def make_ytdlp_engine(config):
+    # None when switched off or yt_dlp is not installed; jobs then run their yt-dlp command line
+    settings = dict(DEFAULT_SETTINGS, **(config.get("ytdlp") or {}))
+    if not settings["enabled"]:
+        return None
+    if importlib.util.find_spec("yt_dlp") is None:
+        logger.warning("yt_dlp module not found, downloads will start the yt-dlp command instead")
+        return None
+    return YtdlpEngine(settings)